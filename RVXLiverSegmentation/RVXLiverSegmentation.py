@@ -9,7 +9,8 @@ from RVXLiverSegmentationLib import RVXLiverSegmentationLogic, Settings, DataWid
   SegmentWidget, PortalVesselWidget, IVCVesselWidget, PortalVesselEditWidget, IVCVesselEditWidget, createButton, \
   resourcesPath
 from RVXLiverSegmentationTest import RVXLiverSegmentationTestCase, VesselBranchTreeTestCase, \
-  ExtractVesselStrategyTestCase, VesselBranchWizardTestCase, VesselSegmentEditWidgetTestCase
+  ExtractVesselStrategyTestCase, VesselBranchWizardTestCase, VesselSegmentEditWidgetTestCase, \
+  VoxelSkeletonCenterlineTestCase, MinimalPathCenterlineTestCase, VesselTreeModelTestCase
 
 
 class RVXLiverSegmentation(ScriptedLoadableModule):
@@ -445,7 +446,8 @@ class RVXLiverSegmentationTest(ScriptedLoadableModuleTest):
 
     # Gather tests for the plugin and run them in a test suite
     testCases = [RVXLiverSegmentationTestCase, VesselBranchTreeTestCase, VesselBranchWizardTestCase,
-                 ExtractVesselStrategyTestCase, VesselSegmentEditWidgetTestCase]
+                 ExtractVesselStrategyTestCase, VesselSegmentEditWidgetTestCase, VoxelSkeletonCenterlineTestCase,
+                 MinimalPathCenterlineTestCase, VesselTreeModelTestCase]
 
     suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(case) for case in testCases])
     unittest.TextTestRunner(verbosity=3).run(suite)
@@ -1,30 +1,72 @@
+from collections import OrderedDict
+import heapq
+from itertools import combinations
+
+import numpy as np
 import slicer
+import vtk
 
 from RVXLiverSegmentationLib import removeNodeFromMRMLScene
 from .RVXLiverSegmentationLogic import RVXLiverSegmentationLogic
-from .RVXLiverSegmentationUtils import getMarkupIdPositionDictionary, createLabelMapVolumeNodeBasedOnModel
+from .RVXLiverSegmentationUtils import getMarkupIdPositionDictionary, createLabelMapVolumeNodeBasedOnModel, \
+  arrayFromVTKMatrix
+from .VesselBranchWizard import VeinId
+from .VesselTreeModel import preorderNodeIds, branchChains
+
+
+class NodePositionTable(object):
+  """Read only table of node positions shared by the VesselSeedPoints constructed from the same node positions.
+
+  Positions are stored as one N x 3 array with a node id to row index dictionary.
+  """
+  __slots__ = ("nodeIds", "rowIndex", "positions")
+
+  def __init__(self, idPositionDict):
+    """
+    Parameters
+    ----------
+    idPositionDict: Dict[str, List[Float]]
+      Dictionary with nodeId as key and node position as value
+    """
+    self.nodeIds = list(idPositionDict.keys())
+    self.rowIndex = {nodeId: i for i, nodeId in enumerate(self.nodeIds)}
+    self.positions = np.array([idPositionDict[nodeId] for nodeId in self.nodeIds])
+    self.positions.setflags(write=False)
+
+  @classmethod
+  def of(cls, idPositionDict):
+    """
+    Returns
+    -------
+    NodePositionTable
+      Input if it already is a table, table constructed from the input dictionary otherwise
+    """
+    return idPositionDict if isinstance(idPositionDict, NodePositionTable) else cls(idPositionDict)
+
+  def rows(self, pointIds):
+    return [self.rowIndex[pointId] for pointId in pointIds]
 
 
 class VesselSeedPoints(object):
   """Helper class containing the different seed points to use for vessel VMTK extraction.
+
+  Seed points only hold the list of the row indices of their points in a shared NodePositionTable. Appending a point
+  is amortized constant time. Copy, combine and comparisons are proportional to the number of seed points and don't
+  duplicate the node positions.
   """
+  __slots__ = ("_table", "_rows")
 
   def __init__(self, idPositionDict, pointIdList=None):
     """
     Parameters
     ----------
-    idPositionDict: Dict[str, List[Float]]
-      Dictionary with nodeId as key and node position as value
+    idPositionDict: Dict[str, List[Float]] or NodePositionTable
+      Dictionary with nodeId as key and node position as value or table shared with other seed points
     pointIdList: List[str] or None
       List of points to add to the vessel seed points
     """
-    self._idPositionDict = idPositionDict
-    self._pointList = []
-    self._pointIdList = []
-
-    if pointIdList is not None:
-      for pointId in pointIdList:
-        self.appendPoint(pointId)
+    self._table = NodePositionTable.of(idPositionDict)
+    self._rows = self._table.rows(pointIdList if pointIdList is not None else [])
 
   def appendPoint(self, pointId):
     """Adds input point id to the current seed list.
@@ -33,11 +75,16 @@ class VesselSeedPoints(object):
     ----------
     pointId: str - Id of the point to add to list
     """
-    self._pointIdList.append(pointId)
-    self._pointList.append(self._idPositionDict[pointId])
+    self._rows.append(self._table.rowIndex[pointId])
 
   def isValid(self):
-    return len(self._pointList) > 1
+    return len(self._rows) > 1
+
+  def _positions(self):
+    return self._table.positions[self._rows].tolist()
+
+  def _pointIds(self):
+    return [self._table.nodeIds[row] for row in self._rows]
 
   def getSeedPositions(self):
     """
@@ -45,7 +92,7 @@ class VesselSeedPoints(object):
     -------
     List[List[float]] - List containing all the nodes before last in the seed list if valid else empty list.
     """
-    return self._pointList[:-1] if self.isValid() else []
+    return self._table.positions[self._rows[:-1]].tolist() if self.isValid() else []
 
   def getStopperPositions(self):
     """
@@ -53,17 +100,16 @@ class VesselSeedPoints(object):
     -------
     List[List[float]] - List containing last node position in the seed list if valid else empty list.
     """
-    return [self._pointList[-1]] if self.isValid() else []
+    return self._table.positions[self._rows[-1:]].tolist() if self.isValid() else []
 
   def copy(self):
     """
     Returns
     -------
-    VesselSeedPoints - Deep copy of current object
+    VesselSeedPoints - Copy of current object sharing the same position table
     """
-    copy = VesselSeedPoints(self._idPositionDict.copy())
-    copy._pointIdList = list(self._pointIdList)
-    copy._pointList = list(self._pointList)
+    copy = VesselSeedPoints(self._table)
+    copy._rows = list(self._rows)
     return copy
 
   @staticmethod
@@ -93,9 +139,9 @@ class VesselSeedPoints(object):
     if not first.isValid() or not second.isValid() or first.lastPointId() != second.firstPointId():
       raise ValueError("Cannot combine vessel seed points %s and %s" % (first, second))
 
-    combined = first.copy()
-    combined._pointList += second._pointList[1:]
-    combined._pointIdList += second._pointIdList[1:]
+    secondRows = second._rows[1:] if second._table is first._table else first._table.rows(second._pointIds()[1:])
+    combined = VesselSeedPoints(first._table)
+    combined._rows = first._rows + secondRows
     return combined
 
   def firstPointId(self):
@@ -105,7 +151,7 @@ class VesselSeedPoints(object):
     str or None
       First point id in the vessel seeds
     """
-    return self._pointIdList[0] if self.isValid() else None
+    return self._table.nodeIds[self._rows[0]] if self.isValid() else None
 
   def lastPointId(self):
     """
@@ -114,25 +160,44 @@ class VesselSeedPoints(object):
     str or None
       Last point is in the vessel seeds
     """
-    return self._pointIdList[-1] if self.isValid() else None
+    return self._table.nodeIds[self._rows[-1]] if self.isValid() else None
+
+  def getPointIds(self):
+    return self._pointIds()
+
+  def getEdgeIds(self):
+    """
+    Returns
+    -------
+    List[Tuple[str, str]]
+      Consecutive [parentId, childId] pairs covered by the vessel seeds
+    """
+    pointIds = self._pointIds()
+    return list(zip(pointIds[:-1], pointIds[1:]))
 
   def __repr__(self):
-    return str(self._pointIdList)
+    return str(self._pointIds())
 
   def __eq__(self, other):
     if not isinstance(other, VesselSeedPoints):
       return False
-    else:
-      return (self._pointIdList, self._pointList) == (other._pointIdList, other._pointList)
+    if len(self._rows) != len(other._rows):
+      return False
+    if self._table is other._table:
+      return self._rows == other._rows
+    return (self._pointIds(), self._positions()) == (other._pointIds(), other._positions())
 
   def __ne__(self, other):
     return not self == other
 
+  def _comparisonKey(self):
+    return self._positions() if self.isValid() else []
+
   def __le__(self, other):
-    return self.getSeedPositions() + self.getStopperPositions() <= other.getSeedPositions() + other.getStopperPositions()
+    return self._comparisonKey() <= other._comparisonKey()
 
   def __lt__(self, other):
-    return self.getSeedPositions() + self.getStopperPositions() < other.getSeedPositions() + other.getStopperPositions()
+    return self._comparisonKey() < other._comparisonKey()
 
   def __ge__(self, other):
     return not self.__lt__(other)
@@ -143,15 +208,52 @@ class VesselSeedPoints(object):
 
 class IExtractVesselStrategy(object):
   """Interface object for vessel volume extraction from source vessel branch tree and associated markup.
+
+  If keepBranchLabels is set, the strategy will also construct a label map where each voxel holds the label of the
+  branch which claimed it. This label map can be accessed after extraction using getBranchLabelMap.
   """
 
+  def __init__(self):
+    self.keepBranchLabels = False
+    self._branchLabelMap = None
+
+  def getBranchLabelMap(self):
+    """
+    Returns
+    -------
+    Tuple[vtkMRMLLabelMapVolumeNode, Dict[str, int]] or None
+      Branch label map constructed during last extraction and dictionary of branch name to label value.
+      None if keepBranchLabels was not set during last extraction.
+    """
+    return self._branchLabelMap
+
+  def _updateBranchLabelMap(self, vesselBranchTree, idPositionDict, volumes, volumesEdges):
+    """Constructs the branch label map from the extracted volumes if keepBranchLabels is set.
+
+    Parameters
+    ----------
+    vesselBranchTree: VesselTreeModel
+    idPositionDict: Dict[str,List[float]]
+    volumes: List[vtkMRMLLabelMapVolumeNode]
+      Volumes extracted during the level set runs
+    volumesEdges: List[List[Tuple[str, str]]]
+      [parentId, childId] pairs used as seeds for each of the extracted volumes
+    """
+    self._branchLabelMap = None
+    if not self.keepBranchLabels:
+      return
+
+    edgeLabels = branchLabelNames(vesselBranchTree, [edge for edges in volumesEdges for edge in edges])
+    self._branchLabelMap = mergeVolumesAsBranchLabels(volumes, volumesEdges, idPositionDict, edgeLabels,
+                                                      "levelSetSegmentationBranches")
+
   def extractVesselVolumeFromVesselBranchTree(self, vesselBranchTree, vesselBranchMarkup, logic):
     """Extract vessel volume and model from input data.
     The data are expected to be unchanged when the algorithm has run.
 
     Parameters
     ----------
-    vesselBranchTree: VesselBranchTree
+    vesselBranchTree: VesselTreeModel
       Tree containing the hierarchy of the markups
     vesselBranchMarkup: vtkMRMLMarkupsFiducialNode
       Markup containing all the vessel branches
@@ -191,6 +293,350 @@ def mergeVolumes(volumes, volName):
   return outVol, RVXLiverSegmentationLogic.createVolumeBoundaryModel(outVol, volName + "Model", threshold=1)
 
 
+def branchLabelNames(vesselBranchTree, edges):
+  """Associates each [parentId, childId] edge with the name of the branch it belongs to.
+
+  An edge belongs to the branch named after its child node. Nodes inserted by the user before a branch node do not have
+  a branch name and are associated with the first named node found down their chain of single children.
+
+  Parameters
+  ----------
+  vesselBranchTree: VesselTreeModel
+  edges: List[Tuple[str, str]]
+
+  Returns
+  -------
+  Dict[Tuple[str, str], str]
+  """
+  branchNames = set(VeinId().sortedIds())
+  edgeLabels = {}
+  for parentId, childId in edges:
+    nodeId = childId
+    while nodeId not in branchNames and len(vesselBranchTree.getChildrenNodeId(nodeId)) == 1:
+      nodeId = vesselBranchTree.getChildrenNodeId(nodeId)[0]
+    edgeLabels[(parentId, childId)] = nodeId if nodeId in branchNames else childId
+  return edgeLabels
+
+
+def labelVoxelsByNearestBranch(masks, ijkToRas, masksEdges, idPositionDict, edgeLabelValues):
+  """Labels every voxel claimed by at least one mask with the label of the nearest edge amongst the edges of the masks
+  claiming it.
+
+  Parameters
+  ----------
+  masks: List[np.ndarray]
+    Boolean arrays in KJI order, all with the same shape
+  ijkToRas: np.ndarray
+    4x4 IJK to RAS matrix of the masks
+  masksEdges: List[List[Tuple[str, str]]]
+    [parentId, childId] pairs associated with each mask
+  idPositionDict: Dict[str,List[float]]
+    Dictionary with nodeId as key and node position as value
+  edgeLabelValues: Dict[Tuple[str, str], int]
+    Label value of each edge
+
+  Returns
+  -------
+  np.ndarray
+    int32 label array with the same shape as the input masks
+  """
+  union = np.zeros(masks[0].shape, dtype=bool)
+  for mask in masks:
+    union |= mask
+
+  kji = np.nonzero(union)
+  ijk = np.stack([kji[2], kji[1], kji[0], np.ones_like(kji[0])])
+  rasPoints = np.dot(ijkToRas, ijk)[:3].T
+
+  minDistance = np.full(len(rasPoints), np.inf)
+  voxelLabels = np.zeros(len(rasPoints), dtype="int32")
+  for mask, edges in zip(masks, masksEdges):
+    claimedIds = np.nonzero(mask[kji])[0]
+    for edge in edges:
+      distance = _distanceToSegment(rasPoints[claimedIds], idPositionDict[edge[0]], idPositionDict[edge[1]])
+      isCloser = distance < minDistance[claimedIds]
+      minDistance[claimedIds[isCloser]] = distance[isCloser]
+      voxelLabels[claimedIds[isCloser]] = edgeLabelValues[edge]
+
+  labels = np.zeros(masks[0].shape, dtype="int32")
+  labels[kji] = voxelLabels
+  return labels
+
+
+def _distanceToSegment(points, start, end):
+  """Returns the distance of each point in points to the [start, end] segment"""
+  start, end = np.asarray(start, dtype=float), np.asarray(end, dtype=float)
+  segment = end - start
+  segmentSquaredLength = np.dot(segment, segment)
+  if segmentSquaredLength > 0:
+    t = np.clip(np.dot(points - start, segment) / segmentSquaredLength, 0, 1)
+  else:
+    t = np.zeros(len(points))
+  return np.linalg.norm(points - (start + t[:, np.newaxis] * segment), axis=1)
+
+
+def mergeVolumesAsBranchLabels(volumes, volumesEdges, idPositionDict, edgeLabels, volName):
+  """Merges volumes nodes into a single label map volume node where each voxel holds the label of the branch which
+  claimed it. Voxels claimed by multiple branches are attributed to the branch whose segment is the nearest.
+
+  Parameters
+  ----------
+  volumes: List[vtkMRMLVolumeNode]
+  volumesEdges: List[List[Tuple[str, str]]]
+    [parentId, childId] pairs used as seeds for each volume
+  idPositionDict: Dict[str,List[float]]
+  edgeLabels: Dict[Tuple[str, str], str]
+    Branch name associated with each edge
+  volName: str
+
+  Returns
+  -------
+  Tuple[vtkMRMLLabelMapVolumeNode, Dict[str, int]]
+    Label map volume and dictionary of branch name to label value
+  """
+  # Label values follow the standard branch order. Non standard branch names are added at the end
+  sortedNames = [name for name in VeinId().sortedIds() if name in edgeLabels.values()]
+  sortedNames += sorted(set(edgeLabels.values()) - set(sortedNames))
+  labelValues = {name: i + 1 for i, name in enumerate(sortedNames)}
+  edgeLabelValues = {edge: labelValues[name] for edge, name in edgeLabels.items()}
+
+  ijkToRas = vtk.vtkMatrix4x4()
+  volumes[0].GetIJKToRASMatrix(ijkToRas)
+  masks = [slicer.util.arrayFromVolume(volume) > 0 for volume in volumes]
+  labels = labelVoxelsByNearestBranch(masks, arrayFromVTKMatrix(ijkToRas), volumesEdges, idPositionDict,
+                                      edgeLabelValues)
+
+  outVol = createLabelMapVolumeNodeBasedOnModel(volumes[0], volName)
+  slicer.util.updateVolumeFromArray(outVol, labels)
+  return outVol, labelValues
+
+
+class VesselSeedCluster(object):
+  """Group of VesselSeedPoints extracted by one VMTK run and RAS box containing the group points. The box voxel count
+  is used as the cost of the run.
+  """
+  __slots__ = ("vesselSeedsList", "lower", "upper")
+
+  def __init__(self, vesselSeedsList, lower, upper):
+    """
+    Parameters
+    ----------
+    vesselSeedsList: List[VesselSeedPoints]
+    lower: np.ndarray
+      Lower RAS corner of the cluster box
+    upper: np.ndarray
+      Upper RAS corner of the cluster box
+    """
+    self.vesselSeedsList = vesselSeedsList
+    self.lower = lower
+    self.upper = upper
+
+  @classmethod
+  def fromVesselSeeds(cls, vesselSeeds, margin):
+    """
+    Returns
+    -------
+    VesselSeedCluster
+      Cluster containing the input seeds only with the seeds bounding box expanded by margin
+    """
+    positions = np.array(vesselSeeds.getSeedPositions() + vesselSeeds.getStopperPositions(), dtype=float)
+    return cls([vesselSeeds], positions.min(axis=0) - margin, positions.max(axis=0) + margin)
+
+  def overlaps(self, other):
+    return bool(np.all(self.lower <= other.upper) and np.all(other.lower <= self.upper))
+
+  def merge(self, other):
+    return VesselSeedCluster(self.vesselSeedsList + other.vesselSeedsList, np.minimum(self.lower, other.lower),
+                             np.maximum(self.upper, other.upper))
+
+  def voxelCount(self, spacing):
+    """
+    Returns
+    -------
+    int
+      Number of voxels of the cluster box for the input voxel spacing
+    """
+    return int(np.prod(np.ceil((self.upper - self.lower) / np.abs(spacing))))
+
+  def getSeedPositions(self):
+    return [position for vesselSeeds in self.vesselSeedsList for position in vesselSeeds.getSeedPositions()]
+
+  def getStopperPositions(self):
+    """
+    Returns
+    -------
+    List[List[float]]
+      Last position of the seeds which don't continue with other seeds of the cluster
+    """
+    firstIds = {vesselSeeds.firstPointId() for vesselSeeds in self.vesselSeedsList}
+    return [position for vesselSeeds in self.vesselSeedsList if vesselSeeds.lastPointId() not in firstIds
+            for position in vesselSeeds.getStopperPositions()]
+
+  def getEdgeIds(self):
+    return [edge for vesselSeeds in self.vesselSeedsList for edge in vesselSeeds.getEdgeIds()]
+
+  def isChainedWith(self, other):
+    """
+    Returns
+    -------
+    bool
+      True if a seed of one cluster starts at the last point of a seed of the other cluster. The stopper of the first
+      seed is dropped by getStopperPositions if both clusters are merged.
+    """
+    return self._continuesIn(other) or other._continuesIn(self)
+
+  def _continuesIn(self, other):
+    otherFirstIds = {vesselSeeds.firstPointId() for vesselSeeds in other.vesselSeedsList}
+    return any(vesselSeeds.lastPointId() in otherFirstIds for vesselSeeds in self.vesselSeedsList)
+
+  def overlapRatio(self, other, spacing):
+    """
+    Returns
+    -------
+    float
+      Ratio of the smallest of the two cluster boxes covered by the other box
+    """
+    if not self.overlaps(other):
+      return 0.0
+
+    intersection = VesselSeedCluster([], np.maximum(self.lower, other.lower), np.minimum(self.upper, other.upper))
+    return intersection.voxelCount(spacing) / float(max(1, min(self.voxelCount(spacing), other.voxelCount(spacing))))
+
+
+def clusterVesselSeeds(vesselSeedList, spacing, maxClusterVoxels, margin):
+  """Groups the input seeds in spatially compact clusters.
+
+  Each seed starts in its own cluster with its bounding box expanded by margin. The pair of clusters with overlapping
+  boxes and the smallest merged box is then merged until no overlapping pair fits in maxClusterVoxels. Seeds whose box
+  alone exceeds maxClusterVoxels are kept in their own cluster. Clusters where a seed continues a seed of the other
+  cluster are never merged as the merged cluster would lose the stopper at their junction.
+
+  Candidate pairs are kept in a heap keyed by merged voxel count. Pairs referring to an already merged cluster are
+  dropped when popped and only the pairs of the newly merged cluster are pushed after each merge.
+
+  Parameters
+  ----------
+  vesselSeedList: List[VesselSeedPoints]
+  spacing: List[float]
+    Voxel spacing of the volume on which the clusters will be extracted
+  maxClusterVoxels: int
+    Maximum number of voxels of a merged cluster box
+  margin: float
+    Margin (in mm) added around the seed positions
+
+  Returns
+  -------
+  List[VesselSeedCluster]
+  """
+  validSeeds = [vesselSeeds for vesselSeeds in vesselSeedList if vesselSeeds.isValid()]
+  clusters = OrderedDict((clusterId, VesselSeedCluster.fromVesselSeeds(vesselSeeds, margin))
+                         for clusterId, vesselSeeds in enumerate(validSeeds))
+
+  candidates = []
+  for i, j in combinations(clusters.keys(), 2):
+    _pushClusterMerge(candidates, clusters, i, j, spacing, maxClusterVoxels)
+
+  nextClusterId = len(clusters)
+  while candidates:
+    _, i, j, merged = heapq.heappop(candidates)
+    if i not in clusters or j not in clusters:
+      continue
+
+    del clusters[i]
+    del clusters[j]
+    clusters[nextClusterId] = merged
+    for otherId in list(clusters.keys())[:-1]:
+      _pushClusterMerge(candidates, clusters, otherId, nextClusterId, spacing, maxClusterVoxels)
+    nextClusterId += 1
+
+  return list(clusters.values())
+
+
+def _pushClusterMerge(candidates, clusters, i, j, spacing, maxClusterVoxels):
+  """Pushes the merge of clusters i and j to the candidates heap if their boxes overlap, if they are not chained and if
+  the merged box fits in maxClusterVoxels. Cluster i is expected to be older than cluster j.
+  """
+  if not clusters[i].overlaps(clusters[j]) or clusters[i].isChainedWith(clusters[j]):
+    return
+
+  merged = clusters[i].merge(clusters[j])
+  voxelCount = merged.voxelCount(spacing)
+  if voxelCount <= maxClusterVoxels:
+    heapq.heappush(candidates, (voxelCount, i, j, merged))
+
+
+def planVesselSeedRuns(vesselSeedList, spacing, overlapThreshold, margin):
+  """Plans the VMTK runs extracting the input seeds.
+
+  Seeds with the same point set are extracted once. The pair of runs with the largest overlap ratio above
+  overlapThreshold is then merged in one run as long as the merged box voxel count doesn't exceed the voxel count of
+  the two separate runs. Runs where a seed continues a seed of the other run are never merged as the merged run would
+  lose the stopper at their junction.
+
+  Candidate pairs and their overlap ratio are kept in a heap. Pairs referring to an already merged run are dropped when
+  popped and only the pairs of the newly merged run are pushed after each merge.
+
+  Parameters
+  ----------
+  vesselSeedList: List[VesselSeedPoints]
+  spacing: List[float]
+    Voxel spacing of the volume on which the runs will be extracted
+  overlapThreshold: float
+    Minimum overlap ratio of two runs to be merged (see VesselSeedCluster.overlapRatio). Values above 1 only drop the
+    duplicated seeds.
+  margin: float
+    Margin (in mm) added around the seed positions
+
+  Returns
+  -------
+  List[VesselSeedCluster]
+    Planned runs
+  """
+  uniqueSeeds = OrderedDict()
+  for vesselSeeds in vesselSeedList:
+    if vesselSeeds.isValid():
+      uniqueSeeds.setdefault(frozenset(vesselSeeds.getPointIds()), vesselSeeds)
+
+  runs = OrderedDict((runId, VesselSeedCluster.fromVesselSeeds(vesselSeeds, margin))
+                     for runId, vesselSeeds in enumerate(uniqueSeeds.values()))
+  if overlapThreshold > 1:
+    return list(runs.values())
+
+  voxelCounts = {runId: run.voxelCount(spacing) for runId, run in runs.items()}
+  candidates = []
+  for i, j in combinations(runs.keys(), 2):
+    _pushRunMerge(candidates, runs, voxelCounts, i, j, spacing, overlapThreshold)
+
+  nextRunId = len(runs)
+  while candidates:
+    _, i, j, merged = heapq.heappop(candidates)
+    if i not in runs or j not in runs:
+      continue
+
+    del runs[i]
+    del runs[j]
+    runs[nextRunId] = merged
+    voxelCounts[nextRunId] = merged.voxelCount(spacing)
+    for otherId in list(runs.keys())[:-1]:
+      _pushRunMerge(candidates, runs, voxelCounts, otherId, nextRunId, spacing, overlapThreshold)
+    nextRunId += 1
+
+  return list(runs.values())
+
+
+def _pushRunMerge(candidates, runs, voxelCounts, i, j, spacing, overlapThreshold):
+  """Pushes the merge of runs i and j to the candidates heap if their overlap ratio reaches overlapThreshold and if the
+  merged box isn't larger than the two separate boxes. Largest overlap ratios are popped first.
+  """
+  overlapRatio = runs[i].overlapRatio(runs[j], spacing)
+  if overlapRatio < overlapThreshold or runs[i].isChainedWith(runs[j]):
+    return
+
+  merged = runs[i].merge(runs[j])
+  if merged.voxelCount(spacing) <= voxelCounts[i] + voxelCounts[j]:
+    heapq.heappush(candidates, (-overlapRatio, i, j, merged))
+
+
 class ExtractAllVesselsInOneGoStrategy(IExtractVesselStrategy):
   """Strategy uses VMTK on all markup points at once to extract data.
   """
@@ -201,7 +647,7 @@ class ExtractAllVesselsInOneGoStrategy(IExtractVesselStrategy):
 
     Parameters
     ----------
-    vesselBranchTree: VesselBranchTree
+    vesselBranchTree: VesselTreeModel
       Tree containing the hierarchy of the markups
     vesselBranchMarkup: vtkMRMLMarkupsFiducialNode
       Markup containing all the vessel branches
@@ -215,13 +661,9 @@ class ExtractAllVesselsInOneGoStrategy(IExtractVesselStrategy):
     # Extract all the node ids in the tree and group them by either seed or end id
     # End Ids regroup all the ids which are tree leaves
     nodeList = vesselBranchTree.getNodeList()
-    seedIds = []
-    endIds = []
-    for node in nodeList:
-      if vesselBranchTree.isLeaf(node):
-        endIds.append(node)
-      else:
-        seedIds.append(node)
+    leafIds = vesselBranchTree.getLeafNodeIds()
+    seedIds = [node for node in nodeList if node not in leafIds]
+    endIds = [node for node in nodeList if node in leafIds]
 
     # Convert seed id list and end id list to position lists
     idPositionDict = getMarkupIdPositionDictionary(vesselBranchMarkup)
@@ -232,6 +674,9 @@ class ExtractAllVesselsInOneGoStrategy(IExtractVesselStrategy):
     seedsNodes, stoppersNodes, outVolume, outModel = logic.extractVesselVolumeFromPosition(seedsPositions, endPositions)
     removeNodeFromMRMLScene(seedsNodes)
     removeNodeFromMRMLScene(stoppersNodes)
+
+    treeEdges = [(parentId, childId) for parentId, childId in vesselBranchTree.getTreeParentList() if parentId]
+    self._updateBranchLabelMap(vesselBranchTree, idPositionDict, [outVolume], [treeEdges])
     return outVolume, outModel
 
 
@@ -239,13 +684,45 @@ class ExtractVesselFromVesselSeedPointsStrategy(IExtractVesselStrategy):
   """Base class for strategies using VMTK on multiple start + end points and aggregating results as one volume.
   deriving classes must implement a function returning a list of node pairs constructed from vessel tree and node id
   position dictionary
+
+  Before extraction, the vessel seeds are planned as VMTK runs with planVesselSeedRuns. Duplicated seeds are dropped
+  and seeds with mostly overlapping boxes are extracted in one run. Each run only processes the voxels of its box (see
+  RVXLiverSegmentationLogic.extractVesselVolumesInRASBoxes). The planned runs and their box voxel count can be
+  accessed after extraction using getRunPlan.
   """
 
+  def __init__(self, overlapThreshold=0.9, margin=10.0, maxWorkers=None):
+    """
+    Parameters
+    ----------
+    overlapThreshold: float
+      Minimum ratio of the smallest run box covered by the other run box for two runs to be merged. Values above 1
+      disable the merge.
+    margin: float
+      Margin (in mm) added around the seed positions when computing the run boxes
+    maxWorkers: int or None
+      Maximum number of concurrent level set evolutions. If None, uses the number of CPUs.
+    """
+    IExtractVesselStrategy.__init__(self)
+    self.overlapThreshold = overlapThreshold
+    self.margin = margin
+    self.maxWorkers = maxWorkers
+    self._runPlan = []
+
+  def getRunPlan(self):
+    """
+    Returns
+    -------
+    List[Tuple[List[Tuple[str, str]], int]]
+      [parentId, childId] pairs and box voxel count of each VMTK run executed during last extraction
+    """
+    return self._runPlan
+
   def constructVesselSeedList(self, vesselBranchTree, idPositionDict):
     """
     Parameters
     ----------
-    vesselBranchTree: VesselBranchTree
+    vesselBranchTree: VesselTreeModel
       Tree containing the hierarchy of the markups
     idPositionDict: Dict[str,List[float]]
       Dictionary with nodeId as key and node position as value
@@ -262,7 +739,7 @@ class ExtractVesselFromVesselSeedPointsStrategy(IExtractVesselStrategy):
 
     Parameters
     ----------
-    vesselBranchTree: VesselBranchTree
+    vesselBranchTree: VesselTreeModel
       Tree containing the hierarchy of the markups
     vesselBranchMarkup: vtkMRMLMarkupsFiducialNode
       Markup containing all the vessel branches
@@ -273,30 +750,51 @@ class ExtractVesselFromVesselSeedPointsStrategy(IExtractVesselStrategy):
     Tuple[vtkMRMLScalarVolume, vtkMRMLModel]
       Tuple containing extracted volume information and associated poly data model
     """
+    vesselnessVolume = logic.getCurrentVesselnessVolume()
+    if vesselnessVolume is None:
+      raise ValueError("Please extract vesselness volume before extracting vessels")
+
     # Convert seed id list and end id list to position lists
     idPositionDict = getMarkupIdPositionDictionary(vesselBranchMarkup)
 
-    # Extract all the branches in the tree.
-    # Loop over all ids
-    vesselSeedList = self.constructVesselSeedList(vesselBranchTree, idPositionDict)
-
-    volumes = []
-    elementsToRemoveFromScene = []
-    for vesselSeeds in vesselSeedList:
-      seedsNodes, stoppersNodes, outVolume, outModel = logic.extractVesselVolumeFromPosition(
-        vesselSeeds.getSeedPositions(), vesselSeeds.getStopperPositions())
-      elementsToRemoveFromScene.append(seedsNodes)
-      elementsToRemoveFromScene.append(stoppersNodes)
-      elementsToRemoveFromScene.append(outModel)
-      elementsToRemoveFromScene.append(outVolume)
-      volumes.append(outVolume)
+    # Extract all the branches in the tree and plan them as VMTK runs
+    spacing = vesselnessVolume.GetSpacing()
+    runs = self.planRuns(vesselBranchTree, idPositionDict, spacing)
+    self._runPlan = [(run.getEdgeIds(), run.voxelCount(spacing)) for run in runs]
+
+    # Intermediate models are never displayed. Only the merged volume model is constructed.
+    runOutputs = logic.extractVesselVolumesInRASBoxes(
+      [(run.getSeedPositions(), run.getStopperPositions(), run.lower, run.upper) for run in runs], lazyModel=True,
+      maxWorkers=self.maxWorkers)
+    volumes = [outVolume for _, _, outVolume, _ in runOutputs]
 
     outVolume, outModel = mergeVolumes(volumes, "levelSetSegmentation")
-    for volume in elementsToRemoveFromScene:
+    self._updateBranchLabelMap(vesselBranchTree, idPositionDict, volumes, [run.getEdgeIds() for run in runs])
+    for seedsNodes, stoppersNodes, volume, _ in runOutputs:
+      removeNodeFromMRMLScene(seedsNodes)
+      removeNodeFromMRMLScene(stoppersNodes)
       removeNodeFromMRMLScene(volume)
 
     return outVolume, outModel
 
+  def planRuns(self, vesselBranchTree, idPositionDict, spacing):
+    """
+    Parameters
+    ----------
+    vesselBranchTree: VesselTreeModel
+      Tree containing the hierarchy of the markups
+    idPositionDict: Dict[str,List[float]]
+      Dictionary with nodeId as key and node position as value
+    spacing: List[float]
+      Voxel spacing of the volume on which the runs will be extracted
+
+    Returns
+    -------
+    List[VesselSeedCluster] - VMTK runs to extract. Each run is extracted in its box only.
+    """
+    return planVesselSeedRuns(self.constructVesselSeedList(vesselBranchTree, idPositionDict), spacing,
+                              self.overlapThreshold, self.margin)
+
 
 class ExtractOneVesselPerParentChildNode(ExtractVesselFromVesselSeedPointsStrategy):
   """Strategy uses VMTK on parent + child pair and merges the results as output.
@@ -321,7 +819,7 @@ class ExtractOneVesselPerParentChildNode(ExtractVesselFromVesselSeedPointsStrate
     """
     Parameters
     ----------
-    vesselBranchTree: VesselBranchTree
+    vesselBranchTree: VesselTreeModel
       Tree containing the hierarchy of the markups
     idPositionDict: Dict[str,List[float]]
       Dictionary with nodeId as key and node position as value
@@ -333,11 +831,12 @@ class ExtractOneVesselPerParentChildNode(ExtractVesselFromVesselSeedPointsStrate
 
     # Extract all the branches in the tree and return as branch list
     nodeList = vesselBranchTree.getNodeList()
+    positionTable = NodePositionTable.of(idPositionDict)
     vesselSeedList = []
 
     for node in nodeList:
       for child in vesselBranchTree.getChildrenNodeId(node):
-        vesselSeedList.append(VesselSeedPoints(idPositionDict, [node, child]))
+        vesselSeedList.append(VesselSeedPoints(positionTable, [node, child]))
     return vesselSeedList
 
 
@@ -363,7 +862,7 @@ class ExtractOneVesselPerParentAndSubChildNode(ExtractVesselFromVesselSeedPoints
     """
     Parameters
     ----------
-    vesselBranchTree: VesselBranchTree
+    vesselBranchTree: VesselTreeModel
       Tree containing the hierarchy of the markups
     idPositionDict: Dict[str,List[float]]
       Dictionary with nodeId as key and node position as value
@@ -376,6 +875,7 @@ class ExtractOneVesselPerParentAndSubChildNode(ExtractVesselFromVesselSeedPoints
 
   def parentSubChildBranchPairs(self, vesselBranchTree, idPositionDict, startNode=None):
     # Initialize vessel seed list
+    positionTable = NodePositionTable.of(idPositionDict)
     vesselSeedList = []
 
     # Initialize start node as tree root if startNode not provided
@@ -384,19 +884,18 @@ class ExtractOneVesselPerParentAndSubChildNode(ExtractVesselFromVesselSeedPoints
       startNode = vesselBranchTree.getRootNodeId()
       isStartNodeRoot = True
 
-    for child in vesselBranchTree.getChildrenNodeId(startNode):
-      # Construct startNode + subChildren pairs
+    # Each child of the start node sub tree is visited in depth first order
+    for child in preorderNodeIds(vesselBranchTree, startNode)[1:]:
+      # Construct child parent + subChildren pairs
+      parent = vesselBranchTree.getParentNodeId(child)
       subChildren = vesselBranchTree.getChildrenNodeId(child)
       for subChild in subChildren:
-        vesselSeedList.append(VesselSeedPoints(idPositionDict, [startNode, subChild]))
+        vesselSeedList.append(VesselSeedPoints(positionTable, [parent, subChild]))
 
       # Special case if starting from root node and current node doesn't have children (to avoid missing the point)
       # otherwise, the node will be contained in a previous parent + subChild pair
-      if len(subChildren) == 0 and isStartNodeRoot:
-        vesselSeedList.append(VesselSeedPoints(idPositionDict, [startNode, child]))
-
-      # Call recursively for children
-      vesselSeedList += self.parentSubChildBranchPairs(vesselBranchTree, idPositionDict, startNode=child)
+      if len(subChildren) == 0 and isStartNodeRoot and parent == startNode:
+        vesselSeedList.append(VesselSeedPoints(positionTable, [parent, child]))
 
     return vesselSeedList
 
@@ -425,7 +924,7 @@ class ExtractOneVesselPerBranch(ExtractVesselFromVesselSeedPointsStrategy):
     """
     Parameters
     ----------
-    vesselBranchTree: VesselBranchTree
+    vesselBranchTree: VesselTreeModel
       Tree containing the hierarchy of the markups
     idPositionDict: Dict[str,List[float]]
       Dictionary with nodeId as key and node position as value
@@ -437,26 +936,68 @@ class ExtractOneVesselPerBranch(ExtractVesselFromVesselSeedPointsStrategy):
     return self.constructBranchFromRoot(vesselBranchTree, idPositionDict)
 
   def constructBranchFromRoot(self, vesselBranchTree, idPositionDict, startNode=None):
-    # Initialize vessel seed list
-    vesselSeedList = []
+    # Each branch goes from the start node or a junction node to the next leaf or junction node
+    chains = vesselBranchTree.getBranchChains() if startNode is None else branchChains(vesselBranchTree, startNode)
+    positionTable = NodePositionTable.of(idPositionDict)
+    return [VesselSeedPoints(positionTable, chain) for chain in chains]
 
-    # Initialize start node as tree root if startNode not provided
-    if startNode is None:
-      startNode = vesselBranchTree.getRootNodeId()
 
-    for child in vesselBranchTree.getChildrenNodeId(startNode):
-      seedPoints = VesselSeedPoints(idPositionDict)
-      seedPoints.appendPoint(startNode)
-      seedPoints.appendPoint(child)
+class ExtractVesselsByCluster(ExtractOneVesselPerBranch):
+  """Strategy groups the branches of ExtractOneVesselPerBranch in spatially compact clusters and uses one VMTK run per
+  cluster. Each run only processes the voxels of its cluster box and the level set evolutions of the runs are
+  executed concurrently (see RVXLiverSegmentationLogic.extractVesselVolumesInRASBoxes).
+
+  maxClusterVoxels balances the number of runs against the number of voxels processed by each run. Large values lead
+  to a few runs over large boxes, small values to one run per branch. A branch and the branches continuing it are
+  never grouped as the grouped run would lose the stopper at their junction.
+
+  Example :
+    n0
+      |_ n10
+          |_ n20
+              |_n30
+              |_n31
+              |_n32
+
+  With n30 far away from the other nodes, exp VMTK runs :
+    [n0, n10, n20]
+    [n20, n31] and [n20, n32] in one run
+    [n20, n30]
+  """
+
+  defaultClusterSize = 128
+
+  def __init__(self, maxClusterVoxels=defaultClusterSize ** 3, margin=10.0, maxWorkers=None):
+    """
+    Parameters
+    ----------
+    maxClusterVoxels: int
+      Maximum number of voxels of a cluster box
+    margin: float
+      Margin (in mm) added around the branch nodes when computing the cluster boxes
+    maxWorkers: int or None
+      Maximum number of concurrent level set evolutions. If None, uses the number of CPUs.
+    """
+    ExtractOneVesselPerBranch.__init__(self, margin=margin, maxWorkers=maxWorkers)
+    self.maxClusterVoxels = maxClusterVoxels
 
-      # Append children until child reaches leaf or a child with more than one sub child
-      subChild = child
-      while len(vesselBranchTree.getChildrenNodeId(subChild)) == 1:
-        subChild = vesselBranchTree.getChildrenNodeId(subChild)[0]
-        seedPoints.appendPoint(subChild)
+  def constructVesselSeedClusters(self, vesselBranchTree, idPositionDict, spacing):
+    """
+    Parameters
+    ----------
+    vesselBranchTree: VesselTreeModel
+      Tree containing the hierarchy of the markups
+    idPositionDict: Dict[str,List[float]]
+      Dictionary with nodeId as key and node position as value
+    spacing: List[float]
+      Voxel spacing of the volume on which the clusters will be extracted
 
-      # Call recursively for reached leafs
-      vesselSeedList.append(seedPoints)
-      vesselSeedList += self.constructBranchFromRoot(vesselBranchTree, idPositionDict, startNode=subChild)
+    Returns
+    -------
+    List[VesselSeedCluster] - List of clusters to extract using VMTK
+    """
+    return clusterVesselSeeds(self.constructVesselSeedList(vesselBranchTree, idPositionDict), spacing,
+                              self.maxClusterVoxels, self.margin)
 
-    return vesselSeedList
+  def planRuns(self, vesselBranchTree, idPositionDict, spacing):
+    return self.constructVesselSeedClusters(vesselBranchTree, idPositionDict, spacing)
@@ -0,0 +1,180 @@
+from collections import OrderedDict
+
+import numpy as np
+import slicer
+import vtk
+
+from .RVXLiverSegmentationUtils import raiseValueErrorIfInvalidType, createModelNode, arrayFromVTKMatrix, \
+  getMarkupIdPositionDictionary
+from .VoxelSkeletonCenterline import kjiToRas, pathsToPolyData
+
+# Minimal path front propagation is provided by scikit-image which is not bundled with Slicer
+# (see installPythonPackageIfNeeded)
+minimalPathModuleName = "skimage.graph"
+minimalPathPackageName = "scikit-image"
+
+
+def vesselnessCostArray(vesselnessArray, epsilon=1e-3):
+  """Converts vesselness to a travel cost. Cost is low inside vessels and high outside.
+
+  Parameters
+  ----------
+  vesselnessArray: np.ndarray
+  epsilon: float
+    Offset added to the normalized vesselness to bound the maximum cost to 1 / epsilon
+
+  Returns
+  -------
+  np.ndarray
+    1 / (normalized vesselness + epsilon)
+  """
+  vesselness = vesselnessArray.astype(float)
+  vMin, vMax = vesselness.min(), vesselness.max()
+  normalized = (vesselness - vMin) / (vMax - vMin) if vMax > vMin else np.zeros_like(vesselness)
+  return 1.0 / (normalized + epsilon)
+
+
+def minimalPaths(costArray, startKji, endsKji, margin=10, sampling=None):
+  """Computes the geodesic minimal paths from start voxel to each end voxel.
+
+  Paths are computed using heap based Dijkstra on the 26-connectivity voxel graph restricted to the bounding box of
+  start and ends voxels expanded by margin. One front propagation is done for all the ends.
+
+  Parameters
+  ----------
+  costArray: np.ndarray
+    Voxel travel cost in KJI order
+  startKji: np.ndarray
+    Start voxel index in KJI order
+  endsKji: List[np.ndarray]
+    End voxel indices in KJI order
+  margin: int
+    Number of voxels added around the start and ends bounding box
+  sampling: Sequence[float] or None
+    Voxel spacing in KJI order. Converted to a tuple of floats as scikit-image rejects numpy arrays.
+
+  Returns
+  -------
+  List[np.ndarray]
+    N x 3 KJI voxel indices from start to end for each end
+
+  Raises
+  ------
+  ImportError if scikit-image is not installed
+  """
+  from skimage.graph import MCP_Geometric
+
+  points = np.array([startKji] + list(endsKji), dtype=int)
+  lower = np.maximum(points.min(axis=0) - margin, 0)
+  upper = np.minimum(points.max(axis=0) + margin + 1, costArray.shape)
+  crop = tuple(slice(l, u) for l, u in zip(lower, upper))
+
+  if sampling is not None:
+    sampling = tuple(float(s) for s in sampling)
+
+  mcp = MCP_Geometric(costArray[crop], sampling=sampling)
+  localEnds = [tuple(end) for end in points[1:] - lower]
+  mcp.find_costs([tuple(points[0] - lower)], localEnds)
+  return [np.array(mcp.traceback(end)) + lower for end in localEnds]
+
+
+def rasToKji(positions, rasToIjk):
+  """Converts RAS positions to the closest KJI voxel indices. Returned indices may be outside of the volume."""
+  ras = np.column_stack([np.asarray(positions, dtype=float), np.ones(len(positions))])
+  ijk = np.rint(np.dot(rasToIjk, ras.T).T[:, :3]).astype(int)
+  return ijk[:, ::-1]
+
+
+def isInsideVolume(kji, shape):
+  """Returns whether each of the N x 3 KJI voxel indices is inside the volume of given shape"""
+  return np.all((kji >= 0) & (kji < np.array(shape)), axis=1)
+
+
+def treeChildrenDictionary(vesselBranchTree, idPositionDict):
+  """
+  Returns
+  -------
+  OrderedDict[str, List[str]]
+    Placed children ids of each placed parent id in breadth first order
+  """
+  childrenDict = OrderedDict()
+  for parentId, childId in vesselBranchTree.getTreeParentList():
+    if parentId in idPositionDict and childId in idPositionDict:
+      childrenDict.setdefault(parentId, []).append(childId)
+  return childrenDict
+
+
+def minimalPathCenterlinePaths(vesselnessArray, ijkToRas, childrenDict, idPositionDict, margin=10):
+  """Computes the minimal path centerlines between every parent and child nodes on the vesselness cost.
+
+  One front propagation is computed per parent node. Edges with a node outside of the vesselness volume are skipped
+  as their path cannot be computed.
+
+  Parameters
+  ----------
+  vesselnessArray: np.ndarray
+    Vesselness in KJI order
+  ijkToRas: np.ndarray
+    4x4 IJK to RAS matrix of the vesselness
+  childrenDict: OrderedDict[str, List[str]]
+    Children ids of each parent id
+  idPositionDict: Dict[str, List[float]]
+    Dictionary with nodeId as key and node position as value
+  margin: int
+    Number of voxels added around each parent and children bounding box
+
+  Returns
+  -------
+  List[Tuple[Tuple[str, str], np.ndarray]]
+    (parentId, childId) and RAS path for each tree edge inside of the volume in childrenDict order
+  """
+  costArray = vesselnessCostArray(vesselnessArray)
+  sampling = tuple(float(s) for s in np.linalg.norm(ijkToRas[:3, :3], axis=0)[::-1])
+
+  nodeIds = list(OrderedDict.fromkeys(list(childrenDict.keys()) + [childId for childrenIds in childrenDict.values()
+                                                                    for childId in childrenIds]))
+  nodesKji = rasToKji([idPositionDict[nodeId] for nodeId in nodeIds], np.linalg.inv(ijkToRas))
+  nodeKji = {nodeId: kji for nodeId, kji, isInside in zip(nodeIds, nodesKji, isInsideVolume(nodesKji, costArray.shape))
+             if isInside}
+
+  edgePaths = []
+  for parentId, childrenIds in childrenDict.items():
+    childrenIds = [childId for childId in childrenIds if childId in nodeKji]
+    if parentId not in nodeKji or not childrenIds:
+      continue
+
+    paths = minimalPaths(costArray, nodeKji[parentId], [nodeKji[childId] for childId in childrenIds], margin, sampling)
+    edgePaths += [((parentId, childId), kjiToRas(path, ijkToRas)) for childId, path in zip(childrenIds, paths)]
+  return edgePaths
+
+
+def extractMinimalPathCenterlines(vesselBranchTree, vesselBranchMarkup, vesselnessVolume, margin=10):
+  """Extracts the centerline tree directly from the node tree and vesselness volume without level set segmentation.
+
+  Parameters
+  ----------
+  vesselBranchTree: VesselTreeModel
+    Tree containing the hierarchy of the markups
+  vesselBranchMarkup: vtkMRMLMarkupsFiducialNode
+    Markup containing all the vessel branches
+  vesselnessVolume: vtkMRMLScalarVolumeNode
+  margin: int
+    Number of voxels added around each parent and children bounding box
+
+  Returns
+  -------
+  centerLineModel : vtkMRMLModelNode
+    Contains one poly line per tree edge in the tree parent list order
+  """
+  raiseValueErrorIfInvalidType(vesselnessVolume=(vesselnessVolume, "vtkMRMLScalarVolumeNode"))
+
+  idPositionDict = getMarkupIdPositionDictionary(vesselBranchMarkup)
+  ijkToRas = vtk.vtkMatrix4x4()
+  vesselnessVolume.GetIJKToRASMatrix(ijkToRas)
+  edgePaths = minimalPathCenterlinePaths(slicer.util.arrayFromVolume(vesselnessVolume), arrayFromVTKMatrix(ijkToRas),
+                                         treeChildrenDictionary(vesselBranchTree, idPositionDict), idPositionDict,
+                                         margin)
+
+  centerLineModel = createModelNode("NodeTreeCenterLineModel")
+  centerLineModel.SetAndObservePolyData(pathsToPolyData([path for _, path in edgePaths]))
+  return centerLineModel
@@ -1,11 +1,17 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+
 import numpy as np
 import slicer
 from slicer.ScriptedLoadableModule import ScriptedLoadableModuleLogic
 import vtk
+from vtk.util.numpy_support import vtk_to_numpy
 
 from .RVXLiverSegmentationUtils import raiseValueErrorIfInvalidType, createLabelMapVolumeNodeBasedOnModel, \
-  createFiducialNode, createModelNode, createVolumeNodeBasedOnModel, removeNodeFromMRMLScene, cropSourceVolume, \
-  cloneSourceVolume, getVolumeIJKToRASDirectionMatrixAsNumpyArray
+  createFiducialNode, createModelNode, createVolumeNodeBasedOnModel, removeNodeFromMRMLScene, removeNodesFromMRMLScene, \
+  cropSourceVolumeToRASBounds, cropSourceVolumeToIJKSlices, rasBoundsToIJKSlices, \
+  getVolumeIJKToRASDirectionMatrixAsNumpyArray
 
 try:
   from LevelSetSegmentation import LevelSetSegmentationWidget, LevelSetSegmentationLogic
@@ -44,6 +50,7 @@ class VesselnessFilterParameters(object):
     self.useROI = True
     self.roiGrowthFactor = 1.2
     self.minROIExtent = 20
+    self.roiClusterCount = 1
     self.minimumDiameter = 1
     self.maximumDiameter = 7
     self.suppressPlatesPercent = 50
@@ -69,6 +76,155 @@ class LevelSetParameters(object):
     self.levelSetMethod = "geodesic"
 
 
+class CenterlineParameters(object):
+  """
+  Object holding the parameters for centerline surface preprocessing. Init construct parameters with default values.
+
+  The decimation target number of points is adapted to the surface area so that the mesh edge length allows
+  edgesPerCircumference edges around the smallest expected vessel. With the default parameters, the target scales
+  with the surface area between about 535 mm2 and 10700 mm2, which covers the usual liver vessel tree surfaces.
+  """
+
+  def __init__(self):
+    self.minimumVesselRadius = 1.0
+    self.edgesPerCircumference = 8
+    self.minimumNumberOfPoints = 1000
+    self.maximumNumberOfPoints = 20000
+    self.decimationAggressiveness = 4.0
+    self.subdivideInputSurface = False
+
+  def targetNumberOfPoints(self, surfaceArea):
+    """
+    Parameters
+    ----------
+    surfaceArea: float
+      Area of the surface to decimate in mm2
+
+    Returns
+    -------
+    int
+      Number of points of an equilateral triangle mesh of the given area with edge length adapted to the minimum vessel
+      radius. Value is clamped between minimumNumberOfPoints and maximumNumberOfPoints.
+    """
+    edgeLength = 2 * np.pi * self.minimumVesselRadius / self.edgesPerCircumference
+    triangleArea = np.sqrt(3) / 4 * edgeLength ** 2
+
+    # Closed triangle meshes have about twice as many triangles as points
+    numberOfPoints = int(round(surfaceArea / (2 * triangleArea)))
+    return int(np.clip(numberOfPoints, self.minimumNumberOfPoints, self.maximumNumberOfPoints))
+
+
+class PreprocessedSurfaceCache(object):
+  """Bounded cache of the surfaces preprocessed for centerline extraction.
+
+  Surfaces are indexed by their poly data MTime and the preprocessing parameters. VTK modified times come from a
+  global counter : an unchanged surface keeps its MTime while a modified or new surface gets a new one. Extracting the
+  centerline again on an unchanged surface with moved end points doesn't preprocess the surface again.
+  """
+
+  def __init__(self, maxSize=4):
+    self.maxSize = maxSize
+    self._surfaces = OrderedDict()
+
+  def getOrPreprocess(self, surfacePolyData, preprocessingKey, preprocess):
+    """
+    Parameters
+    ----------
+    surfacePolyData: vtkPolyData
+    preprocessingKey: Tuple
+      Preprocessing parameters used to construct the preprocessed surface
+    preprocess: Callable[[], vtkPolyData]
+      Called to construct the preprocessed surface if it is not cached
+
+    Returns
+    -------
+    vtkPolyData
+      Preprocessed surface. The returned surface is shared with the cache and should not be modified.
+    """
+    key = (surfacePolyData.GetMTime(), preprocessingKey)
+    if key in self._surfaces:
+      self._surfaces.move_to_end(key)
+      return self._surfaces[key]
+
+    preprocessedPolyData = preprocess()
+    self._surfaces[key] = preprocessedPolyData
+    while len(self._surfaces) > self.maxSize:
+      self._surfaces.popitem(last=False)
+    return preprocessedPolyData
+
+  def clear(self):
+    self._surfaces.clear()
+
+  def __len__(self):
+    return len(self._surfaces)
+
+
+class LazyVolumeBoundaryModel(object):
+  """Handle deferring the construction of a volume boundary model until the model is first requested.
+  The model is constructed at most once and is added to the scene on construction.
+  """
+
+  def __init__(self, sourceVolume, modelName, imageData=None, threshold=0.0):
+    self._sourceVolume = sourceVolume
+    self._modelName = modelName
+    self._imageData = imageData
+    self._threshold = threshold
+    self._model = None
+
+  def isCreated(self):
+    return self._model is not None
+
+  def get(self):
+    """
+    Returns
+    -------
+    vtkMRMLModelNode
+      Model after marching cubes on the source volume
+    """
+    if self._model is None:
+      self._model = RVXLiverSegmentationLogic.createVolumeBoundaryModel(self._sourceVolume, self._modelName,
+                                                                        self._imageData, self._threshold)
+      # Release the image data once the model has been created
+      self._imageData = None
+    return self._model
+
+
+def kMeansLabels(points, clusterCount, iterationNumber=20):
+  """Clusters the input points using Lloyd's k-means algorithm with deterministic farthest point initialization.
+
+  Parameters
+  ----------
+  points: np.ndarray
+    N x 3 array of positions
+  clusterCount: int
+  iterationNumber: int
+
+  Returns
+  -------
+  np.ndarray
+    Cluster label of each point
+  """
+  points = np.asarray(points, dtype=float)
+  clusterCount = min(clusterCount, len(points))
+
+  # Farthest point initialization starting from the first point
+  centers = [points[0]]
+  for _ in range(clusterCount - 1):
+    distances = np.min([np.sum((points - center) ** 2, axis=1) for center in centers], axis=0)
+    centers.append(points[np.argmax(distances)])
+  centers = np.array(centers)
+
+  labels = np.zeros(len(points), dtype=int)
+  for _ in range(iterationNumber):
+    labels = np.argmin(np.sum((points[:, np.newaxis, :] - centers[np.newaxis, :, :]) ** 2, axis=2), axis=1)
+    newCenters = np.array([points[labels == i].mean(axis=0) if np.any(labels == i) else centers[i]
+                           for i in range(clusterCount)])
+    if np.allclose(newCenters, centers):
+      break
+    centers = newCenters
+  return labels
+
+
 class IRVXLiverSegmentationLogic(object):
   """Interface definition for Logic module.
   """
@@ -79,7 +235,7 @@ class IRVXLiverSegmentationLogic(object):
   def setInputVolume(self, inputVolume):
     pass
 
-  def updateVesselnessVolume(self, nodePositions):
+  def updateVesselnessVolume(self, nodePositions, nodeEdges=None):
     pass
 
   @property
@@ -103,8 +259,9 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
     self._inputVolume = None
     self._croppedInputVolume = None
     self._vesselnessVolume = None
-    self._inputRoi = None
     self.levelSetParameters = LevelSetParameters()
+    self.centerlineParameters = CenterlineParameters()
+    self.centerlineSurfaceCache = PreprocessedSurfaceCache()
 
   @staticmethod
   def isVmtkFound():
@@ -177,13 +334,23 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
     outputVolume : vtkMRMLLabelMapVolumeNode
       Volume with vesselness information
     """
-    import itk
-
     # Type checking
     raiseValueErrorIfInvalidType(sourceVolume=(sourceVolume, "vtkMRMLScalarVolumeNode"))
 
-    # Convert input volume to ITK
-    np_array = slicer.util.arrayFromVolume(sourceVolume)
+    # Normalize output between 0 and 1
+    output_array = self._satoVesselnessArray(slicer.util.arrayFromVolume(sourceVolume))
+    output_array = (output_array - np.min(output_array)) / (np.max(output_array) - np.min(output_array))
+
+    # Initialize output volume from input volume
+    vesselnessFiltered = createVolumeNodeBasedOnModel(sourceVolume, "VesselnessFiltered", "vtkMRMLScalarVolumeNode")
+    slicer.util.updateVolumeFromArray(vesselnessFiltered, output_array)
+
+    return vesselnessFiltered
+
+  def _satoVesselnessArray(self, np_array):
+    """Returns the non normalized SATO vesselness of the input KJI array"""
+    import itk
+
     itk_image = itk.image_view_from_array(np_array)
     hessian_image = itk.hessian_recursive_gaussian_image_filter(itk_image.astype(itk.F),
                                                                 sigma=self._vesselnessFilterParam.satoSigma)
@@ -192,24 +359,64 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
     vesselness_filter.SetInput(hessian_image)
     vesselness_filter.SetAlpha1(self._vesselnessFilterParam.satoAlpha1)
     vesselness_filter.SetAlpha2(self._vesselnessFilterParam.satoAlpha2)
-
-    # Convert output back to Slicer format
     vesselness_filter.Update()
-    filtered_image = vesselness_filter.GetOutput()
+    return np.array(itk.array_view_from_image(vesselness_filter.GetOutput()))
 
-    # Normalize output between 0 and 1
-    output_array = itk.array_view_from_image(filtered_image)
-    output_array = (output_array - np.min(output_array)) / (np.max(output_array) - np.min(output_array))
+  def _applyVesselnessFilterPerBox(self, sourceVolume, boxes):
+    """Apply current vesselness filter inside each of the input RAS boxes only. Voxels outside of the boxes are set to
+    zero. SATO boxes are filtered concurrently and VMTK boxes sequentially as VMTK filter works on scene nodes.
+
+    Parameters
+    ----------
+    sourceVolume: vtkMRMLScalarVolumeNode
+      Volume containing every box
+    boxes: List[Tuple[np.ndarray, np.ndarray]]
+      Lower and upper RAS corners of each box
+
+    Returns
+    -------
+    outputVolume : vtkMRMLScalarVolumeNode
+      Volume with vesselness information
+    """
+    sourceArray = slicer.util.arrayFromVolume(sourceVolume)
+    boxSlices = [rasBoundsToIJKSlices(sourceVolume, lower, upper)[::-1] for lower, upper in boxes]
+
+    # Hessian is computed on a margin around each box to avoid border effects inside the box
+    margin = int(np.ceil(4 * self._vesselnessFilterParam.satoSigma))
+    paddedSlices = [tuple(slice(max(s.start - margin, 0), min(s.stop + margin, dim))
+                          for s, dim in zip(kjiSlices, sourceArray.shape)) for kjiSlices in boxSlices]
+
+    if self._vesselnessFilterParam.useVmtkFilter:
+      boxVesselness = [self._vmtkVesselnessArray(sourceVolume, kjiSlices) for kjiSlices in paddedSlices]
+    else:
+      with ThreadPoolExecutor() as executor:
+        boxVesselness = list(executor.map(lambda kjiSlices: self._satoVesselnessArray(sourceArray[kjiSlices]),
+                                          paddedSlices))
+
+    output_array = np.zeros(sourceArray.shape, dtype=np.float32)
+    for kjiSlices, paddedKjiSlices, vesselness in zip(boxSlices, paddedSlices, boxVesselness):
+      innerSlices = tuple(slice(s.start - p.start, s.stop - p.start) for s, p in zip(kjiSlices, paddedKjiSlices))
+      output_array[kjiSlices] = np.maximum(output_array[kjiSlices], vesselness[innerSlices])
+
+    # Normalize output between 0 and 1 over all the boxes
+    if not self._vesselnessFilterParam.useVmtkFilter:
+      output_array = (output_array - np.min(output_array)) / (np.max(output_array) - np.min(output_array))
 
-    # Initialize output volume from input volume
     vesselnessFiltered = createVolumeNodeBasedOnModel(sourceVolume, "VesselnessFiltered", "vtkMRMLScalarVolumeNode")
     slicer.util.updateVolumeFromArray(vesselnessFiltered, output_array)
-
     return vesselnessFiltered
 
+  def _vmtkVesselnessArray(self, sourceVolume, kjiSlices):
+    """Returns the VMTK vesselness of the source volume voxels in the input KJI slices"""
+    boxVolume = cropSourceVolumeToIJKSlices(sourceVolume, kjiSlices[::-1])
+    vesselnessVolume = self._applyVmtkVesselnessFilter(boxVolume)
+    vesselness = np.array(slicer.util.arrayFromVolume(vesselnessVolume))
+    removeNodesFromMRMLScene([boxVolume, vesselnessVolume])
+    return vesselness
+
   @classmethod
   def _applyLevelSetSegmentationFromNodePositions(cls, sourceVolume, croppedSourceVolume, vesselnessVolume,
-                                                  seedsPositions, endPositions, levelSetParameters):
+                                                  seedsPositions, endPositions, levelSetParameters, lazyModel=False):
     """ Apply VMTK LevelSetSegmentation to vesselnessVolume given input seed positions and end positions
 
     Returns label Map Volume with segmentation information and model containing marching cubes iso surface extraction
@@ -227,6 +434,8 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
     endPositions : List[List[float]]
       End positions for the vessel
     levelSetParameters : LevelSetParameters
+    lazyModel : bool
+      If True, the model is returned as a LazyVolumeBoundaryModel and marching cubes is only run when requested
 
     Returns
     -------
@@ -236,7 +445,7 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
       Nodes used as stoppers during level set segmentation (aggregate of start point and end point)
     LevelSetSegmentation : vtkMRMLLabelMapVolumeNode
       segmentation volume output
-    LevelSetModel : vtkMRMLModelNode
+    LevelSetModel : vtkMRMLModelNode or LazyVolumeBoundaryModel
       Model after marching cubes on the segmentation data
     """
     # Type checking
@@ -244,12 +453,23 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
                                  croppedSourceVolume=(croppedSourceVolume, "vtkMRMLScalarVolumeNode"),
                                  vesselnessVolume=(vesselnessVolume, "vtkMRMLScalarVolumeNode"))
 
-    # Get module logic from VMTK LevelSetSegmentation
-    segmentationLogic = VMTKModule.getLevelSetSegmentationLogic()
+    seedsNodes, stoppersNodes, seeds, stoppers = cls._createLevelSetSeeds(seedsPositions, endPositions,
+                                                                          vesselnessVolume)
 
-    # Create output volume node
-    tmpVolume = createLabelMapVolumeNodeBasedOnModel(croppedSourceVolume, "LevelSetSegmentation")
+    # no preview, run the whole thing! we never use the vesselness node here, just the original one
+    evolImageData, labelMap = cls._levelSetEvolution(sourceVolume.GetImageData(), vesselnessVolume.GetImageData(),
+                                                     seeds, stoppers, levelSetParameters)
+    outVolume, outModel = cls._levelSetOutput(sourceVolume, croppedSourceVolume, labelMap, evolImageData, lazyModel)
+    return seedsNodes, stoppersNodes, outVolume, outModel
 
+  @staticmethod
+  def _createLevelSetSeeds(seedsPositions, endPositions, vesselnessVolume):
+    """Creates the seeds and stoppers nodes of the level set and converts them to the vesselness volume point ids.
+
+    Returns
+    -------
+    Tuple[vtkMRMLMarkupsFiducialNode, vtkMRMLMarkupsFiducialNode, vtkIdList, vtkIdList]
+    """
     # Copy paste code from LevelSetSegmentation start method
     # https://github.com/vmtk/SlicerExtension-VMTK/blob/master/LevelSetSegmentation/LevelSetSegmentation.py
 
@@ -262,10 +482,24 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
     seeds = LevelSetSegmentationWidget.convertFiducialHierarchyToVtkIdList(seedsNodes, vesselnessVolume)
     stoppers = LevelSetSegmentationWidget.convertFiducialHierarchyToVtkIdList(stoppersNodes,
                                                                               vesselnessVolume) if stoppersNodes else vtk.vtkIdList()
+    return seedsNodes, stoppersNodes, seeds, stoppers
+
+  @staticmethod
+  def _levelSetEvolution(sourceImageData, vesselnessImageData, seeds, stoppers, levelSetParameters):
+    """Runs the level set initialization on the vesselness image and the level set evolution on the source image.
+    Only VTK image data are used which lets the evolutions of independent runs be executed concurrently.
+
+    Returns
+    -------
+    Tuple[vtkImageData, vtkImageData]
+      Level set evolution image and segmentation label map
+    """
+    # Get module logic from VMTK LevelSetSegmentation
+    segmentationLogic = VMTKModule.getLevelSetSegmentationLogic()
 
     # the input image for the initialization
     inputImage = vtk.vtkImageData()
-    inputImage.DeepCopy(vesselnessVolume.GetImageData())
+    inputImage.DeepCopy(vesselnessImageData)
 
     # initialization
     initImageData = vtk.vtkImageData()
@@ -286,17 +520,28 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
       # something went wrong, the image is empty
       raise ValueError("Segmentation failed - the output was empty...")
 
-    # no preview, run the whole thing! we never use the vesselness node here, just the original one
     evolImageData.DeepCopy(
-      segmentationLogic.performEvolution(sourceVolume.GetImageData(), initImageData, levelSetParameters.iterationNumber,
+      segmentationLogic.performEvolution(sourceImageData, initImageData, levelSetParameters.iterationNumber,
                                          levelSetParameters.inflation, levelSetParameters.curvature,
                                          levelSetParameters.attraction, levelSetParameters.levelSetMethod))
 
     # create segmentation labelMap
     labelMap = vtk.vtkImageData()
     labelMap.DeepCopy(segmentationLogic.buildSimpleLabelMap(evolImageData, 5, 0))
+    return evolImageData, labelMap
+
+  @classmethod
+  def _levelSetOutput(cls, sourceVolume, croppedSourceVolume, labelMap, modelImageData, lazyModel):
+    """Creates the level set segmentation volume resampled on the source volume and its boundary model.
+    The model is constructed from modelImageData if provided (expected with the source volume geometry) and from the
+    resampled segmentation volume otherwise.
 
+    Returns
+    -------
+    Tuple[vtkMRMLLabelMapVolumeNode, vtkMRMLModelNode or LazyVolumeBoundaryModel]
+    """
     # propagate the label map to the node
+    tmpVolume = createLabelMapVolumeNodeBasedOnModel(croppedSourceVolume, "LevelSetSegmentation")
     tmpVolume.SetAndObserveImageData(labelMap)
 
     # Resample output volume to be the same size and orientation as non cropped volume
@@ -307,9 +552,10 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
     slicer.mrmlScene.RemoveNode(tmpVolume)
 
     # Construct model boundary mesh
-    outModel = RVXLiverSegmentationLogic.createVolumeBoundaryModel(outVolume, "LevelSetSegmentationModel", evolImageData)
-
-    return seedsNodes, stoppersNodes, outVolume, outModel
+    outModel = LazyVolumeBoundaryModel(outVolume, "LevelSetSegmentationModel", modelImageData)
+    if not lazyModel:
+      outModel = outModel.get()
+    return outVolume, outModel
 
   @classmethod
   def resampleLabelMap(cls, newVolumeTemplate, labelMapToResample, labelMapName):
@@ -355,10 +601,17 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
     ijkToRasMatrix = vtk.vtkMatrix4x4()
     sourceVolume.GetIJKToRASMatrix(ijkToRasMatrix)
 
-    # generate 3D model and call marching cubes
+    # generate 3D model and call marching cubes on the part of the image containing the boundary only
     modelPolyData = vtk.vtkPolyData()
-    modelPolyData.DeepCopy(
-      VMTKModule.getLevelSetSegmentationLogic().marchingCubes(imageData, ijkToRasMatrix, threshold))
+    boundaryExtent = RVXLiverSegmentationLogic.calculateBoundaryExtent(imageData, threshold)
+    if boundaryExtent is not None:
+      # Extracted VOI keeps the input IJK indices and can be used with the source ijkToRas transform as is
+      extractVOI = vtk.vtkExtractVOI()
+      extractVOI.SetInputData(imageData)
+      extractVOI.SetVOI(*boundaryExtent)
+      extractVOI.Update()
+      modelPolyData.DeepCopy(
+        VMTKModule.getLevelSetSegmentationLogic().marchingCubes(extractVOI.GetOutput(), ijkToRasMatrix, threshold))
 
     # Create model node and associate model poly data
     modelNode = createModelNode(modelName)
@@ -367,6 +620,55 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
 
     return modelNode
 
+  @staticmethod
+  def calculateBoundaryExtent(imageData, threshold):
+    """Calculates the smallest image extent containing the iso surface at the given threshold.
+
+    Marching cubes cells crossing the surface contain voxels both above and below the threshold. The surface is then
+    contained in the intersection of the bounding boxes of both voxel sets, padded by one voxel.
+
+    Parameters
+    ----------
+    imageData: vtkImageData
+    threshold: float
+
+    Returns
+    -------
+    List[int] or None
+      [iMin, iMax, jMin, jMax, kMin, kMax] extent or None if the image doesn't contain any surface
+    """
+    extent = imageData.GetExtent()
+    dimensions = imageData.GetDimensions()
+    array = vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(dimensions[::-1])
+
+    isAbove = array >= threshold
+    aboveBounds = RVXLiverSegmentationLogic._nonZeroBounds(isAbove)
+    belowBounds = RVXLiverSegmentationLogic._nonZeroBounds(~isAbove)
+    if aboveBounds is None or belowBounds is None:
+      return None
+
+    boundaryExtent = []
+    for axis, kjiAxis in enumerate(reversed(range(3))):
+      axisMin = max(aboveBounds[kjiAxis][0], belowBounds[kjiAxis][0]) - 1
+      axisMax = min(aboveBounds[kjiAxis][1], belowBounds[kjiAxis][1]) + 1
+      axisMin, axisMax = max(axisMin, 0), min(axisMax, dimensions[axis] - 1)
+      if axisMin > axisMax:
+        return None
+      boundaryExtent += [extent[2 * axis] + axisMin, extent[2 * axis] + axisMax]
+    return boundaryExtent
+
+  @staticmethod
+  def _nonZeroBounds(mask):
+    """Returns the [min, max] indices of the True values of mask along each of its axes or None if mask is empty"""
+    bounds = []
+    for axis in range(mask.ndim):
+      otherAxes = tuple(i for i in range(mask.ndim) if i != axis)
+      nonZero = np.nonzero(np.any(mask, axis=otherAxes))[0]
+      if len(nonZero) == 0:
+        return None
+      bounds.append((nonZero[0], nonZero[-1]))
+    return bounds
+
   @staticmethod
   def openSurfaceAtPoint(polyData, seed):
     """
@@ -374,30 +676,47 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
 
     Interface has changed between versions of the VMTK module and module logic cannot be used as is for all users.
     """
+    RVXLiverSegmentationLogic.openSurfaceAtPoints(polyData, [seed])
+
+  @staticmethod
+  def openSurfaceAtPoints(polyData, seeds):
+    """Opens the surface at the surface points closest to each seed.
+
+    Point locator and point to cell links are built once for all the seeds and the deleted cells are removed once.
+
+    Parameters
+    ----------
+    polyData : vtkPolyData
+      Surface to open. Modified in place.
+    seeds : List[List[float]]
+      Positions where the surface should be opened
+    """
     pointLocator = vtk.vtkPointLocator()
     pointLocator.SetDataSet(polyData)
     pointLocator.BuildLocator()
 
-    # find the closest point next to the seed on the surface
-    pointId = pointLocator.FindClosestPoint(seed)
-
-    if pointId < 0:
-      # Calling GetPoint(-1) would crash the application
-      raise ValueError("openSurfaceAtPoint failed: empty input polydata")
-
     # Tell the polydata to build 'upward' links from points to cells
     polyData.BuildLinks()
-    # Mark cells as deleted
+
     cellIds = vtk.vtkIdList()
-    polyData.GetPointCells(pointId, cellIds)
-    for cellIdIndex in range(cellIds.GetNumberOfIds()):
-      polyData.DeleteCell(cellIds.GetId(cellIdIndex))
+    for seed in seeds:
+      # find the closest point next to the seed on the surface
+      pointId = pointLocator.FindClosestPoint(seed)
+
+      if pointId < 0:
+        # Calling GetPoint(-1) would crash the application
+        raise ValueError("openSurfaceAtPoint failed: empty input polydata")
+
+      # Mark cells as deleted
+      polyData.GetPointCells(pointId, cellIds)
+      for cellIdIndex in range(cellIds.GetNumberOfIds()):
+        polyData.DeleteCell(cellIds.GetId(cellIdIndex))
 
     # Remove the marked cells
     polyData.RemoveDeletedCells()
 
   @staticmethod
-  def centerLineFilter(levelSetSegmentationModel, endPoints):
+  def centerLineFilter(levelSetSegmentationModel, endPoints, centerlineParameters=None, surfaceCache=None):
     """
     Extracts center line from input level set segmentation model (ie : vessel polyData) and start and end points
     Implementation copied from :
@@ -413,6 +732,10 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
       Start point for the vessel
     endPoints : vtkMRMLMarkupsFiducialNode
       End points for the vessel
+    centerlineParameters : CenterlineParameters or None
+      Surface preprocessing parameters. If None, uses default parameters.
+    surfaceCache : PreprocessedSurfaceCache or None
+      Cache of the preprocessed surfaces. If None, the surface is always preprocessed.
 
     Returns
     -------
@@ -429,12 +752,9 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
     logic = VMTKModule.getCenterlineExtractionLogic()
 
     # Preprocess poly data
-    targetNumberOfPoints = 5000
-    decimationAggressiveness = 4.0
-    subdivideInputSurface = False
     inputSurfacePolyData = logic.polyDataFromNode(levelSetSegmentationModel, None)
-    preprocessedPolyData = logic.preprocess(inputSurfacePolyData, targetNumberOfPoints, decimationAggressiveness,
-                                            subdivideInputSurface)
+    preprocessedPolyData = RVXLiverSegmentationLogic.preprocessCenterlineSurface(inputSurfacePolyData,
+                                                                                 centerlineParameters, surfaceCache)
 
     # grab the current coordinates
     centerlinePolyData, _ = logic.extractCenterline(preprocessedPolyData, endPoints, 1.0)
@@ -443,7 +763,53 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
     return centerLineModel
 
   @staticmethod
-  def centerLineFilterFromNodePositions(levelSetSegmentationModel, startPoints, endPoints):
+  def preprocessCenterlineSurface(surfacePolyData, centerlineParameters=None, surfaceCache=None):
+    """Decimates and optionally subdivides input surface for centerline extraction.
+
+    Parameters
+    ----------
+    surfacePolyData : vtkPolyData
+    centerlineParameters : CenterlineParameters or None
+      Surface preprocessing parameters. If None, uses default parameters.
+    surfaceCache : PreprocessedSurfaceCache or None
+      Cache of the preprocessed surfaces. If None, the surface is always preprocessed.
+
+    Returns
+    -------
+    vtkPolyData
+      Preprocessed surface. If surfaceCache is provided, the surface is shared with the cache and should not be
+      modified.
+    """
+    if centerlineParameters is None:
+      centerlineParameters = CenterlineParameters()
+
+    def preprocess():
+      targetNumberOfPoints = centerlineParameters.targetNumberOfPoints(
+        RVXLiverSegmentationLogic._surfaceArea(surfacePolyData))
+      return VMTKModule.getCenterlineExtractionLogic().preprocess(surfacePolyData, targetNumberOfPoints,
+                                                                  centerlineParameters.decimationAggressiveness,
+                                                                  centerlineParameters.subdivideInputSurface)
+
+    if surfaceCache is None:
+      return preprocess()
+
+    preprocessingKey = (centerlineParameters.minimumVesselRadius, centerlineParameters.edgesPerCircumference,
+                        centerlineParameters.minimumNumberOfPoints, centerlineParameters.maximumNumberOfPoints,
+                        centerlineParameters.decimationAggressiveness, centerlineParameters.subdivideInputSurface)
+    return surfaceCache.getOrPreprocess(surfacePolyData, preprocessingKey, preprocess)
+
+  @staticmethod
+  def _surfaceArea(surfacePolyData):
+    triangleFilter = vtk.vtkTriangleFilter()
+    triangleFilter.SetInputData(surfacePolyData)
+    massProperties = vtk.vtkMassProperties()
+    massProperties.SetInputConnection(triangleFilter.GetOutputPort())
+    massProperties.Update()
+    return massProperties.GetSurfaceArea()
+
+  @staticmethod
+  def centerLineFilterFromNodePositions(levelSetSegmentationModel, startPoints, endPoints, centerlineParameters=None,
+                                        surfaceCache=None):
     """ Extracts centerline from input level set segmentation model (ie : vessel polyData) and start and end points
 
     Parameters
@@ -454,6 +820,10 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
       Start position for the vessel
     endPoints : List[list[float]]
       End position for the vessel
+    centerlineParameters : CenterlineParameters or None
+      Surface preprocessing parameters. If None, uses default parameters.
+    surfaceCache : PreprocessedSurfaceCache or None
+      Cache of the preprocessed surfaces. If None, the surface is always preprocessed.
 
     Returns
     -------
@@ -464,7 +834,8 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
     endPoints = createFiducialNode("endPoint", *(startPoints + endPoints))
 
     # Call centerline extraction
-    centerLineModel = RVXLiverSegmentationLogic.centerLineFilter(levelSetSegmentationModel, endPoints)
+    centerLineModel = RVXLiverSegmentationLogic.centerLineFilter(levelSetSegmentationModel, endPoints,
+                                                                 centerlineParameters, surfaceCache)
 
     # remove end point from slicer
     removeNodeFromMRMLScene(endPoints)
@@ -472,6 +843,127 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
     # Return centerLineModel
     return centerLineModel
 
+  @staticmethod
+  def centerLineFilterPerBranch(levelSetSegmentationModel, branchPaths, centerlineParameters=None, clipMargin=10.0,
+                                surfaceCache=None, maxWorkers=None):
+    """Extracts center line from input level set segmentation model branch by branch.
+
+    The surface is preprocessed once and clipped around each branch path. Each branch centerline is then extracted on
+    its clipped surface only and the branch centerlines are stitched together in one model.
+
+    Clipping and end point creation are done in the calling thread. Branch extractions only work on their own clipped
+    surface and end points with their own VMTK logic and filters and are executed concurrently by at most maxWorkers
+    threads, the wrapped VTK calls releasing the GIL.
+
+    Parameters
+    ----------
+    levelSetSegmentationModel : vtkMRMLModelNode
+      Result from LevelSetSegmentation representing outer vessel mesh
+    branchPaths : List[Tuple[str, List[List[float]]]]
+      Branch names and node positions from branch start to branch end (see NodeBranches.branchPaths)
+    centerlineParameters : CenterlineParameters or None
+      Surface preprocessing parameters. If None, uses default parameters.
+    clipMargin : float
+      Margin (in mm) added around the branch path bounding box when clipping the surface
+    surfaceCache : PreprocessedSurfaceCache or None
+      Cache of the preprocessed surfaces. If None, the surface is always preprocessed.
+    maxWorkers : int or None
+      Maximum number of concurrent branch extractions. If None, uses the number of CPUs. 1 extracts the branches
+      sequentially.
+
+    Returns
+    -------
+    centerLineModel : vtkMRMLModelNode
+      Contains center line vtkPolyData extracted from input vessel model. The "BranchId" cell data contains the index
+      of the branch in branchPaths.
+    """
+    raiseValueErrorIfInvalidType(levelSetSegmentationModel=(levelSetSegmentationModel, "vtkMRMLModelNode"))
+
+    logic = VMTKModule.getCenterlineExtractionLogic()
+    inputSurfacePolyData = logic.polyDataFromNode(levelSetSegmentationModel, None)
+    preprocessedPolyData = RVXLiverSegmentationLogic.preprocessCenterlineSurface(inputSurfacePolyData,
+                                                                                 centerlineParameters, surfaceCache)
+
+    # Clip surfaces and create end points in the calling thread. End points are not added to the scene.
+    branchInputs = []
+    for branchId, (_, pathPoints) in enumerate(branchPaths):
+      branchSurface = RVXLiverSegmentationLogic.clipSurfaceAroundPath(preprocessedPolyData, pathPoints, clipMargin)
+      if branchSurface.GetNumberOfPoints() == 0:
+        continue
+
+      endPoints = slicer.vtkMRMLMarkupsFiducialNode()
+      endPoints.AddControlPoint(pathPoints[0])
+      endPoints.AddControlPoint(pathPoints[-1])
+      branchInputs.append((branchId, branchSurface, endPoints))
+
+    def extractBranchCenterLine(branchInput):
+      branchId, branchSurface, endPoints = branchInput
+      centerLinePolyData, _ = VMTKModule.getCenterlineExtractionLogic().extractCenterline(branchSurface, endPoints, 1.0)
+      return branchId, centerLinePolyData
+
+    maxWorkers = max(1, maxWorkers or os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+      branchCenterLines = list(executor.map(extractBranchCenterLine, branchInputs))
+
+    # Stitch branch centerlines together
+    appendFilter = vtk.vtkAppendPolyData()
+    for branchId, centerLinePolyData in branchCenterLines:
+      branchIdArray = vtk.vtkIntArray()
+      branchIdArray.SetName("BranchId")
+      branchIdArray.SetNumberOfTuples(centerLinePolyData.GetNumberOfCells())
+      branchIdArray.Fill(branchId)
+      centerLinePolyData.GetCellData().AddArray(branchIdArray)
+      appendFilter.AddInputData(centerLinePolyData)
+
+    centerLinePolyData = vtk.vtkPolyData()
+    if branchCenterLines:
+      appendFilter.Update()
+      centerLinePolyData.DeepCopy(appendFilter.GetOutput())
+
+    centerLineModel = createModelNode("CenterLineModel")
+    centerLineModel.SetAndObservePolyData(centerLinePolyData)
+    return centerLineModel
+
+  @staticmethod
+  def clipSurfaceAroundPath(polyData, pathPoints, margin):
+    """Clips the input surface to the bounding box of the path points expanded by margin and keeps the surface region
+    closest to the last path point.
+
+    Parameters
+    ----------
+    polyData : vtkPolyData
+    pathPoints : List[List[float]]
+    margin : float
+
+    Returns
+    -------
+    vtkPolyData
+    """
+    pathPoints = np.array(pathPoints, dtype=float)
+    lowerBounds = pathPoints.min(axis=0) - margin
+    upperBounds = pathPoints.max(axis=0) + margin
+
+    box = vtk.vtkBox()
+    box.SetBounds(lowerBounds[0], upperBounds[0], lowerBounds[1], upperBounds[1], lowerBounds[2], upperBounds[2])
+
+    clipper = vtk.vtkClipPolyData()
+    clipper.SetInputData(polyData)
+    clipper.SetClipFunction(box)
+    clipper.InsideOutOn()
+
+    connectivity = vtk.vtkPolyDataConnectivityFilter()
+    connectivity.SetInputConnection(clipper.GetOutputPort())
+    connectivity.SetExtractionModeToClosestPointRegion()
+    connectivity.SetClosestPoint(*pathPoints[-1])
+
+    cleaner = vtk.vtkCleanPolyData()
+    cleaner.SetInputConnection(connectivity.GetOutputPort())
+    cleaner.Update()
+
+    clippedPolyData = vtk.vtkPolyData()
+    clippedPolyData.DeepCopy(cleaner.GetOutput())
+    return clippedPolyData
+
   @staticmethod
   def _isPointValid(point):
     return (point is not None) and (isinstance(point, slicer.vtkMRMLMarkupsFiducialNode)) and (
@@ -481,13 +973,20 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
   def _areExtremitiesValid(startPoint, endPoint):
     return RVXLiverSegmentationLogic._isPointValid(startPoint) and RVXLiverSegmentationLogic._isPointValid(endPoint)
 
-  def updateVesselnessVolume(self, nodePositions):
+  def updateVesselnessVolume(self, nodePositions, nodeEdges=None):
     """Update vesselness volume node for current input volume and current filter parameters.
 
     If input node is not defined, no processing will be done. The method will return whether update was processed or
     not. Update can be cancelled either because of improper input node or if update for given input node + parameters
     has already been ran before.
 
+    Parameters
+    ----------
+    nodePositions: Iterable[List[float]]
+      Positions of the tree nodes
+    nodeEdges: List[Tuple[List[float], List[float]]] or None
+      Parent and child positions of each tree edge. Used to cluster the nodes when more than one bounding box is used.
+
     Returns
     -------
     bool
@@ -500,17 +999,23 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
       return False
 
     removeNodeFromMRMLScene(self._vesselnessVolume)
-    removeNodeFromMRMLScene(self._croppedInputVolume)
-    removeNodeFromMRMLScene(self._inputRoi)
+    self._removeCroppedInputVolume()
+    roiBoxes = None
     if self._vesselnessFilterParam.useROI:
-      self._inputRoi = self._createROIFromNodePositions(nodePositions)
-      self._croppedInputVolume = cropSourceVolume(self._inputVolume, self._inputRoi)
+      roiBoxes = self.calculateRoiBoxes(nodePositions, nodeEdges, self._vesselnessFilterParam.roiClusterCount,
+                                        self._vesselnessFilterParam.minROIExtent,
+                                        self._vesselnessFilterParam.roiGrowthFactor)
+      lower = np.min([lowerBox for lowerBox, _ in roiBoxes], axis=0)
+      upper = np.max([upperBox for _, upperBox in roiBoxes], axis=0)
+      self._croppedInputVolume = cropSourceVolumeToRASBounds(self._inputVolume, lower, upper)
+      self._croppedInputVolume.GetDisplayNode().SetVisibility(False)
     else:
-      self._croppedInputVolume = cloneSourceVolume(self._inputVolume)
-
-    self._croppedInputVolume.GetDisplayNode().SetVisibility(False)
+      # Filters only read their input volume, the input volume doesn't need to be copied
+      self._croppedInputVolume = self._inputVolume
 
-    if self._vesselnessFilterParam.useVmtkFilter:
+    if roiBoxes is not None and len(roiBoxes) > 1:
+      self._vesselnessVolume = self._applyVesselnessFilterPerBox(self._croppedInputVolume, roiBoxes)
+    elif self._vesselnessFilterParam.useVmtkFilter:
       self._vesselnessVolume = self._applyVmtkVesselnessFilter(self._croppedInputVolume)
     else:
       self._vesselnessVolume = self._applySatoVesselnessFilter(self._croppedInputVolume)
@@ -536,20 +1041,40 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
 
     return center, radius
 
-  def _createROIFromNodePositions(self, nodePositions):
-    roi = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsROINode")
-    roi.CreateDefaultDisplayNodes()
-    roi.GetDisplayNode().SetVisibility(False)
-    roi.SetName(slicer.mrmlScene.GetUniqueNameByString("VolumeCropROI"))
+  @staticmethod
+  def calculateRoiBoxes(nodePositions, nodeEdges, clusterCount, minExtent, growthFactor):
+    """Calculates the RAS boxes in which the vesselness will be computed.
 
-    center, radius = self.calculateRoiExtent(nodePositions, self._vesselnessFilterParam.minROIExtent,
-                                             self._vesselnessFilterParam.roiGrowthFactor)
+    With one cluster, returns the box around every node position. Otherwise, the edges (or node positions if no edges
+    are provided) are clustered using k-means on their middle positions. Each box contains both ends of the edges of
+    its cluster so that the union of the boxes contains every edge.
 
-    roi.SetXYZ(center)
-    roi.SetRadiusXYZ(radius)
-    roi.RemoveAllDisplayNodeIDs()
+    Returns
+    -------
+    List[Tuple[np.ndarray, np.ndarray]]
+      Lower and upper RAS corners of each box
+    """
+    nodePositions = list(nodePositions)
+    if not nodeEdges:
+      nodeEdges = [(position, position) for position in nodePositions]
 
-    return roi
+    if clusterCount <= 1 or len(nodeEdges) <= 1:
+      clusterPositions = [nodePositions]
+    else:
+      edgeEnds = np.array(nodeEdges, dtype=float)
+      labels = kMeansLabels(edgeEnds.mean(axis=1), clusterCount)
+      clusterPositions = [edgeEnds[labels == label].reshape(-1, 3) for label in np.unique(labels)]
+
+    boxes = []
+    for positions in clusterPositions:
+      center, radius = RVXLiverSegmentationLogic.calculateRoiExtent(positions, minExtent, growthFactor)
+      boxes.append((center - radius, center + radius))
+    return boxes
+
+  def _removeCroppedInputVolume(self):
+    if self._croppedInputVolume is not self._inputVolume:
+      removeNodeFromMRMLScene(self._croppedInputVolume)
+    self._croppedInputVolume = None
 
   def _isInvalidVolumeInput(self):
     return self._inputVolume is None
@@ -557,7 +1082,7 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
   def getCurrentVesselnessVolume(self):
     return self._vesselnessVolume
 
-  def extractVesselVolumeFromPosition(self, seedsPositions, endPositions):
+  def extractVesselVolumeFromPosition(self, seedsPositions, endPositions, lazyModel=False):
     """Extract vessels volume and model given two input lists of markups positions and current loaded input volume.
     To be run, seeds positions and end positions must contain at least one position each.
 
@@ -567,7 +1092,8 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
       List of points to use as seeds during VMTK level set segmentation algorithm
     endPositions: List[List[float]]
       List of points to use as stoppers during VMTK level set segmentation algorithm
-    levelSetParameters: LevelSetParameters
+    lazyModel: bool
+      If True, the model is returned as a LazyVolumeBoundaryModel and marching cubes is only run when requested
 
     Returns
     -------
@@ -577,7 +1103,7 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
       Nodes used as stoppers during level set segmentation (aggregate of start point and end point)
     LevelSetSegmentation : vtkMRMLLabelMapVolumeNode
       segmentation volume output
-    LevelSetModel : vtkMRMLModelNode
+    LevelSetModel : vtkMRMLModelNode or LazyVolumeBoundaryModel
       Model after marching cubes on the segmentation data
     """
     if self._vesselnessVolume is None:
@@ -586,4 +1112,75 @@ class RVXLiverSegmentationLogic(ScriptedLoadableModuleLogic, IRVXLiverSegmentati
                                                             croppedSourceVolume=self._croppedInputVolume,
                                                             vesselnessVolume=self.getCurrentVesselnessVolume(),
                                                             seedsPositions=seedsPositions, endPositions=endPositions,
-                                                            levelSetParameters=self.levelSetParameters)
+                                                            levelSetParameters=self.levelSetParameters,
+                                                            lazyModel=lazyModel)
+
+  def extractVesselVolumesInRASBoxes(self, runs, lazyModel=False, maxWorkers=None):
+    """Extracts one vessel volume per input run. The level set of each run only processes the input and vesselness
+    voxels inside of the run RAS box and its output is resampled on the input volume.
+
+    Runs are processed by batches of maxWorkers runs. Cropping, seed creation and output resampling work on scene
+    nodes and are done in the calling thread. The level set evolutions of a batch only work on the image data of their
+    own crops with new VMTK filters and are executed concurrently, the wrapped VTK calls releasing the GIL. Only the
+    cropped volumes of the current batch are kept in the scene.
+
+    Parameters
+    ----------
+    runs: List[Tuple[List[List[float]], List[List[float]], List[float], List[float]]]
+      Seed positions, end positions, lower RAS corner and upper RAS corner of each run
+    lazyModel: bool
+      If True, the models are returned as LazyVolumeBoundaryModel and marching cubes is only run when requested
+    maxWorkers: int or None
+      Maximum number of concurrent level set evolutions. If None, uses the number of CPUs. 1 extracts the runs
+      sequentially.
+
+    Returns
+    -------
+    List[Tuple[vtkMRMLMarkupsFiducialNode, vtkMRMLMarkupsFiducialNode, vtkMRMLLabelMapVolumeNode, vtkMRMLModelNode]]
+      Seeds, stoppers, segmentation volume and model of each run (see extractVesselVolumeFromPosition)
+
+    Raises
+    ------
+    ValueError
+      If the vesselness volume was not extracted or if a run box is outside of the vesselness volume
+    """
+    if self._vesselnessVolume is None:
+      raise ValueError("Please extract vesselness volume before extracting vessels")
+
+    def evolveRun(boxRun):
+      boxSource, boxVesselness, _, _, seeds, stoppers = boxRun
+      _, labelMap = self._levelSetEvolution(boxSource.GetImageData(), boxVesselness.GetImageData(), seeds, stoppers,
+                                            self.levelSetParameters)
+      return labelMap
+
+    maxWorkers = max(1, maxWorkers or os.cpu_count() or 1)
+    outputs = []
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+      for batchStart in range(0, len(runs), maxWorkers):
+        boxRuns = [self._cropLevelSetRun(*run) for run in runs[batchStart:batchStart + maxWorkers]]
+        for boxRun, labelMap in zip(boxRuns, list(executor.map(evolveRun, boxRuns))):
+          # Evolution image has the box geometry, the model is constructed from the resampled volume instead
+          boxSource, boxVesselness, seedsNodes, stoppersNodes, _, _ = boxRun
+          outVolume, outModel = self._levelSetOutput(self._inputVolume, boxSource, labelMap, None, lazyModel)
+          removeNodesFromMRMLScene([boxSource, boxVesselness])
+          outputs.append((seedsNodes, stoppersNodes, outVolume, outModel))
+    return outputs
+
+  def _cropLevelSetRun(self, seedsPositions, endPositions, lowerRAS, upperRAS):
+    """Crops the input and vesselness volumes to the run RAS box and creates the run seeds on the cropped volumes.
+
+    Returns
+    -------
+    Tuple[vtkMRMLScalarVolumeNode, vtkMRMLScalarVolumeNode, vtkMRMLMarkupsFiducialNode, vtkMRMLMarkupsFiducialNode,
+    vtkIdList, vtkIdList]
+      Cropped input volume, cropped vesselness volume, seeds and stoppers nodes and their cropped volume point ids
+    """
+    # Cropped input volume and vesselness volume share the same geometry and are cropped with the same IJK ranges
+    ijkSlices = rasBoundsToIJKSlices(self._vesselnessVolume, lowerRAS, upperRAS)
+    boxSource = cropSourceVolumeToIJKSlices(self._croppedInputVolume, ijkSlices)
+    boxVesselness = cropSourceVolumeToIJKSlices(self._vesselnessVolume, ijkSlices)
+    boxSource.GetDisplayNode().SetVisibility(False)
+    boxVesselness.GetDisplayNode().SetVisibility(False)
+
+    seedsNodes, stoppersNodes, seeds, stoppers = self._createLevelSetSeeds(seedsPositions, endPositions, boxVesselness)
+    return boxSource, boxVesselness, seedsNodes, stoppersNodes, seeds, stoppers
@@ -1,4 +1,5 @@
-from itertools import count
+from collections import OrderedDict
+import importlib
 import logging
 import os
 from pathlib import Path
@@ -9,6 +10,8 @@ import qt
 import slicer
 import vtk
 
+from .VesselTreeTypes import Signal
+
 
 class Icons(object):
   """ Object responsible for the different icons in the module. The module doesn't have any icons internally but pulls
@@ -534,31 +537,64 @@ def createDisplayNodeIfNecessary(volumeNode, presetName=None):
   return volumeDisplayNode
 
 
-class Signal(object):
-  """ Qt like signal slot connections. Enables using the same semantics with Slicer as qt.Signal lead to application
-  crash.
-  (see : https://discourse.slicer.org/t/custom-signal-slots-with-pythonqt/3278/5)
+class CoalescingDispatcher(object):
+  """Merges bursts of events into one callback call per frame.
+
+  Each posted event stores its key and starts a single shot timer if not already running. When the timer expires, the
+  callback is called once with the distinct keys posted since the last flush. The flushed signal reports the flushed
+  keys and the number of events merged in the flush.
   """
 
-  def __init__(self, *typeInfo):
-    self._id = count(0, 1)
-    self._connectDict = {}
-    self._typeInfo = str(typeInfo)
+  def __init__(self, callback, intervalMs=16):
+    """
+    Parameters
+    ----------
+    callback: Callable[[List], None]
+      Called with the list of distinct posted keys in posting order
+    intervalMs: int
+      Delay between the first event of a burst and the flush. Default to one frame at 60 fps.
+    """
+    self.flushed = Signal("List keys, int eventCount")
+
+    self._callback = callback
+    self._pendingKeys = OrderedDict()
+    self._pendingEventCount = 0
+    self.coalescedEventCount = 0
+
+    self._timer = qt.QTimer()
+    self._timer.setSingleShot(True)
+    self._timer.setInterval(intervalMs)
+    self._timer.connect("timeout()", self.flush)
+
+  def post(self, key=None):
+    """Adds the input key to the pending keys and schedules the flush"""
+    self._pendingKeys[key] = None
+    self._pendingEventCount += 1
+    if not self._timer.isActive():
+      self._timer.start()
+
+  def hasPendingEvents(self):
+    return self._pendingEventCount > 0
+
+  def flush(self):
+    """Calls the callback with the pending keys if any event was posted since the last flush"""
+    self._timer.stop()
+    if not self.hasPendingEvents():
+      return
 
-  def emit(self, *args, **kwargs):
-    for slot in self._connectDict.values():
-      slot(*args, **kwargs)
+    keys, eventCount = list(self._pendingKeys.keys()), self._pendingEventCount
+    self._pendingKeys = OrderedDict()
+    self._pendingEventCount = 0
+    self.coalescedEventCount += eventCount - 1
 
-  def connect(self, slot):
-    nextId = next(self._id)
-    self._connectDict[nextId] = slot
-    return nextId
+    self._callback(keys)
+    self.flushed.emit(keys, eventCount)
 
-  def disconnect(self, connectId):
-    if connectId in self._connectDict:
-      del self._connectDict[connectId]
-      return True
-    return False
+  def cancel(self):
+    """Drops the pending events without calling the callback"""
+    self._timer.stop()
+    self._pendingKeys = OrderedDict()
+    self._pendingEventCount = 0
 
 
 def removeNodeFromMRMLScene(node):
@@ -590,23 +626,99 @@ def removeNodesFromMRMLScene(nodesToRemove):
 
 
 def cropSourceVolume(sourceVolume, roi):
-  cropVolumeNode = slicer.vtkMRMLCropVolumeParametersNode()
-  cropVolumeNode.SetScene(slicer.mrmlScene)
-  cropVolumeNode.SetName(slicer.mrmlScene.GetUniqueNameByString(sourceVolume.GetName() + "Cropped"))
-  slicer.mrmlScene.AddNode(cropVolumeNode)
+  """Crops the source volume to the axis aligned bounding box of the input ROI node.
+
+  Parameters
+  ----------
+  sourceVolume: vtkMRMLScalarVolumeNode
+  roi: vtkMRMLMarkupsROINode
 
-  cropVolumeNode.SetInputVolumeNodeID(sourceVolume.GetID())
-  cropVolumeNode.SetROINodeID(roi.GetID())
+  Returns
+  -------
+  vtkMRMLScalarVolumeNode
+    New volume containing the source voxels inside the ROI
+  """
+  center, radius = [0] * 3, [0] * 3
+  roi.GetXYZ(center)
+  roi.GetRadiusXYZ(radius)
+  return cropSourceVolumeToRASBounds(sourceVolume, np.array(center) - radius, np.array(center) + radius)
 
-  cropVolumeLogic = slicer.modules.cropvolume.logic()
-  cropVolumeLogic.Apply(cropVolumeNode)
 
-  return cropVolumeNode.GetOutputVolumeNode()
+def cropSourceVolumeToRASBounds(sourceVolume, lowerRAS, upperRAS):
+  """Crops the source volume to the given RAS box.
 
+  The crop is expressed as an IJK index range over the source voxel array. Only the voxels inside the range are copied
+  to the output volume which keeps the source orientation and spacing with a shifted origin. No CropVolume parameter
+  node nor ROI node is created.
+
+  Parameters
+  ----------
+  sourceVolume: vtkMRMLScalarVolumeNode
+  lowerRAS: List[float]
+    Lower RAS corner of the box
+  upperRAS: List[float]
+    Upper RAS corner of the box
+
+  Returns
+  -------
+  vtkMRMLScalarVolumeNode
+    New volume containing the source voxels inside the box
+  """
+  return cropSourceVolumeToIJKSlices(sourceVolume, rasBoundsToIJKSlices(sourceVolume, lowerRAS, upperRAS))
+
+
+def cropSourceVolumeToIJKSlices(sourceVolume, ijkSlices):
+  """Crops the source volume to the given I, J and K index ranges.
+
+  Returns
+  -------
+  vtkMRMLScalarVolumeNode
+    New volume containing the source voxels inside the index ranges
+  """
+  ijkToRas = vtk.vtkMatrix4x4()
+  sourceVolume.GetIJKToRASMatrix(ijkToRas)
+  cropOrigin = arrayFromVTKMatrix(ijkToRas).dot([ijkSlice.start for ijkSlice in ijkSlices] + [1])[:3]
 
-def cloneSourceVolume(sourceVolume):
-  cloneName = slicer.mrmlScene.GetUniqueNameByString(sourceVolume.GetName() + "Cloned")
-  return slicer.vtkSlicerVolumesLogic().CloneVolume(slicer.mrmlScene, sourceVolume, cloneName, True)
+  croppedVolume = createVolumeNodeBasedOnModel(sourceVolume, sourceVolume.GetName() + "Cropped",
+                                               sourceVolume.GetClassName())
+  croppedVolume.SetOrigin(cropOrigin)
+  slicer.util.updateVolumeFromArray(croppedVolume, slicer.util.arrayFromVolume(sourceVolume)[ijkSlices[::-1]])
+  if croppedVolume.GetDisplayNode() is None:
+    croppedVolume.CreateDefaultDisplayNodes()
+  return croppedVolume
+
+
+def rasBoundsToIJKSlices(sourceVolume, lowerRAS, upperRAS):
+  """Converts the input RAS box to the smallest IJK index range of the source volume containing the box.
+
+  Returns
+  -------
+  Tuple[slice, slice, slice]
+    I, J and K index ranges clipped to the source volume dimensions
+
+  Raises
+  ------
+  ValueError if the box doesn't intersect the source volume
+  """
+  rasToIjk = vtk.vtkMatrix4x4()
+  sourceVolume.GetRASToIJKMatrix(rasToIjk)
+  rasToIjk = arrayFromVTKMatrix(rasToIjk)
+
+  # Box corners may be rotated in IJK coordinates, use the IJK bounds of the eight corners
+  corners = np.array([[x, y, z, 1] for x in (lowerRAS[0], upperRAS[0]) for y in (lowerRAS[1], upperRAS[1])
+                      for z in (lowerRAS[2], upperRAS[2])])
+  ijkCorners = rasToIjk.dot(corners.T).T[:, :3]
+  dimensions = sourceVolume.GetImageData().GetDimensions()
+
+  lower = np.floor(ijkCorners.min(axis=0)).astype(int)
+  upper = np.ceil(ijkCorners.max(axis=0)).astype(int) + 1
+  if np.any(upper <= 0) or np.any(lower >= np.array(dimensions)):
+    raise ValueError("RAS box [{}, {}] is outside of volume {}".format(list(lowerRAS), list(upperRAS),
+                                                                       sourceVolume.GetName()))
+
+  lower = np.clip(lower, 0, np.array(dimensions) - 1)
+  upper = np.clip(upper, 1, dimensions)
+  return tuple(slice(l, u) for l, u in zip(lower, upper))
 
 
 def arrayFromVTKMatrix(vtk_matrix):
@@ -639,3 +751,40 @@ def getVolumeIJKToRASDirectionMatrixAsNumpyArray(vol):
 
 def resourcesPath():
   return Path(os.path.join(os.path.dirname(__file__), '..', 'Resources'))
+
+
+def isPythonModuleFound(moduleName):
+  try:
+    importlib.import_module(moduleName)
+    return True
+  except ImportError:
+    return False
+
+
+def installPythonPackageIfNeeded(moduleName, packageName, featureName):
+  """Proposes to install the input PIP package if the input Python module cannot be imported.
+
+  Parameters
+  ----------
+  moduleName: str
+    Name of the module to import (ex : skimage.morphology)
+  packageName: str
+    Name of the PIP package providing the module (ex : scikit-image)
+  featureName: str
+    Name of the feature requiring the package displayed to the user
+
+  Returns
+  -------
+  bool
+    True if the module can be imported, False if the user refused the installation or if the installation failed
+  """
+  if isPythonModuleFound(moduleName):
+    return True
+
+  if not slicer.util.confirmOkCancelDisplay("{} requires the {} Python package.\n\nInstall it now?".format(
+      featureName, packageName)):
+    return False
+
+  slicer.util.pip_install(packageName)
+  importlib.invalidate_caches()
+  return isPythonModuleFound(moduleName)
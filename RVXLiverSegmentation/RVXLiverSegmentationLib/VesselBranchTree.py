@@ -1,49 +1,64 @@
+import numpy as np
 import qt
 import slicer
 import vtk
 
 from RVXLiverSegmentationLib import Signal, PlaceStatus, VesselBranchWizard, removeNodeFromMRMLScene, InteractionStatus, \
-  VesselTreeColumnRole, VesselHelpWidget
-from .RVXLiverSegmentationUtils import Icons, getMarkupIdPositionDictionary, createMultipleMarkupFiducial, createButton
+  VesselTreeColumnRole, VesselHelpWidget, VesselTreeModel, preorderNodeIds, saveVesselTree, loadVesselTree, \
+  TREE_FILE_EXTENSION
+from .RVXLiverSegmentationUtils import Icons, createMultipleMarkupFiducial, createButton
+
+
+def nodeDisplayText(nodeId, status):
+  """
+  Returns
+  -------
+  str
+    Text displayed for the input node in the vessel tree views depending on the node place status
+  """
+  suffixMap = {PlaceStatus.NOT_PLACED: "<click here to start placing node>", PlaceStatus.PLACING: "*placing*",
+               PlaceStatus.INSERT_BEFORE: "*inserting before*"}
+
+  suffix = suffixMap.get(status, None)
+  return "{} {}".format(nodeId, suffix) if suffix is not None else nodeId
 
 
 class VesselBranchTreeItem(qt.QTreeWidgetItem):
-  """Helper class holding nodeId and nodeName in the VesselBranchTree
+  """Helper class holding nodeId and nodeName in the VesselBranchTree. Item status is stored in the tree model.
   """
 
-  def __init__(self, nodeId, status=PlaceStatus.NOT_PLACED):
+  def __init__(self, nodeId, treeModel):
     qt.QTreeWidgetItem.__init__(self)
     self.nodeId = nodeId
+    self._treeModel = treeModel
     self.setIcon(VesselTreeColumnRole.DELETE, Icons.delete)
-    self._status = status
     self.updateText()
 
   @property
   def status(self):
-    return self._status
+    return self._treeModel.getStatus(self.nodeId)
 
   @status.setter
   def status(self, status):
-    self._status = status
-    self.updateText()
+    self._treeModel.setStatus(self.nodeId, status)
 
   def updateText(self):
-    suffixMap = {PlaceStatus.NOT_PLACED: "<click here to start placing node>", PlaceStatus.PLACING: "*placing*",
-                 PlaceStatus.INSERT_BEFORE: "*inserting before*"}
-
-    suffix = suffixMap.get(self._status, None)
-    self.setText(0, "{} {}".format(self.nodeId, suffix) if suffix is not None else self.nodeId)
+    self.setText(0, nodeDisplayText(self.nodeId, self.status))
     self.setText(VesselTreeColumnRole.INSERT_BEFORE, "Insert Before")
 
 
 class VesselBranchTree(qt.QTreeWidget):
   """Tree representation of vessel branch nodes.
 
+  The tree structure and node status are stored in a VesselTreeModel. The widget is a view synchronized with the
+  model and forwards the structure queries to it. Changes done by dragging and dropping the items are written back to
+  the model.
+
   Class enables inserting new vessel node branches after or before existing nodes.
   Class signals when modified or user interacts with the UI.
   """
 
-  def __init__(self, vesselHelpWidget, parent=None):
+  def __init__(self, vesselHelpWidget, parent=None, treeModel=None):
     qt.QTreeWidget.__init__(self, parent)
 
     self.keyPressed = Signal("VesselBranchTreeItem, qt.Qt.Key")
@@ -51,6 +66,17 @@ class VesselBranchTree(qt.QTreeWidget):
 
     self._branchDict = {}
     self._vesselHelpWidget = vesselHelpWidget
+    self._isUpdatingModel = False
+    self._pendingNodeIds = set()
+    self._detachedExpandedStates = {}
+    self._hasPendingNodeChanges = False
+    self._isResetPending = True
+    self._model = treeModel if treeModel is not None else VesselTreeModel()
+    self._model.nodeInserted.connect(self._onNodeInserted)
+    self._model.nodeRemoved.connect(self._onNodeRemoved)
+    self._model.treeReset.connect(self._onTreeReset)
+    self._model.modified.connect(self._updateItemsFromModel)
+    self._model.statusChanged.connect(self._onStatusChanged)
 
     # Configure tree widget
     self.setColumnCount(3)
@@ -68,10 +94,19 @@ class VesselBranchTree(qt.QTreeWidget):
     self.setDragEnabled(True)
     self.setDropIndicatorShown(True)
     self.setDragDropMode(qt.QAbstractItemView.InternalMove)
+    self._updateItemsFromModel()
+
+  def getTreeModel(self):
+    """
+    Returns
+    -------
+    VesselTreeModel
+      Model holding the tree structure displayed by the widget
+    """
+    return self._model
 
   def clear(self):
-    self._branchDict = {}
-    qt.QTreeWidget.clear(self)
+    self._model.clear()
 
   def clickItem(self, item):
     item = self.getTreeWidgetItem(item) if isinstance(item, str) else item
@@ -91,15 +126,7 @@ class VesselBranchTree(qt.QTreeWidget):
     VesselBranchTreeItem or None
       Next vessel branch tree which has not been placed yet in the scene
     """
-    item = self.getTreeWidgetItem(nodeId)
-    if item is None:
-      return None
-
-    if item.status == PlaceStatus.NOT_PLACED:
-      return item
-
-    nextItem = self._getNextItem(nodeId)
-    return self.getNextUnplacedItem(nextItem.nodeId) if nextItem is not None else None
+    return self.getTreeWidgetItem(self._model.getNextUnplacedNodeId(nodeId))
 
   def isInTree(self, nodeId):
     """
@@ -113,13 +140,13 @@ class VesselBranchTree(qt.QTreeWidget):
     bool
       True if nodeId is part of the tree, False otherwise.
     """
-    return nodeId in self._branchDict.keys()
+    return self._model.isInTree(nodeId)
 
   def isRoot(self, nodeId):
     """
     :return: True if node doesn't have any parents
     """
-    return self.getParentNodeId(nodeId) is None
+    return self._model.isRoot(nodeId)
 
   def dropEvent(self, event):
     """On drop event, enforce structure of the tree is not broken.
@@ -139,51 +166,131 @@ class VesselBranchTree(qt.QTreeWidget):
 
     qt.QTreeWidget.keyPressEvent(self, event)
 
-  def _takeItem(self, nodeId):
-    """Remove item with given item id from the tree. Removes it from its parent if necessary
-    """
-    if nodeId is None:
-      return None
-    elif nodeId in self._branchDict:
-      nodeItem = self._branchDict[nodeId]
-      self._removeFromParent(nodeItem)
-      return nodeItem
-    else:
-      return VesselBranchTreeItem(nodeId)
+  def _onNodeInserted(self, nodeId):
+    self._pendingNodeIds.add(nodeId)
+    self._hasPendingNodeChanges = True
 
-  def _removeFromParent(self, nodeItem):
-    """Remove input node item from its parent if it is attached to an item or from the TreeWidget if at the root
-    """
-    parent = nodeItem.parent()
-    if parent is not None:
-      parent.removeChild(nodeItem)
-    else:
-      self.takeTopLevelItem(self.indexOfTopLevelItem(nodeItem))
+  def _onNodeRemoved(self, nodeId):
+    self._hasPendingNodeChanges = True
+    item = self._branchDict.pop(nodeId, None)
+    if item is None:
+      return
 
-  def _insertNode(self, nodeId, parentId, status):
-    """Insert the nodeId with input node name as child of the item whose name is parentId. If parentId is None, the item
-    will be added as a root of the tree
+    # Children of the removed node are moved to the node parent by the model
+    children = [item.child(i) for i in range(item.childCount())]
+    self._pendingNodeIds.update(child.nodeId for child in children)
+    self._detachedExpandedStates.update((child.nodeId, child.isExpanded()) for child in children
+                                        if child.treeWidget() is not None)
+    self._takeItem(item)
+
+  def _onTreeReset(self):
+    self._isResetPending = True
+
+  def _updateItemsFromModel(self):
+    """Synchronizes the tree widget items with the model structure. Only the items of the nodes inserted, removed or
+    moved since the last synchronization are updated. Items keep their expanded state and new items are expanded.
+    """
+    try:
+      if self._isUpdatingModel:
+        return
+
+      # Nodes inserted before an existing node or as new root become the parent of the displaced nodes
+      pendingNodeIds = {nodeId for nodeId in self._pendingNodeIds if self._model.isInTree(nodeId)}
+      for nodeId in [nodeId for nodeId in pendingNodeIds if nodeId not in self._branchDict]:
+        pendingNodeIds.update(self._model.getChildrenNodeId(nodeId))
+
+      # Structure moves without insertion or removal (reset, undo of a drag and drop) are only known to the model
+      if self._isResetPending or not self._hasPendingNodeChanges:
+        pendingNodeIds = self._resetItems()
+
+      self.setUpdatesEnabled(False)
+      try:
+        self._placeItems(pendingNodeIds)
+      finally:
+        self.setUpdatesEnabled(True)
+    finally:
+      self._pendingNodeIds = set()
+      self._detachedExpandedStates = {}
+      self._hasPendingNodeChanges = False
+      self._isResetPending = False
+
+  def _resetItems(self):
+    """Removes the items of the nodes not in the model anymore and returns every model node as pending"""
+    for nodeId in [nodeId for nodeId in self._branchDict if not self._model.isInTree(nodeId)]:
+      self._takeItem(self._branchDict.pop(nodeId))
+
+    for item in self._branchDict.values():
+      item.updateText()
+    return set(self._model.getNodeList())
+
+  def _placeItems(self, nodeIds):
+    """Moves the items of the input nodes to their model parent and row. Items are first detached and then inserted in
+    increasing row order for the rows of the items not moved to stay valid during the insertion.
+    """
+    isExpanded = {}
+    for nodeId in nodeIds:
+      if nodeId not in self._branchDict:
+        self._branchDict[nodeId] = self._createItem(nodeId)
+        isExpanded[nodeId] = True
+      else:
+        item = self._branchDict[nodeId]
+        isExpanded[nodeId] = item.isExpanded() if item.treeWidget() is not None else \
+          self._detachedExpandedStates.get(nodeId, True)
+        self._takeItem(item)
+
+    for nodeId in sorted(nodeIds, key=self._model.getRowInParent):
+      parentId = self._model.getParentNodeId(nodeId)
+      row = self._model.getRowInParent(nodeId)
+      if parentId is None:
+        self.insertTopLevelItem(row, self._branchDict[nodeId])
+      else:
+        self._branchDict[parentId].insertChild(row, self._branchDict[nodeId])
+
+    for nodeId, expanded in isExpanded.items():
+      self._branchDict[nodeId].setExpanded(expanded)
+
+  def _takeItem(self, item):
+    parentItem = item.parent()
+    if parentItem is not None:
+      parentItem.removeChild(item)
+    elif self.indexOfTopLevelItem(item) >= 0:
+      self.takeTopLevelItem(self.indexOfTopLevelItem(item))
+
+  def _createItem(self, nodeId):
+    item = VesselBranchTreeItem(nodeId, self._model)
+    item.setToolTip(0, self._vesselHelpWidget.tooltipImageUrl(nodeId))
+    return item
+
+  def _onStatusChanged(self, nodeId, status):
+    item = self.getTreeWidgetItem(nodeId)
+    if item is not None:
+      item.updateText()
 
-    Parameters
-    ----------
-    nodeId: str
-      Unique id of the node to add to the tree
-    parentId: str or None
-      Unique id of the parent node. If None or "" will add node as root
-    """
-    nodeItem = self._takeItem(nodeId)
-    nodeItem.status = status
-    if not parentId:
-      hasRoot = self.topLevelItemCount > 0
-      self.addTopLevelItem(nodeItem)
-      if hasRoot:
-        rootItem = self.takeTopLevelItem(0)
-        nodeItem.addChild(rootItem)
-    else:
-      self._branchDict[parentId].addChild(nodeItem)
+  def _updateModelFromItems(self):
+    """Writes the structure of the tree widget items back to the model. Called after the items were moved in the UI.
+    """
+    self._isUpdatingModel = True
+    try:
+      self._model.setTreeParentList(self._getItemTreeParentList())
+    finally:
+      self._isUpdatingModel = False
 
-    self._branchDict[nodeId] = nodeItem
-    return nodeItem
+  def _getItemTreeParentList(self):
+    """
+    Returns
+    -------
+    List[List[str]]
+      Adjacent list of the tree widget items in the getTreeParentList format.
+    """
+    roots = [self.topLevelItem(i) for i in range(self.topLevelItemCount)]
+    treeParentList = [[None, root.nodeId] for root in roots]
+    toVisit = list(reversed(roots))
+    while toVisit:
+      nodeItem = toVisit.pop()
+      children = [nodeItem.child(i) for i in range(nodeItem.childCount())]
+      treeParentList.extend([nodeItem.nodeId, child.nodeId] for child in children)
+      toVisit.extend(reversed(children))
+    return treeParentList
 
   def insertAfterNode(self, nodeId, parentNodeId, status=PlaceStatus.NOT_PLACED):
     """Insert given node after the input parent Id. Inserts new node as root if parentNodeId is None.
@@ -203,9 +310,44 @@ class VesselBranchTree(qt.QTreeWidget):
       ValueError
         If parentNodeId is not None and doesn't exist in the tree
     """
-    node = self._insertNode(nodeId, parentNodeId, status)
-    node.setToolTip(0, self._vesselHelpWidget.tooltipImageUrl(nodeId))
-    self.expandAll()
+    self._model.insertAfterNode(nodeId, parentNodeId, status)
+
+  def insertEdges(self, edges, status=PlaceStatus.NOT_PLACED):
+    """Inserts every input (parentNodeId, nodeId) edge in the list order as insertAfterNode would.
+
+    Tree items are built once after the last insertion with the widget signals blocked and expanded once.
+
+    Parameters
+    ----------
+    edges: Iterable[Tuple[str or None, str]]
+    status: PlaceStatus
+
+    Raises
+    ------
+      ValueError
+        If a parent node doesn't exist in the tree when its edge is inserted
+    """
+    wasBlocked = self.blockSignals(True)
+    try:
+      self._model.insertEdges(edges, status)
+    finally:
+      self.blockSignals(wasBlocked)
+
+  def setTreeParentList(self, treeParentList, statusDict=None):
+    """Replaces the tree structure by the input adjacent list. Items are built once with the widget signals blocked.
+
+    Parameters
+    ----------
+    treeParentList: List[List[str]]
+      Adjacent list in the getTreeParentList format
+    statusDict: Dict[str, PlaceStatus] or None
+      Status of the nodes. See VesselTreeModel.setTreeParentList
+    """
+    wasBlocked = self.blockSignals(True)
+    try:
+      self._model.setTreeParentList(treeParentList, statusDict)
+    finally:
+      self.blockSignals(wasBlocked)
 
   def insertBeforeNode(self, nodeId, beforeNodeId, status=PlaceStatus.NOT_PLACED):
     """Insert given node before the input parent Id. Inserts new node as root if childNodeId is None.
@@ -223,17 +365,7 @@ class VesselBranchTree(qt.QTreeWidget):
       ValueError
         If childNodeId is not None and doesn't exist in the tree
     """
-    if not beforeNodeId:
-      self._insertNode(nodeId, None, status)
-    else:
-      parentNodeId = self.getParentNodeId(beforeNodeId)
-      childItem = self._takeItem(beforeNodeId)
-
-      self._insertNode(nodeId, parentNodeId, status)
-      nodeItem = self._insertNode(nodeId, parentNodeId, status)
-      nodeItem.addChild(childItem)
-
-    self.expandAll()
+    self._model.insertBeforeNode(nodeId, beforeNodeId, status)
 
   def removeNode(self, nodeId):
     """Remove given node from tree.
@@ -250,42 +382,7 @@ class VesselBranchTree(qt.QTreeWidget):
     -------
     bool - True if node was removed, False otherwise
     """
-    nodeItem = self._branchDict[nodeId]
-    if nodeItem.parent() is None:
-      return self._removeRootItem(nodeItem, nodeId)
-    else:
-      self._removeIntermediateItem(nodeItem, nodeId)
-      return True
-
-  def _removeRootItem(self, nodeItem, nodeId):
-    """Only remove if it has exactly one direct child and replace root by child. Else does nothing.
-
-    Returns
-    -------
-    bool - True if root item was removed, False otherwise
-    """
-    if nodeItem.childCount() > 1:
-      return False
-    else:
-      # Delete root item
-      self.takeTopLevelItem(0)
-      del self._branchDict[nodeId]
-
-      # Set child as new root item if necessary
-      if nodeItem.childCount() == 1:
-        child = nodeItem.takeChild(0)
-        self.insertTopLevelItem(0, child)
-        child.setExpanded(True)
-      return True
-
-  def _removeIntermediateItem(self, nodeItem, nodeId):
-    """Move each child of node to node parent and remove item.
-    """
-    parentItem = nodeItem.parent()
-    parentItem.takeChild(parentItem.indexOfChild(nodeItem))
-    for child in nodeItem.takeChildren():
-      parentItem.addChild(child)
-    del self._branchDict[nodeId]
+    return self._model.removeNode(nodeId)
 
   def getParentNodeId(self, childNodeId):
     """
@@ -300,8 +397,7 @@ class VesselBranchTree(qt.QTreeWidget):
     str or None
       Id of the parent item or None if node has no parent
     """
-    parentItem = self._branchDict[childNodeId].parent()
-    return parentItem.nodeId if parentItem is not None else None
+    return self._model.getParentNodeId(childNodeId)
 
   def getChildrenNodeId(self, parentNodeId):
     """
@@ -310,50 +406,7 @@ class VesselBranchTree(qt.QTreeWidget):
     List[str]
       List of nodeIds of every children associated with parentNodeId
     """
-    parent = self._branchDict[parentNodeId]
-    return [parent.child(i).nodeId for i in range(parent.childCount())]
-
-  def _getSiblingId(self, nodeId, nextIncrement):
-    """
-    Returns
-    -------
-    str or None
-      nodeId sibling at iNode + nextIncrement index. None if new index is out of bounds
-    """
-    nodeItem = self._branchDict[nodeId]
-    parent = nodeItem.parent()
-    if parent is None:
-      return None
-    else:
-      iSibling = parent.indexOfChild(nodeItem) + nextIncrement
-      return parent.child(iSibling).nodeId if (0 <= iSibling < parent.childCount()) else None
-
-  def _getNextItem(self, nodeId, lookInChildren=True):
-    """
-    Parameters
-    ----------
-      nodeId: str
-        Id of start element
-      lookInChildren: bool
-        if True, will look for next in the node's children if any, else will look for next in siblings or parents
-
-    Returns
-    -------
-    Optional[VesselBranchTreeItem] next node item
-    """
-    nodeItem = self.getTreeWidgetItem(nodeId)
-    if nodeItem is None:
-      return None
-
-    if lookInChildren and nodeItem.childCount() > 0:
-      return nodeItem.child(0)
-
-    nextSiblingId = self._getSiblingId(nodeId, 1)
-    if nextSiblingId is not None:
-      return self.getTreeWidgetItem(nextSiblingId)
-
-    parent = nodeItem.parent()
-    return self._getNextItem(parent.nodeId, lookInChildren=False) if parent is not None else None
+    return self._model.getChildrenNodeId(parentNodeId)
 
   def getNextSiblingNodeId(self, nodeId):
     """
@@ -362,7 +415,7 @@ class VesselBranchTree(qt.QTreeWidget):
     str or None
       nodeId sibling at iNode + 1 index. None if new index is out of bounds
     """
-    return self._getSiblingId(nodeId, nextIncrement=1)
+    return self._model.getNextSiblingNodeId(nodeId)
 
   def getPreviousSiblingNodeId(self, nodeId):
     """
@@ -371,7 +424,7 @@ class VesselBranchTree(qt.QTreeWidget):
     str or None
       nodeId sibling at iNode - 1 index. None if new index is out of bounds
     """
-    return self._getSiblingId(nodeId, nextIncrement=-1)
+    return self._model.getPreviousSiblingNodeId(nodeId)
 
   def getRootNodeId(self):
     """
@@ -380,22 +433,17 @@ class VesselBranchTree(qt.QTreeWidget):
     str or None
       nodeId of the first root of the tree. None if tree has no root item
     """
-    return self.topLevelItem(0).nodeId if self.topLevelItemCount > 0 else None
+    return self._model.getRootNodeId()
 
   def getTreeParentList(self):
     """Returns tree as adjacent list in the format [[parentId, childId_1], [parentId, childId_2], ...].
-    Root adjacent list is listed as [None, RootId]. List is constructed in breadth first manner from root to leaf.
+    Root adjacent list is listed as [None, RootId].
 
     Returns
     -------
     List[List[str]] Representing adjacent list of the tree. List is empty if tree is emtpy.
     """
-    roots = [self.topLevelItem(i) for i in range(self.topLevelItemCount)]
-    treeParentList = [[None, root.nodeId] for root in roots]
-    for root in roots:
-      treeParentList += self._getChildrenAdjacentLists(root)
-
-    return treeParentList
+    return self._model.getTreeParentList()
 
   def getPlacedNodeList(self):
     """
@@ -404,13 +452,10 @@ class VesselBranchTree(qt.QTreeWidget):
     List[str]
       List of nodeIds which have been placed in the mrmlScene
     """
-    return [nodeId for nodeId in self.getNodeList() if self._isPlaced(nodeId)]
+    return self._model.getPlacedNodeList()
 
   def areAllNodesPlaced(self):
-    return all([self._isPlaced(nodeId) for nodeId in self.getNodeList()])
-
-  def _isPlaced(self, nodeId):
-    return self.getTreeWidgetItem(nodeId).status == PlaceStatus.PLACED
+    return self._model.areAllNodesPlaced()
 
   def getNodeList(self):
     """
@@ -419,7 +464,19 @@ class VesselBranchTree(qt.QTreeWidget):
     List[str]
       List of every nodeIds referenced in the tree
     """
-    return self._branchDict.keys()
+    return self._model.getNodeList()
+
+  def getLeafNodeIds(self):
+    return self._model.getLeafNodeIds()
+
+  def getStatus(self, nodeId):
+    return self._model.getStatus(nodeId)
+
+  def getBranchChains(self):
+    return self._model.getBranchChains()
+
+  def getVersion(self):
+    return self._model.getVersion()
 
   def getTreeWidgetItem(self, nodeId):
     return self._branchDict[nodeId] if nodeId in self._branchDict else None
@@ -435,50 +492,41 @@ class VesselBranchTree(qt.QTreeWidget):
     bool
       True if nodeId has no children item, False otherwise
     """
-    return len(self.getChildrenNodeId(nodeId)) == 0
-
-  def _getChildrenAdjacentLists(self, nodeItem):
-    """
-    Returns
-    -------
-    List[List[str]]
-      List of every [parentId, childId] pair starting from nodeItem in the tree.
-    """
-    children = [nodeItem.child(i) for i in range(nodeItem.childCount())]
-    nodeList = [[nodeItem.nodeId, child.nodeId] for child in children]
-    for child in children:
-      nodeList += self._getChildrenAdjacentLists(child)
-    return nodeList
+    return self._model.isLeaf(nodeId)
 
   def enforceOneRoot(self):
     """Reorders tree to have only one root item. If elements are defined after root, they will be inserted before
-    current root. Methods is called during drop events.
+    current root. Methods is called during drop events. The resulting structure is written to the tree model.
     """
-    # Early return if tree has at most one root
-    if self.topLevelItemCount <= 1:
-      return
+    while self.topLevelItemCount > 1:
+      # Set current root as second item child
+      newRoot = self.takeTopLevelItem(1)
+      currentRoot = self.takeTopLevelItem(0)
+      newRoot.addChild(currentRoot)
 
-    # Set current root as second item child
-    newRoot = self.takeTopLevelItem(1)
-    currentRoot = self.takeTopLevelItem(0)
-    newRoot.addChild(currentRoot)
+      # Add the new root to the tree
+      self.insertTopLevelItem(0, newRoot)
 
-    # Add the new root to the tree
-    self.insertTopLevelItem(0, newRoot)
+      # Expand both items
+      newRoot.setExpanded(True)
+      currentRoot.setExpanded(True)
 
-    # Expand both items
-    newRoot.setExpanded(True)
-    currentRoot.setExpanded(True)
-
-    # Call recursively until the whole tree has only one root
-    self.enforceOneRoot()
+    self._updateModelFromItems()
 
 
 class TreeDrawer(object):
   """
-  Class responsible for drawing lines between the different vessel nodes
+  Class responsible for drawing lines between the different vessel nodes.
+
+  Lines are drawn as a poly data with one point per placed node and one line cell per edge between a placed node and
+  its closest placed ancestor. Each line cell carries the branch id and depth of its child node as cell scalars which
+  can be used to color the tree by sub tree. The drawer keeps the point index of each node, which lets
+  updateNodePosition move a single node point in place without reconstructing the lines.
   """
 
+  branchIdArrayName = "BranchId"
+  depthArrayName = "Depth"
+
   def __init__(self, vesselTree, markupFiducial):
     """
     Parameters
@@ -490,13 +538,19 @@ class TreeDrawer(object):
     self._markupFiducial = markupFiducial
     self._lineWidth = 4
     self._lineOpacity = 1
+    self._nodePointIndex = {}
+    self._layoutKey = None
     self._setupLineModel()
 
   def _setupLineModel(self):
-    self._polyLine = vtk.vtkPolyLineSource()
-    self._polyLine.SetClosed(False)
+    self._points = vtk.vtkPoints()
+    self._polyData = vtk.vtkPolyData()
+    self._polyData.SetPoints(self._points)
+    self._polyData.SetLines(vtk.vtkCellArray())
+    self._nodePointIndex = {}
+    self._layoutKey = None
     self._lineModel = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode")
-    self._lineModel.SetAndObservePolyData(self._polyLine.GetOutput())
+    self._lineModel.SetAndObservePolyData(self._polyData)
     self._lineModel.CreateDefaultDisplayNodes()
     self._lineModel.SetName("VesselBranchNodeTree")
     self._updateNodeCoordDict()
@@ -513,7 +567,7 @@ class TreeDrawer(object):
     Dict[str, List[float]]
       Dictionary containing the node ids contained in the markup node and its associated positions
     """
-    self._nodeCoordDict = getMarkupIdPositionDictionary(self._markupFiducial)
+    self._nodeCoordDict = self._markupFiducial.getIdPositionDict()
 
   def updateTreeLines(self):
     """Updates the lines between the different nodes of the tree. Uses the last set line width and color
@@ -521,53 +575,110 @@ class TreeDrawer(object):
     # Update nodes coordinates
     self._updateNodeCoordDict()
 
-    # Force modification by resetting number of points to 0 (other wise update will not be visible if only points
-    # position has changed)
-    self._polyLine.SetNumberOfPoints(0)
-    coordList = self._extractTreeLinePointSequence()
-    self._polyLine.SetNumberOfPoints(len(coordList))
-    for i, coord in enumerate(coordList):
-      self._polyLine.SetPoint(i, *coord)
-
-    # Trigger poly line update
-    self._polyLine.Update()
+    # Branch id of each node is the index of the branch chain ending with the edge from its parent
+    branchIds = {nodeId: iBranch for iBranch, chain in enumerate(self._tree.getBranchChains()) for nodeId in chain[1:]}
+
+    self._nodePointIndex = {}
+    points = vtk.vtkPoints()
+    lines = vtk.vtkCellArray()
+    branchIdArray = self._createCellArray(self.branchIdArrayName)
+    depthArray = self._createCellArray(self.depthArrayName)
+
+    # Connect each placed node to its closest placed ancestor, skipping the nodes which are not placed yet
+    placedAncestors = {}
+    depths = {}
+    for nodeId in preorderNodeIds(self._tree):
+      parentId = self._tree.getParentNodeId(nodeId)
+      depths[nodeId] = depths[parentId] + 1 if parentId in depths else 0
+      ancestorId = parentId if parentId in self._nodePointIndex else placedAncestors.get(parentId)
+      placedAncestors[nodeId] = ancestorId
+
+      coord = self._nodeCoordinate(nodeId)
+      if coord is None:
+        continue
+
+      self._nodePointIndex[nodeId] = points.InsertNextPoint(*coord)
+      if ancestorId is not None:
+        lines.InsertNextCell(2)
+        lines.InsertCellPoint(self._nodePointIndex[ancestorId])
+        lines.InsertCellPoint(self._nodePointIndex[nodeId])
+        branchIdArray.InsertNextValue(branchIds.get(nodeId, -1))
+        depthArray.InsertNextValue(depths[nodeId])
+
+    self._points = points
+    self._polyData.SetPoints(points)
+    self._polyData.SetLines(lines)
+    self._polyData.GetCellData().Initialize()
+    self._polyData.GetCellData().AddArray(branchIdArray)
+    self._polyData.GetCellData().AddArray(depthArray)
+    self._polyData.Modified()
+    self._layoutKey = self._currentLayoutKey()
+
+  @staticmethod
+  def _createCellArray(name):
+    array = vtk.vtkIntArray()
+    array.SetName(name)
+    return array
+
+  def setScalarColoring(self, arrayName):
+    """
+    Parameters
+    ----------
+    arrayName: str or None
+      Name of the cell array used to color the lines (branchIdArrayName or depthArrayName). If None, lines are drawn
+      with the color set with setColor.
+    """
+    displayNode = self._lineDisplayNode()
+    if arrayName is None:
+      displayNode.SetScalarVisibility(False)
+      return
 
-  def _extractTreeLinePointSequence(self, parentId=None):
-    """Constructs a coordinate sequence starting from parentId node recursively.
+    displayNode.SetActiveScalar(arrayName, vtk.vtkAssignAttribute.CELL_DATA)
+    displayNode.SetScalarVisibility(True)
 
-    example :
-    parent
-      |_ child
-            |_ sub child
-      |_ child2
+  def _currentLayoutKey(self):
+    """Line layout depends on the tree structure and on the placed control points"""
+    return self._tree.getVersion(), self._markupFiducial.GetNumberOfControlPoints()
 
-    Previous tree will generate coordinates : [parent, child, sub child, child, parent, child2, parent]
-    This coordinate construction enables using only one poly line instead of multiple lines at the expense of
-    constructed lines number
+  def updateNodePosition(self, pointIndex):
+    """Moves the line point of the node associated with the input control point without reconstructing the lines.
+    Falls back to updateTreeLines if the line layout is not up to date with the tree and the markup.
 
     Parameters
     ----------
-    parentId: str or None
-      Starting point of the recursion. If none, will start from tree root
-
-    Returns
-    -------
-    List[List[float]]
-      Coordinate sequence for polyLine construction
+    pointIndex: int or None
+      Index of the modified control point in the markup node
     """
-    if parentId is None:
-      parentId = self._tree.getRootNodeId()
+    if pointIndex is None or self._layoutKey != self._currentLayoutKey() or \
+        not 0 <= pointIndex < self._markupFiducial.GetNumberOfControlPoints():
+      self.updateTreeLines()
+      return
+
+    nodeId = self._markupFiducial.GetNthControlPointLabel(pointIndex)
+    if nodeId not in self._nodePointIndex:
+      return
 
-    # Early return if tree is empty
-    if not parentId:
-      return []
+    coord = self._markupFiducial.getControlPointPosition(nodeId)
+    self._nodeCoordDict[nodeId] = coord
+    self._points.SetPoint(self._nodePointIndex[nodeId], *coord)
+    self._points.Modified()
+    self._polyData.Modified()
 
-    parentCoord = self._nodeCoordinate(parentId)
-    pointSeq = [parentCoord]
-    for childId in self._tree.getChildrenNodeId(parentId):
-      pointSeq += self._extractTreeLinePointSequence(childId)
-      pointSeq.append(parentCoord)
-    return [point for point in pointSeq if point is not None]
+  def updateNodePositions(self, pointIndices):
+    """Moves the line points of the nodes associated with the input control points. Lines are reconstructed once
+    instead if the line layout is not up to date with the tree and the markup.
+
+    Parameters
+    ----------
+    pointIndices: List[int]
+      Indices of the modified control points in the markup node
+    """
+    if self._layoutKey != self._currentLayoutKey():
+      self.updateTreeLines()
+      return
+
+    for pointIndex in pointIndices:
+      self.updateNodePosition(pointIndex)
 
   def _nodeCoordinate(self, nodeId):
     return self._nodeCoordDict[nodeId] if nodeId in self._nodeCoordDict else None
@@ -619,6 +730,12 @@ class TreeDrawer(object):
     """
     self._lineModel.SetDisplayVisibility(isVisible)
 
+  def getLineModel(self):
+    """
+    :return: vtkMRMLModelNode displaying the tree lines
+    """
+    return self._lineModel
+
   def _lineDisplayNode(self):
     return self._lineModel.GetDisplayNode()
 
@@ -630,6 +747,9 @@ class TreeDrawer(object):
 class MarkupNode(object):
   """
   Wrapper around slicer markup Node to define a single interface for signals slots and access to the fiducial points.
+
+  The wrapper maintains an index of the control point labels and positions. The index is updated in place when a
+  single point is moved and rebuilt in one pass on the next access after points are added, removed or renamed.
   """
 
   def __init__(self, slicerNode):
@@ -645,6 +765,12 @@ class MarkupNode(object):
     self.pointModified = Signal("int pointId")
 
     self._node = slicerNode
+    self._signalsBlocked = False
+
+    # Control point labels, label to index dictionary and N x 3 positions. None when index needs to be rebuilt.
+    self._labels = None
+    self._labelIndex = None
+    self._positions = None
 
     # Handle API change between Slicer 4.10 and 4.11
     if hasattr(slicer.vtkMRMLMarkupsNode, 'MarkupAddedEvent'):
@@ -660,12 +786,17 @@ class MarkupNode(object):
     self._connectNodeSignal(pointClickedEvent, self._emitPointClicked)
     self._connectNodeSignal(slicer.vtkMRMLMarkupsNode.PointEndInteractionEvent, self._emitPointInteractionEnded)
     self._connectNodeSignal(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self._emitPointModified)
+    pointRemovedEvent = getattr(slicer.vtkMRMLMarkupsNode, 'PointRemovedEvent', None)
+    if pointRemovedEvent is None:
+      pointRemovedEvent = slicer.vtkMRMLMarkupsNode.MarkupRemovedEvent
+    self._connectNodeSignal(pointRemovedEvent, self._invalidateIndex)
 
     # Forward slicer markup functions
     self.GetNumberOfControlPoints = self._node.GetNumberOfControlPoints
     self.AddControlPoint = self._node.AddControlPoint
     self.GetNthControlPointLabel = self._node.GetNthControlPointLabel
     self.GetNthControlPointPosition = self._node.GetNthControlPointPosition
+    self.SetNthControlPointPosition = self._node.SetNthControlPointPosition
     self.GetNthFiducialVisibility = self._node.GetNthFiducialVisibility
     self.SetNthControlPointVisibility = self._node.SetNthControlPointVisibility
     self.SetNthControlPointLabel = self._node.SetNthControlPointLabel
@@ -673,7 +804,106 @@ class MarkupNode(object):
     self.SetLocked = self._node.SetLocked
     self.GetLocked = self._node.GetLocked
     self.GetDisplayNode = self._node.GetDisplayNode
-    self.RemoveAllControlPoints = self._node.RemoveAllControlPoints
+
+  def RemoveAllControlPoints(self):
+    self._node.RemoveAllControlPoints()
+    self._invalidateIndex()
+
+  def _invalidateIndex(self, *args):
+    self._labels = None
+    self._labelIndex = None
+    self._positions = None
+
+  def _ensureIndex(self):
+    if self._labels is not None and len(self._labels) == self._node.GetNumberOfControlPoints():
+      return
+
+    nPoints = self._node.GetNumberOfControlPoints()
+    self._labels = [self._node.GetNthControlPointLabel(i) for i in range(nPoints)]
+    self._labelIndex = {label: i for i, label in enumerate(self._labels)}
+    self._positions = np.zeros((nPoints, 3))
+    for i in range(nPoints):
+      self._node.GetNthControlPointPosition(i, self._positions[i])
+
+  def _updateIndexedPoint(self, pointIndex):
+    """Updates the position of the input point in the index or invalidates the index if the point label changed"""
+    if self._labels is None:
+      return
+
+    if pointIndex is None or not 0 <= pointIndex < len(self._labels) or \
+        self._labels[pointIndex] != self._node.GetNthControlPointLabel(pointIndex):
+      self._invalidateIndex()
+      return
+
+    self._node.GetNthControlPointPosition(pointIndex, self._positions[pointIndex])
+
+  def getControlPointIndex(self, label):
+    """
+    Returns
+    -------
+    int or None
+      Index of the last control point with the input label. None if no control point has the label.
+    """
+    self._ensureIndex()
+    return self._labelIndex.get(label)
+
+  def getControlPointPosition(self, label):
+    """
+    Returns
+    -------
+    List[float] or None
+      Position of the last control point with the input label. None if no control point has the label.
+    """
+    i = self.getControlPointIndex(label)
+    return self._positions[i].tolist() if i is not None else None
+
+  def getControlPointLabels(self):
+    self._ensureIndex()
+    return list(self._labels)
+
+  def getControlPointPositions(self):
+    """
+    Returns
+    -------
+    np.array
+      N x 3 read only array of the control point positions, in the control point order
+    """
+    self._ensureIndex()
+    positions = self._positions.view()
+    positions.setflags(write=False)
+    return positions
+
+  def setControlPointsVisibility(self, hiddenLabels, isVisible=True):
+    """Sets the visibility of every control point in one node modification. Only the control points whose visibility
+    changes are modified and the wrapper signals are not emitted for the visibility changes.
+
+    Parameters
+    ----------
+    hiddenLabels: Set[str]
+      Labels of the control points to hide
+    isVisible: bool
+      Visibility of the control points which are not hidden
+    """
+    self._signalsBlocked = True
+    wasModifying = self._node.StartModify()
+    try:
+      for i, label in enumerate(self.getControlPointLabels()):
+        isPointVisible = isVisible and label not in hiddenLabels
+        if bool(self._node.GetNthControlPointVisibility(i)) != isPointVisible:
+          self._node.SetNthControlPointVisibility(i, isPointVisible)
+    finally:
+      self._node.EndModify(wasModifying)
+      self._signalsBlocked = False
+
+  def getIdPositionDict(self):
+    """
+    Returns
+    -------
+    Dict[str, List[float]]
+      Dictionary with control point labels as key and positions as value. See getMarkupIdPositionDictionary.
+    """
+    self._ensureIndex()
+    return dict(zip(self._labels, self._positions.tolist()))
 
   def GetSlicerNode(self):
     return self._node
@@ -688,17 +918,44 @@ class MarkupNode(object):
   def _connectNodeSignal(self, signal, slot):
     self._nodeObsId.append(self._node.AddObserver(signal, slot))
 
+  def setControlPoints(self, idPositionDict):
+    """Replaces every control point of the node by the input labelled positions. Node modified event is triggered once
+    and the wrapper signals are not emitted for the added points.
+
+    Parameters
+    ----------
+    idPositionDict: Dict[str, List[float]]
+      Dictionary with control point label as key and control point position as value
+    """
+    self._signalsBlocked = True
+    wasModifying = self._node.StartModify()
+    try:
+      self._node.RemoveAllControlPoints()
+      for label, position in idPositionDict.items():
+        self._node.SetNthControlPointLabel(self._node.AddControlPoint(position), label)
+    finally:
+      self._node.EndModify(wasModifying)
+      self._signalsBlocked = False
+      self._invalidateIndex()
+
   def _emitPointAdded(self, *args):
-    self.pointAdded.emit()
+    self._invalidateIndex()
+    if not self._signalsBlocked:
+      self.pointAdded.emit()
 
   def _emitPointClicked(self, caller, callData):
-    self.pointClicked.emit(callData)
+    if not self._signalsBlocked:
+      self.pointClicked.emit(callData)
 
   def _emitPointInteractionEnded(self, caller, callData):
-    self.pointInteractionEnded.emit(callData)
+    if not self._signalsBlocked:
+      self.pointInteractionEnded.emit(callData)
 
-  def _emitPointModified(self, caller, callData):
-    self.pointModified.emit(callData)
+  @vtk.calldata_type(vtk.VTK_INT)
+  def _emitPointModified(self, caller, event, callData=None):
+    self._updateIndexedPoint(callData)
+    if not self._signalsBlocked:
+      self.pointModified.emit(callData)
 
 
 class INodePlaceWidget(object):
@@ -783,8 +1040,10 @@ class VesselBranchWidget(qt.QWidget):
     widgetLayout.addWidget(self._branchTree)
     self.setLayout(widgetLayout)
 
-    # Create interaction action
+    # Create interaction actions
     self._stopInteractionAction = self._createStopInteractionAction()
+    self._undoAction = self._createShortcutAction("Undo branch edit", self._wizard.undo, qt.QKeySequence.Undo)
+    self._redoAction = self._createShortcutAction("Redo branch edit", self._wizard.redo, qt.QKeySequence.Redo)
 
     # Emitted when validity changes
     self.treeValidityChanged = Signal()
@@ -796,8 +1055,15 @@ class VesselBranchWidget(qt.QWidget):
 
   def enableShortcuts(self, isEnabled):
     """Enables/Disables the shortcuts for the widget. If enabled, add node and edit node can be disabled by pressing
-    escape key.
+    escape key. Undo / redo shortcuts are only active when the focus is in the widget to leave the application undo
+    shortcuts untouched elsewhere.
     """
+    for action in [self._undoAction, self._redoAction]:
+      if isEnabled:
+        self.addAction(action)
+      else:
+        self.removeAction(action)
+
     if isEnabled:
       slicer.util.mainWindow().addAction(self._stopInteractionAction)
     else:
@@ -815,6 +1081,13 @@ class VesselBranchWidget(qt.QWidget):
     action.setShortcut(qt.QKeySequence("esc"))
     return action
 
+  def _createShortcutAction(self, text, callback, shortcut):
+    action = qt.QAction(text, self)
+    action.connect("triggered()", callback)
+    action.setShortcut(qt.QKeySequence(shortcut))
+    action.setShortcutContext(qt.Qt.WidgetWithChildrenShortcut)
+    return action
+
   def _createVesselsBranchMarkupNode(self):
     """Creates markup node and node selector and connect the interaction node modified event to node status update.
     """
@@ -826,7 +1099,7 @@ class VesselBranchWidget(qt.QWidget):
     self._markupPlaceWidget = SlicerNodePlaceWidget(self._markupNodeSelector.markupsPlaceWidget())
 
   def _createButtonLayout(self):
-    """Create layout with Extract vessels, Add Node button and an Edit Node button
+    """Create layout with Extract vessels, Extract centerlines, Add Node button and an Edit Node button
 
     Returns
     -------
@@ -837,14 +1110,27 @@ class VesselBranchWidget(qt.QWidget):
     addEditButtonLayout = qt.QHBoxLayout()
     self._unlockNodePositionsButton = createButton("Unlock Node Positions", self._wizard.onEditNode, isCheckable=True)
     addEditButtonLayout.addWidget(self._unlockNodePositionsButton)
+    addEditButtonLayout.addWidget(createButton("Load Node Tree", self._onLoadTree))
+    self._undoButton = createButton("Undo", self._wizard.undo)
+    self._redoButton = createButton("Redo", self._wizard.redo)
+    addEditButtonLayout.addWidget(self._undoButton)
+    addEditButtonLayout.addWidget(self._redoButton)
+    self._wizard.getJournal().changed.connect(self._updateUndoRedoButtons)
+    self._updateUndoRedoButtons()
 
     # Create vertical layout and add Add and edit buttons on top of extract button
     buttonLayout = qt.QVBoxLayout()
     buttonLayout.addLayout(addEditButtonLayout)
     self.extractVesselsButton = createButton("Extract Vessels from node tree")
     buttonLayout.addWidget(self.extractVesselsButton)
+    self.extractCenterlinesButton = createButton("Extract centerlines from node tree")
+    buttonLayout.addWidget(self.extractCenterlinesButton)
     return buttonLayout
 
+  def _updateUndoRedoButtons(self):
+    self._undoButton.setEnabled(self._wizard.getJournal().canUndo())
+    self._redoButton.setEnabled(self._wizard.getJournal().canRedo())
+
   def _updateButtonCheckedStatus(self):
     interaction = self._wizard.getInteractionStatus()
     self._unlockNodePositionsButton.setChecked(interaction == InteractionStatus.EDIT)
@@ -852,6 +1138,30 @@ class VesselBranchWidget(qt.QWidget):
   def getBranchTree(self):
     return self._branchTree
 
+  def getTreeModel(self):
+    return self._branchTree.getTreeModel()
+
+  def saveTree(self, filePath):
+    """Saves the branch tree, node status and node positions to the input file
+    """
+    saveVesselTree(filePath, self.getTreeModel(), self.getIdPositionDict())
+
+  def loadTree(self, filePath):
+    """Replaces the current branch tree and node positions by the ones saved in the input file
+    """
+    self._wizard.loadTree(*loadVesselTree(filePath))
+
+  def _onLoadTree(self):
+    fileFilter = "Vessel tree (*{})".format(TREE_FILE_EXTENSION)
+    filePath = qt.QFileDialog.getOpenFileName(self, "Load node tree", "", fileFilter)
+    if not filePath:
+      return
+
+    try:
+      self.loadTree(filePath)
+    except Exception as e:
+      slicer.util.errorDisplay("Failed to load node tree :\n{}".format(e))
+
   def getBranchNames(self):
     """
     :return: Standardized branch names present in the tree. If some branches have been removed from the tree, they are
@@ -862,6 +1172,15 @@ class VesselBranchWidget(qt.QWidget):
   def getBranchMarkupNode(self):
     return self._markupNode.GetSlicerNode()
 
+  def getIdPositionDict(self):
+    """
+    Returns
+    -------
+    Dict[str, List[float]]
+      Position of each branch node from the markup node index
+    """
+    return self._markupNode.getIdPositionDict()
+
   def setVisibleInScene(self, isVisible):
     """
     If isVisible, markups and tree will be shown in scene, else they will be hidden.
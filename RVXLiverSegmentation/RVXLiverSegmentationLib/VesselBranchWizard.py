@@ -1,6 +1,8 @@
 import qt
 
-from RVXLiverSegmentationLib import Signal, jumpSlicesToNthMarkupPosition
+from RVXLiverSegmentationLib import Signal, jumpSlicesToNthMarkupPosition, CoalescingDispatcher
+from .VesselEditJournal import VesselEditJournal
+from .VesselTreeTypes import PlaceStatus
 
 
 class VeinId(object):
@@ -59,10 +61,21 @@ class NodeBranches(object):
     self._branchNames = []
     self._startPoints = []
     self._endPoints = []
+    self._branchPaths = []
 
   def addBranch(self, branchName):
     self._branchNames.append(branchName)
 
+  def addBranchPath(self, branchName, pathPoints):
+    """
+    Parameters
+    ----------
+    branchName: str
+    pathPoints: List[List[float]]
+      Positions of the nodes from the branch parent to the branch node including the intermediate inserted nodes
+    """
+    self._branchPaths.append((branchName, pathPoints))
+
   def addEndPoint(self, endPoint):
     self._endPoints.append(endPoint)
 
@@ -78,6 +91,15 @@ class NodeBranches(object):
   def endPoints(self):
     return self._endPoints
 
+  def branchPaths(self):
+    """
+    Returns
+    -------
+    List[Tuple[str, List[List[float]]]]
+      Branch names and path node positions for every branch with a parent
+    """
+    return self._branchPaths
+
 
 class InteractionStatus(object):
   STOPPED = "Stopped"
@@ -105,8 +127,7 @@ def setup_portal_vein_default_branch(tree):
               (VeinId.portalOptional_2, VeinId.posteriorBranch),  #
               ]
 
-  for child, parent in branches:
-    tree.insertAfterNode(nodeId=child, parentNodeId=parent)
+  tree.insertEdges([(parent, child) for child, parent in branches])
 
 
 def setup_inferior_cava_vein_default_branch(tree):
@@ -126,8 +147,7 @@ def setup_inferior_cava_vein_default_branch(tree):
               (VeinId.ivcOptional_3, VeinId.leftHepaticVein),  #
               ]
 
-  for child, parent in branches:
-    tree.insertAfterNode(nodeId=child, parentNodeId=parent)
+  tree.insertEdges([(parent, child) for child, parent in branches])
 
 
 class VesselBranchWizard(object):
@@ -156,13 +176,22 @@ class VesselBranchWizard(object):
     self._currentTreeItem = None
     self._treeDrawer = treeDrawer
 
+    # Undo / redo history of the edits done after the default branch setup
+    self._journal = VesselEditJournal(self._tree.getTreeModel(), self._node)
+    self._journal.applied.connect(self._onJournalApplied)
+    self._editStartPositions = {}
+    self._movedPointIndices = set()
+
     self._tree.connect("itemClicked(QTreeWidgetItem *, int)", self.onItemClicked)
     self._tree.connect("currentItemChanged(QTreeWidgetItem *), QTreeWidgetItem *)",
                        lambda current, previous: self.onItemClicked(current, 0))
     self._tree.keyPressed.connect(self.onKeyPressed)
     self._node.pointAdded.connect(self.onMarkupPointAdded)
-    self._node.pointModified.connect(lambda *x: self._treeDrawer.updateTreeLines())
-    self._node.pointInteractionEnded.connect(lambda *x: self._treeDrawer.updateTreeLines())
+    # Point modified events are fired at high frequency during drags. Redraw the tree lines at most once per frame
+    self._pointModifiedDispatcher = CoalescingDispatcher(self._onPointsModified)
+    self._node.pointModified.connect(self._pointModifiedDispatcher.post)
+    self._node.pointModified.connect(self._onPointModified)
+    self._node.pointInteractionEnded.connect(self._onPointInteractionEnded)
     self._placeWidget.placeModeChanged.connect(self._onNodePlaceModeChanged)
 
     # Emitted when interaction mode changes
@@ -226,9 +255,91 @@ class VesselBranchWizard(object):
     self.onStopInteraction()
 
     if editEnabled:
+      self._editStartPositions = self._node.getIdPositionDict()
+      self._movedPointIndices = set()
       self._node.SetLocked(False)
       self._updateCurrentInteraction(InteractionStatus.EDIT)
 
+  def getPointModifiedDispatcher(self):
+    return self._pointModifiedDispatcher
+
+  def _onPointsModified(self, pointIndices):
+    if None in pointIndices:
+      self._treeDrawer.updateTreeLines()
+      return
+
+    for pointIndex in pointIndices:
+      self._treeDrawer.updateNodePosition(pointIndex)
+
+  def _onPointModified(self, pointIndex):
+    if self._interactionStatus == InteractionStatus.EDIT:
+      self._movedPointIndices.add(pointIndex)
+
+  def _onPointInteractionEnded(self, *args):
+    # Lines of the points moved since the last redraw are updated without waiting for the next frame
+    self._pointModifiedDispatcher.flush()
+    if self._interactionStatus == InteractionStatus.EDIT:
+      self._recordMovedNodes()
+
+  def _recordMovedNodes(self):
+    """Records the moves of the points modified since the last record. Only the modified points are compared with
+    their position at the start of the edit, unless a modification didn't report its point index.
+    """
+    movedIndices, self._movedPointIndices = self._movedPointIndices, set()
+    if None in movedIndices:
+      positions = self._node.getIdPositionDict()
+    else:
+      nPoints = self._node.GetNumberOfControlPoints()
+      labels = [self._node.GetNthControlPointLabel(i) for i in movedIndices if 0 <= i < nPoints]
+      positions = {label: self._node.getControlPointPosition(label) for label in labels}
+
+    self._journal.recordNodeMoves(self._editStartPositions, positions)
+    self._editStartPositions.update(positions)
+
+  def getJournal(self):
+    return self._journal
+
+  def undo(self):
+    """Reverts the last tree edit or node move"""
+    self.onStopInteraction()
+    self._journal.undo()
+
+  def redo(self):
+    """Applies again the last reverted tree edit or node move"""
+    self.onStopInteraction()
+    self._journal.redo()
+
+  def _onJournalApplied(self, nodeIds):
+    """Updates the markups, status and tree lines of the nodes touched by undo / redo.
+
+    Nodes in the tree are placed if and only if their markup exists. Markups of removed nodes are hidden and not
+    deleted, which lets a node restored by undo / redo keep its markup instead of being placed a second time.
+    """
+    if self._currentTreeItem is not None and not self._tree.isInTree(self._currentTreeItem.nodeId):
+      self._currentTreeItem = None
+
+    pointIndices = []
+    for nodeId in nodeIds:
+      pointIndex = self._node.getControlPointIndex(nodeId)
+      isInTree = self._tree.isInTree(nodeId)
+      if pointIndex is not None:
+        self._node.SetNthControlPointVisibility(pointIndex, isInTree)
+        pointIndices.append(pointIndex)
+
+      if isInTree:
+        self._updateStatusFromMarkup(nodeId, hasMarkup=pointIndex is not None)
+
+    self._treeDrawer.updateNodePositions(pointIndices)
+    self._updatePlacingFinished()
+    self._emitNewNodeId()
+
+  def _updateStatusFromMarkup(self, nodeId, hasMarkup):
+    status = self._tree.getStatus(nodeId)
+    if hasMarkup and status == PlaceStatus.NOT_PLACED:
+      self._tree.getTreeModel().setStatus(nodeId, PlaceStatus.PLACED)
+    elif not hasMarkup and status == PlaceStatus.PLACED:
+      self._tree.getTreeModel().setStatus(nodeId, PlaceStatus.NOT_PLACED)
+
   def onStartPlacing(self):
     if self._currentItemPlaceStatus() == PlaceStatus.NOT_PLACED:
       self.onStopInteraction()
@@ -287,10 +398,7 @@ class VesselBranchWizard(object):
     int or None
       Markup index associated with id if found else None
     """
-    for i in range(self._node.GetNumberOfControlPoints()):
-      if self._node.GetNthControlPointLabel(i) == nodeId:
-        return i
-    return None
+    return self._node.getControlPointIndex(nodeId)
 
   def _updateCurrentInteraction(self, interaction):
     if self._interactionStatus != interaction:
@@ -320,8 +428,7 @@ class VesselBranchWizard(object):
     """
     Hides markup nodes which may have been deleted
     """
-    for i in range(self._node.GetNumberOfControlPoints()):
-      self._node.SetNthControlPointVisibility(i, self._tree.isInTree(self._node.GetNthControlPointLabel(i)))
+    self._node.setControlPointsVisibility(self._removedNodeIds())
 
     self._treeDrawer.updateTreeLines()
 
@@ -380,10 +487,16 @@ class VesselBranchWizard(object):
     Show or hide the tree and the nodes in the scene
     """
     self._treeDrawer.setVisible(isVisible)
+    self._node.setControlPointsVisibility(self._removedNodeIds(), isVisible)
 
-    for i in range(self._node.GetNumberOfControlPoints()):
-      isNodeVisible = isVisible and self._tree.isInTree(self._node.GetNthControlPointLabel(i))
-      self._node.SetNthControlPointVisibility(i, isNodeVisible)
+  def _removedNodeIds(self):
+    """
+    Returns
+    -------
+    Set[str]
+      Labels of the markup control points which are not part of the tree anymore
+    """
+    return set(self._node.getControlPointLabels()).difference(self._tree.getNodeList())
 
   def _updatePlacingFinished(self):
     """
@@ -402,40 +515,67 @@ class VesselBranchWizard(object):
     :return: List of all the default branches present in the tree as well as their start and end positions
     """
     treeBranches = NodeBranches()
+    leafIds = self._tree.getLeafNodeIds()
 
     for nodeId in VeinId().sortedIds():
-      if nodeId in self._tree.getNodeList():
+      if self._tree.isInTree(nodeId):
         nodePosition = self._getNodePosition(nodeId)
         treeBranches.addBranch(nodeId)
         if self._tree.isRoot(nodeId):
           treeBranches.addStartPoint(nodePosition)
-        elif self._tree.isLeaf(nodeId):
+        elif nodeId in leafIds:
           treeBranches.addEndPoint(nodePosition)
 
+        branchPath = [self._getNodePosition(pathId) for pathId in self._getBranchPathNodeIds(nodeId)]
+        if len(branchPath) > 1 and None not in branchPath:
+          treeBranches.addBranchPath(nodeId, branchPath)
+
     return treeBranches
 
+  def _getBranchPathNodeIds(self, nodeId):
+    """Returns the node ids from the first default branch ancestor (or root) of nodeId to nodeId"""
+    defaultIds = set(VeinId().sortedIds())
+    path = [nodeId]
+    parentId = self._tree.getParentNodeId(nodeId)
+    while parentId is not None:
+      path.append(parentId)
+      if parentId in defaultIds:
+        break
+      parentId = self._tree.getParentNodeId(parentId)
+    return path[::-1]
+
   def _getNodePosition(self, nodeId):
-    for i in range(self._node.GetNumberOfControlPoints()):
-      if self._node.GetNthControlPointLabel(i) == nodeId:
-        position = [0] * 3
-        self._node.GetNthControlPointPosition(i, position)
-        return position
+    return self._node.getControlPointPosition(nodeId)
 
-    return None
+  def loadTree(self, treeParentList, statusDict, idPositionDict):
+    """Replaces the tree and the markup nodes in one pass. Tree items, markups and tree lines are each updated once.
+
+    Parameters
+    ----------
+    treeParentList: List[List[str]]
+      Tree adjacent list in the getTreeParentList format
+    statusDict: Dict[str, PlaceStatus]
+      Status of each node
+    idPositionDict: Dict[str, List[float]]
+      Position of each placed node
+    """
+    self.onStopInteraction()
+    self._currentTreeItem = None
+    self._tree.setTreeParentList(treeParentList, statusDict)
+    self._node.setControlPoints(idPositionDict)
+    self.updateNodeVisibility()
+    self._journal.clear()
+
+    self._placingFinished = False
+    self._updatePlacingFinished()
+    self._emitNewNodeId()
 
   def clear(self):
     self._tree.clear()
     self._treeDrawer.clear()
     self._node.RemoveAllControlPoints()
     self._setupDefaultBranchNodes()
-
-
-class PlaceStatus(object):
-  NOT_PLACED = 0
-  PLACING = 1
-  PLACED = 2
-  INSERT_BEFORE = 3
-  NONE = 4
+    self._journal.clear()
 
 
 class VesselTreeColumnRole(object):
@@ -0,0 +1,123 @@
+from .VesselTreeTypes import Signal
+
+
+class NodeMoveEdit(object):
+  """Delta of one node position modification. Holds the positions of the moved nodes before and after the move.
+  """
+
+  def __init__(self, before, after):
+    self.before = before
+    self.after = after
+
+  def getNodeIds(self):
+    return list(self.before.keys())
+
+
+class VesselEditJournal(object):
+  """Undo / redo history of the vessel tree structure edits and of the node moves.
+
+  Tree edits are recorded from the tree model edited signal as the delta of the touched nodes. Node moves are recorded
+  with recordNodeMoves. Undo and redo only apply the recorded delta and notify the touched node ids with the applied
+  signal, letting listeners update what depends on these nodes only.
+  """
+
+  def __init__(self, treeModel, markupNode, maxLength=100):
+    """
+    Parameters
+    ----------
+    treeModel: VesselTreeModel
+    markupNode: MarkupNode
+    maxLength: int
+      Maximum number of edits kept in the undo history
+    """
+    self.changed = Signal()
+    self.applied = Signal("List[str]")
+
+    self._treeModel = treeModel
+    self._markupNode = markupNode
+    self._maxLength = maxLength
+    self._undoStack = []
+    self._redoStack = []
+    self._isApplying = False
+
+    self._treeModel.edited.connect(self._record)
+
+  def _record(self, edit):
+    if self._isApplying:
+      return
+
+    self._undoStack.append(edit)
+    del self._undoStack[:-self._maxLength]
+    self._redoStack = []
+    self.changed.emit()
+
+  def recordNodeMoves(self, positionsBefore, positionsAfter):
+    """Records the move of the nodes which position changed between the two input position dictionaries
+
+    Parameters
+    ----------
+    positionsBefore: Dict[str, List[float]]
+    positionsAfter: Dict[str, List[float]]
+    """
+    movedIds = [nodeId for nodeId, position in positionsAfter.items()
+                if nodeId in positionsBefore and list(positionsBefore[nodeId]) != list(position)]
+    if movedIds:
+      self._record(NodeMoveEdit({nodeId: positionsBefore[nodeId] for nodeId in movedIds},
+                                {nodeId: positionsAfter[nodeId] for nodeId in movedIds}))
+
+  def canUndo(self):
+    return len(self._undoStack) > 0
+
+  def canRedo(self):
+    return len(self._redoStack) > 0
+
+  def undo(self):
+    """Reverts the last recorded edit. Does nothing if the undo history is empty.
+
+    Returns
+    -------
+    List[str]
+      Ids of the nodes touched by the reverted edit
+    """
+    return self._applyLast(self._undoStack, self._redoStack, undo=True)
+
+  def redo(self):
+    """Applies again the last reverted edit. Does nothing if there is no edit to redo.
+
+    Returns
+    -------
+    List[str]
+      Ids of the nodes touched by the applied edit
+    """
+    return self._applyLast(self._redoStack, self._undoStack, undo=False)
+
+  def clear(self):
+    self._undoStack = []
+    self._redoStack = []
+    self.changed.emit()
+
+  def _applyLast(self, fromStack, toStack, undo):
+    if not fromStack:
+      return []
+
+    edit = fromStack.pop()
+    self._isApplying = True
+    try:
+      if isinstance(edit, NodeMoveEdit):
+        self._setNodePositions(edit.before if undo else edit.after)
+      else:
+        self._treeModel.applyEdit(edit, undo)
+    finally:
+      self._isApplying = False
+
+    toStack.append(edit)
+    nodeIds = edit.getNodeIds()
+    self.applied.emit(nodeIds)
+    self.changed.emit()
+    return nodeIds
+
+  def _setNodePositions(self, idPositionDict):
+    for nodeId, position in idPositionDict.items():
+      pointIndex = self._markupNode.getControlPointIndex(nodeId)
+      if pointIndex is not None:
+        self._markupNode.SetNthControlPointPosition(pointIndex, *position)
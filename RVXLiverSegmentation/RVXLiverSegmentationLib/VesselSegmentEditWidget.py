@@ -1,8 +1,13 @@
+from collections import OrderedDict
+
+import numpy as np
 import qt
 import slicer
 import vtk
 
-from RVXLiverSegmentationLib import SegmentWidget, createButton, GeometryExporter, NodeBranches, removeNodeFromMRMLScene
+from RVXLiverSegmentationLib import SegmentWidget, createButton, GeometryExporter, NodeBranches, \
+  removeNodeFromMRMLScene, extractSkeletonCenterline, installPythonPackageIfNeeded
+from .VoxelSkeletonCenterline import skeletonizationModuleName, skeletonizationPackageName
 
 
 class VesselSegmentEditWidget(SegmentWidget):
@@ -16,6 +21,7 @@ class VesselSegmentEditWidget(SegmentWidget):
     self._vesselBranches = NodeBranches()
     self._logic = logic
     self._centerLineVolume = None
+    self._branchLabelMap = None
     self._setupProceedWithVesselSplittingLayout()
     self._segmentationLogic = slicer.modules.segmentations.logic()
     self._proceedButton.setEnabled(False)
@@ -27,8 +33,21 @@ class VesselSegmentEditWidget(SegmentWidget):
 
   def _setupProceedWithVesselSplittingLayout(self):
     self._proceedButton = createButton("Proceed to vessel splitting", self.proceedToVesselSplitting)
+
+    # Centerline extraction modes
+    self._centerLineModes = OrderedDict()
+    self._centerLineModes["Whole tree"] = self._extractWholeTreeCenterLine
+    self._centerLineModes["Per branch (parallel)"] = self._extractPerBranchCenterLine
+    self._centerLineModes["Voxel skeleton (fast)"] = self._extractSkeletonCenterLine
+
+    self._centerLineModeChoice = qt.QComboBox()
+    self._centerLineModeChoice.addItems(list(self._centerLineModes.keys()))
+    self._centerLineModeChoice.toolTip = "Choose how the vessel tree centerline is extracted"
+
     layout = qt.QHBoxLayout()
     layout.addWidget(self._proceedButton)
+    layout.addWidget(qt.QLabel("Centerline:"))
+    layout.addWidget(self._centerLineModeChoice)
     self.insertLayout(0, layout)
 
   def proceedToVesselSplitting(self):
@@ -42,7 +61,7 @@ class VesselSegmentEditWidget(SegmentWidget):
 
     self._removePreviousCenterLineVolume()
     self._extractCenterLine()
-    self._addSegmentationNodes(self._vesselBranches.names())
+    self._addBranchSegmentationNodes(self._vesselBranches.names())
     self._proceedButton.setEnabled(False)
     self._segmentNode.GetDisplayNode().SetOpacity3D(self._segmentOpacity)
     self._prepareSplittingTools()
@@ -50,13 +69,83 @@ class VesselSegmentEditWidget(SegmentWidget):
     progressDialog.hide()
 
   def _extractCenterLine(self):
+    self._centerLineVolume = self._centerLineModes[self._centerLineModeChoice.currentText]()
+    if self._centerLineVolume is not None:
+      self._centerLineVolume.SetName(self._segmentNodeName + "CenterLine")
+
+  def _getValidTreeModel(self):
     branchVolume = self._getSegmentClosedModel(self._segmentNodeName)
-    if self._hasInvalidVolume(branchVolume):
-      return
+    return branchVolume if not self._hasInvalidVolume(branchVolume) else None
+
+  def _extractWholeTreeCenterLine(self):
+    branchVolume = self._getValidTreeModel()
+    if branchVolume is None:
+      return None
 
     startPoints, endPoints = self._vesselBranches.startPoints(), self._vesselBranches.endPoints()
-    self._centerLineVolume = self._logic.centerLineFilterFromNodePositions(branchVolume, startPoints, endPoints)
-    self._centerLineVolume.SetName(self._segmentNodeName + "CenterLine")
+    return self._logic.centerLineFilterFromNodePositions(branchVolume, startPoints, endPoints,
+                                                         self._logic.centerlineParameters,
+                                                         self._logic.centerlineSurfaceCache)
+
+  def _extractPerBranchCenterLine(self):
+    branchVolume = self._getValidTreeModel()
+    if branchVolume is None:
+      return None
+
+    return self._logic.centerLineFilterPerBranch(branchVolume, self._vesselBranches.branchPaths(),
+                                                 self._logic.centerlineParameters,
+                                                 surfaceCache=self._logic.centerlineSurfaceCache)
+
+  def _extractSkeletonCenterLine(self):
+    featureName = "Voxel skeleton centerline extraction"
+    if not installPythonPackageIfNeeded(skeletonizationModuleName, skeletonizationPackageName, featureName):
+      slicer.util.errorDisplay("{} requires the {} Python package. Please install it or choose another centerline "
+                               "mode.".format(featureName, skeletonizationPackageName))
+      return None
+
+    treeLabelMap = self._exportTreeSegmentAsLabelMap()
+    try:
+      startPoints, endPoints = self._vesselBranches.startPoints(), self._vesselBranches.endPoints()
+      return extractSkeletonCenterline(treeLabelMap, startPoints, endPoints)
+    except ImportError as e:
+      slicer.util.errorDisplay("{} failed to import its dependencies :\n{}".format(featureName, e))
+      return None
+    finally:
+      removeNodeFromMRMLScene(treeLabelMap)
+
+  def _exportTreeSegmentAsLabelMap(self):
+    segmentIds = vtk.vtkStringArray()
+    segmentIds.InsertNextValue(self._segmentationObj().GetSegmentIdBySegmentName(self._segmentNodeName))
+
+    treeLabelMap = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
+    self._segmentationLogic.ExportSegmentsToLabelmapNode(self._segmentNode, segmentIds, treeLabelMap)
+    return treeLabelMap
+
+  def _addBranchSegmentationNodes(self, branchNames):
+    """Adds one segment per branch name. If branch labels were kept during extraction, the segments are pre-filled with
+    the voxels claimed by each branch. Otherwise, the segments are empty.
+    """
+    if self._branchLabelMap is None:
+      self._addSegmentationNodes(branchNames)
+      return
+
+    # Imported segments are created in increasing label value order
+    labelMap, labelValues = self._branchLabelMap
+    previousIds = self._segmentIds()
+    self._segmentationLogic.ImportLabelmapToSegmentationNode(labelMap, self._segmentNode)
+    importedIds = [segmentId for segmentId in self._segmentIds() if segmentId not in previousIds]
+
+    labelNames = {value: name for name, value in labelValues.items()}
+    presentValues = [value for value in np.unique(slicer.util.arrayFromVolume(labelMap)) if value != 0]
+    importedNames = []
+    for segmentId, value in zip(importedIds, presentValues):
+      self._segmentationObj().GetSegment(segmentId).SetName(labelNames[value])
+      importedNames.append(labelNames[value])
+
+    self._addSegmentationNodes([name for name in branchNames if name not in importedNames])
+
+  def _segmentIds(self):
+    return [self._segmentationObj().GetNthSegmentID(i) for i in range(self._segmentationObj().GetNumberOfSegments())]
 
   def _prepareSplittingTools(self):
     # Get segmentation editor widget
@@ -95,9 +184,14 @@ class VesselSegmentEditWidget(SegmentWidget):
     modelName = "{}Model".format(segmentName)
     removeNodeFromMRMLScene(modelName)
 
-    polyData = vtk.vtkPolyData()
+    # The model shares the segment closed surface instead of copying it. The surface MTime then only changes when the
+    # segment is edited and the preprocessed centerline surface is reused when only the end points are moved.
+    self._segmentNode.CreateClosedSurfaceRepresentation()
     segmentId = self._segmentationObj().GetNthSegmentID(0)
-    self._segmentationLogic.GetSegmentClosedSurfaceRepresentation(self._segmentNode, segmentId, polyData)
+    polyData = self._segmentationObj().GetSegment(segmentId).GetRepresentation(
+      slicer.vtkSegmentationConverter.GetSegmentationClosedSurfaceRepresentationName())
+    if polyData is None:
+      polyData = vtk.vtkPolyData()
 
     model = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode")
     model.SetAndObservePolyData(polyData)
@@ -111,10 +205,20 @@ class VesselSegmentEditWidget(SegmentWidget):
     removeNodeFromMRMLScene(self._centerLineVolume)
     self._centerLineVolume = None
 
-  def onVesselSegmentationChanged(self, vesselLabelMap, vesselBranches):
+  def onVesselSegmentationChanged(self, vesselLabelMap, vesselBranches, branchLabelMap=None):
+    """
+    Parameters
+    ----------
+    vesselLabelMap: vtkMRMLLabelMapVolumeNode
+      Extracted vessel tree
+    vesselBranches: NodeBranches
+    branchLabelMap: Tuple[vtkMRMLLabelMapVolumeNode, Dict[str, int]] or None
+      If provided, label map with pre-split branches and associated branch name to label value dictionary
+    """
     self.clear()
     self._importLabelMap(vesselLabelMap)
     self._vesselBranches = vesselBranches
+    self._branchLabelMap = branchLabelMap
     self._proceedButton.setEnabled(True)
     self.setVisibleInScene(self.visible)
 
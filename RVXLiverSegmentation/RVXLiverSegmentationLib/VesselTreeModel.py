@@ -0,0 +1,803 @@
+import json
+
+import numpy as np
+
+from .VesselTreeTypes import Signal, PlaceStatus
+
+# Version of the vessel tree file format. Increment when the header content changes.
+TREE_FILE_FORMAT = "RVXVesselTree"
+TREE_FILE_VERSION = 1
+TREE_FILE_EXTENSION = ".rvxtree"
+
+# Transient placing status and the status they are saved and restored as
+_STABLE_STATUS = {PlaceStatus.PLACING: PlaceStatus.NOT_PLACED, PlaceStatus.INSERT_BEFORE: PlaceStatus.PLACED}
+
+
+def _stableStatus(status):
+  return _STABLE_STATUS.get(status, status)
+
+
+def _startNodeIds(tree, startNodeId):
+  if startNodeId is not None:
+    return [startNodeId]
+  rootId = tree.getRootNodeId()
+  return [rootId] if rootId else []
+
+
+def preorderNodeIds(tree, startNodeId=None):
+  """Depth first pre order traversal using an explicit stack.
+
+  Parameters
+  ----------
+  tree: VesselTreeModel or VesselBranchTree
+  startNodeId: str or None
+    Node from which the traversal starts. If None, starts from the tree root.
+
+  Returns
+  -------
+  List[str]
+    Node ids with each parent listed before its children
+  """
+  nodeIds = []
+  toVisit = _startNodeIds(tree, startNodeId)
+  while toVisit:
+    nodeId = toVisit.pop()
+    nodeIds.append(nodeId)
+    toVisit.extend(reversed(tree.getChildrenNodeId(nodeId)))
+  return nodeIds
+
+
+def postorderNodeIds(tree, startNodeId=None):
+  """Depth first post order traversal using an explicit stack.
+
+  Returns
+  -------
+  List[str]
+    Node ids with each parent listed after its children
+  """
+  nodeIds = []
+  toVisit = _startNodeIds(tree, startNodeId)
+  while toVisit:
+    nodeId = toVisit.pop()
+    nodeIds.append(nodeId)
+    toVisit.extend(tree.getChildrenNodeId(nodeId))
+  nodeIds.reverse()
+  return nodeIds
+
+
+def eulerTourNodeIds(tree, startNodeId=None):
+  """Euler tour of the tree using an explicit stack. Each parent is listed again after each of its children sub tree.
+
+  example :
+  parent
+    |_ child
+          |_ sub child
+    |_ child2
+
+  Previous tree will generate : [parent, child, sub child, child, parent, child2, parent]
+
+  Returns
+  -------
+  List[str]
+  """
+  startNodeIds = _startNodeIds(tree, startNodeId)
+  nodeIds = list(startNodeIds)
+  stack = [(nodeId, iter(tree.getChildrenNodeId(nodeId))) for nodeId in startNodeIds]
+  while stack:
+    childId = next(stack[-1][1], None)
+    if childId is None:
+      stack.pop()
+      if stack:
+        nodeIds.append(stack[-1][0])
+    else:
+      nodeIds.append(childId)
+      stack.append((childId, iter(tree.getChildrenNodeId(childId))))
+  return nodeIds
+
+
+def branchChains(tree, startNodeId=None):
+  """Compresses the tree in chains of nodes. Each chain starts at the start node or at a junction node and follows the
+  nodes with exactly one child until reaching a leaf or another junction.
+
+  example :
+    n0
+      |_ n10
+          |_ n20
+              |_n30
+              |_n31
+                  |_ n40
+
+  Previous tree will generate : [[n0, n10, n20], [n20, n30], [n20, n31, n40]]
+
+  Returns
+  -------
+  List[List[str]]
+    Chains in depth first order
+  """
+  chains = []
+  toVisit = [(nodeId, childId) for nodeId in _startNodeIds(tree, startNodeId)
+             for childId in reversed(tree.getChildrenNodeId(nodeId))]
+  while toVisit:
+    chain = list(toVisit.pop())
+    children = tree.getChildrenNodeId(chain[-1])
+    while len(children) == 1:
+      chain.append(children[0])
+      children = tree.getChildrenNodeId(chain[-1])
+
+    chains.append(chain)
+    toVisit.extend((chain[-1], childId) for childId in reversed(children))
+  return chains
+
+
+class TreeEdit(object):
+  """Delta of one tree structure modification. Holds the state of each node touched by the modification before and
+  after the modification. Node state is a (parentId, childrenIds, status) tuple or None if node was not in the tree.
+  """
+
+  def __init__(self, before, after, rootsBefore, rootsAfter):
+    self.before = before
+    self.after = after
+    self.rootsBefore = rootsBefore
+    self.rootsAfter = rootsAfter
+
+  def getNodeIds(self):
+    """
+    Returns
+    -------
+    List[str]
+      Ids of the nodes touched by the modification
+    """
+    return list(self.before.keys())
+
+  def isEmpty(self):
+    return self.before == self.after and self.rootsBefore == self.rootsAfter
+
+
+class VesselTreeModel(object):
+  """Pure python representation of the vessel branch node tree.
+
+  Tree structure is stored in dictionaries indexed by node id for constant time parent, children and status lookups.
+  The model doesn't depend on any widget and can be used by the extraction strategies and exporters without GUI.
+
+  Class signals each of its modifications :
+    - nodeInserted(nodeId) when a node is added to the tree
+    - nodeRemoved(nodeId) when a node is removed from the tree
+    - statusChanged(nodeId, status) when the place status of a node changes
+    - treeReset() when the whole structure is replaced
+    - modified() after each structure modification
+    - edited(TreeEdit) after each structure modification with the touched nodes states. Not emitted by applyEdit.
+
+  Each structure modification increments the tree version. Views derived from the structure (adjacent list, leaves,
+  branch chains) are computed once per version and returned from cache until the next modification.
+  """
+
+  def __init__(self):
+    self.nodeInserted = Signal("str")
+    self.nodeRemoved = Signal("str")
+    self.statusChanged = Signal("str, PlaceStatus")
+    self.treeReset = Signal()
+    self.modified = Signal()
+    self.edited = Signal("TreeEdit")
+
+    self._parents = {}
+    self._children = {}
+    self._status = {}
+    self._roots = []
+    self._version = 0
+    self._derivedViews = {}
+
+    # Node states before the modification in progress, None outside of modifications
+    self._editBefore = None
+    self._editRootsBefore = None
+
+  def clear(self):
+    self._beginEdit()
+    for nodeId in self.getNodeList():
+      self._touch(nodeId)
+    self._parents = {}
+    self._children = {}
+    self._status = {}
+    self._roots = []
+    self.treeReset.emit()
+    self._notifyModified()
+    self._endEdit()
+
+  def getVersion(self):
+    """
+    Returns
+    -------
+    int
+      Number of structure modifications done on the tree
+    """
+    return self._version
+
+  def _notifyModified(self):
+    self._version += 1
+    self._derivedViews = {}
+    self.modified.emit()
+
+  def _beginEdit(self):
+    self._editBefore = {}
+    self._editRootsBefore = list(self._roots)
+
+  def _touch(self, nodeId):
+    """Saves the state of nodeId the first time it is touched by the modification in progress"""
+    if self._editBefore is not None and nodeId is not None and nodeId not in self._editBefore:
+      self._editBefore[nodeId] = self._nodeState(nodeId)
+
+  def _nodeState(self, nodeId):
+    if not self.isInTree(nodeId):
+      return None
+    return self._parents[nodeId], tuple(self._children[nodeId]), self._status[nodeId]
+
+  def _endEdit(self):
+    before = self._editBefore
+    self._editBefore = None
+    edit = TreeEdit(before, {nodeId: self._nodeState(nodeId) for nodeId in before}, self._editRootsBefore,
+                    list(self._roots))
+    if not edit.isEmpty():
+      self.edited.emit(edit)
+
+  def applyEdit(self, edit, undo=False):
+    """Sets the nodes touched by the input edit to their state after the edit, or before the edit if undo is True.
+    Only the touched nodes are modified. Nodes present before and after the edit keep their current status, removed
+    nodes are restored with their status at the time of the edit.
+
+    Parameters
+    ----------
+    edit: TreeEdit
+    undo: bool
+    """
+    states, roots = (edit.before, edit.rootsBefore) if undo else (edit.after, edit.rootsAfter)
+    removedIds, insertedIds = [], []
+    for nodeId, state in states.items():
+      if state is None:
+        if self.isInTree(nodeId):
+          del self._parents[nodeId]
+          del self._children[nodeId]
+          del self._status[nodeId]
+          removedIds.append(nodeId)
+        continue
+
+      parentId, childrenIds, status = state
+      if not self.isInTree(nodeId):
+        self._status[nodeId] = _stableStatus(status)
+        insertedIds.append(nodeId)
+      self._parents[nodeId] = parentId
+      self._children[nodeId] = list(childrenIds)
+    self._roots = list(roots)
+
+    for nodeId in removedIds:
+      self.nodeRemoved.emit(nodeId)
+    for nodeId in insertedIds:
+      self.nodeInserted.emit(nodeId)
+    self._notifyModified()
+
+  def _derivedView(self, name, compute):
+    """Returns the view named name for the current tree version. View is computed by calling compute if not cached.
+    """
+    if name not in self._derivedViews:
+      self._derivedViews[name] = compute()
+    return self._derivedViews[name]
+
+  def isInTree(self, nodeId):
+    """
+    Returns
+    -------
+    bool
+      True if nodeId is part of the tree, False otherwise.
+    """
+    return nodeId in self._parents
+
+  def isRoot(self, nodeId):
+    """
+    :return: True if node doesn't have any parents
+    """
+    return self.getParentNodeId(nodeId) is None
+
+  def isLeaf(self, nodeId):
+    """
+    Returns
+    -------
+    bool
+      True if nodeId has no children, False otherwise
+    """
+    return len(self._children[nodeId]) == 0
+
+  def getParentNodeId(self, childNodeId):
+    """
+    Returns
+    -------
+    str or None
+      Id of the parent node or None if node has no parent
+    """
+    return self._parents[childNodeId]
+
+  def getChildrenNodeId(self, parentNodeId):
+    """
+    Returns
+    -------
+    List[str]
+      List of nodeIds of every children associated with parentNodeId
+    """
+    return list(self._children[parentNodeId])
+
+  def getRootNodeId(self):
+    """
+    Returns
+    -------
+    str or None
+      nodeId of the first root of the tree. None if tree has no root
+    """
+    return self._roots[0] if self._roots else None
+
+  def getRootNodeIds(self):
+    return list(self._roots)
+
+  def getChildCount(self, parentNodeId):
+    """
+    Returns
+    -------
+    int
+      Number of children of parentNodeId. Number of roots if parentNodeId is None.
+    """
+    return len(self._siblings(parentNodeId))
+
+  def getNthChildNodeId(self, parentNodeId, n):
+    """
+    Returns
+    -------
+    str
+      Id of the nth child of parentNodeId without copying the children list. Nth root if parentNodeId is None.
+    """
+    return self._siblings(parentNodeId)[n]
+
+  def getRowInParent(self, nodeId):
+    """
+    Returns
+    -------
+    int
+      Index of nodeId in its parent children list or in the roots list if nodeId is a root
+    """
+    return self._derivedView("rows", self._computeRows)[nodeId]
+
+  def _computeRows(self):
+    rows = {nodeId: i for i, nodeId in enumerate(self._roots)}
+    for children in self._children.values():
+      rows.update((nodeId, i) for i, nodeId in enumerate(children))
+    return rows
+
+  def _siblings(self, parentNodeId):
+    return self._roots if parentNodeId is None else self._children[parentNodeId]
+
+  def getNodeList(self):
+    """
+    Returns
+    -------
+    List[str]
+      List of every nodeIds referenced in the tree
+    """
+    return self._parents.keys()
+
+  def getStatus(self, nodeId):
+    return self._status[nodeId]
+
+  def setStatus(self, nodeId, status):
+    if self._status[nodeId] == status:
+      return
+
+    self._touch(nodeId)
+    self._status[nodeId] = status
+    self.statusChanged.emit(nodeId, status)
+
+  def getPlacedNodeList(self):
+    """
+    Returns
+    -------
+    List[str]
+      List of nodeIds which have been placed in the mrmlScene
+    """
+    return [nodeId for nodeId in self.getNodeList() if self._isPlaced(nodeId)]
+
+  def areAllNodesPlaced(self):
+    return all([self._isPlaced(nodeId) for nodeId in self.getNodeList()])
+
+  def _isPlaced(self, nodeId):
+    return self._status[nodeId] == PlaceStatus.PLACED
+
+  def getTreeParentList(self):
+    """Returns tree as adjacent list in the format [[parentId, childId_1], [parentId, childId_2], ...].
+    Root adjacent list is listed as [None, RootId]. For each node, the node's children pairs are listed before the
+    pairs of its first child sub tree.
+
+    Returns
+    -------
+    List[List[str]] Representing adjacent list of the tree. List is empty if tree is emtpy.
+    """
+    return [list(edge) for edge in self._derivedView("treeParentList", self._computeTreeParentList)]
+
+  def _computeTreeParentList(self):
+    treeParentList = [(None, root) for root in self._roots]
+    for root in self._roots:
+      for nodeId in preorderNodeIds(self, root):
+        treeParentList.extend((nodeId, childId) for childId in self._children[nodeId])
+    return tuple(treeParentList)
+
+  def getLeafNodeIds(self):
+    """
+    Returns
+    -------
+    FrozenSet[str]
+      Ids of the nodes without children
+    """
+    return self._derivedView("leaves", lambda: frozenset(nodeId for nodeId, children in self._children.items()
+                                                         if not children))
+
+  def getBranchChains(self):
+    """
+    Returns
+    -------
+    List[List[str]]
+      Chains of nodes from the tree root or junction nodes to the next leaf or junction node. See branchChains.
+    """
+    return [list(chain) for chain in self._derivedView("branchChains",
+                                                       lambda: tuple(tuple(chain) for chain in branchChains(self)))]
+
+  def getNextSiblingNodeId(self, nodeId):
+    """
+    Returns
+    -------
+    str or None
+      nodeId sibling at iNode + 1 index. None if new index is out of bounds
+    """
+    return self._getSiblingId(nodeId, nextIncrement=1)
+
+  def getPreviousSiblingNodeId(self, nodeId):
+    """
+    Returns
+    -------
+    str or None
+      nodeId sibling at iNode - 1 index. None if new index is out of bounds
+    """
+    return self._getSiblingId(nodeId, nextIncrement=-1)
+
+  def _getSiblingId(self, nodeId, nextIncrement):
+    parentId = self._parents[nodeId]
+    if parentId is None:
+      return None
+
+    siblings = self._children[parentId]
+    iSibling = siblings.index(nodeId) + nextIncrement
+    return siblings[iSibling] if (0 <= iSibling < len(siblings)) else None
+
+  def getNextUnplacedNodeId(self, nodeId):
+    """
+    Returns
+    -------
+    str or None
+      Id of the next node in depth first order, starting from nodeId, which has not been placed yet in the scene
+    """
+    if not self.isInTree(nodeId):
+      return None
+
+    nodeIds, positions = self._derivedView("preorder", self._computePreorder)
+    iStart, iEnd = positions[nodeId]
+    return next((nodeIds[i] for i in range(iStart, iEnd) if self._status[nodeIds[i]] == PlaceStatus.NOT_PLACED), None)
+
+  def _computePreorder(self):
+    """Returns the pre order node ids of every root sub tree and, for each node, its position and the end position of
+    its root sub tree in the node ids"""
+    nodeIds = []
+    positions = {}
+    for root in self._roots:
+      rootNodeIds = preorderNodeIds(self, root)
+      iEnd = len(nodeIds) + len(rootNodeIds)
+      positions.update((nodeId, (len(nodeIds) + i, iEnd)) for i, nodeId in enumerate(rootNodeIds))
+      nodeIds.extend(rootNodeIds)
+    return tuple(nodeIds), positions
+
+  def insertAfterNode(self, nodeId, parentNodeId, status=PlaceStatus.NOT_PLACED):
+    """Insert given node after the input parent Id. Inserts new node as root if parentNodeId is None.
+    If root is already present in the tree and insert after None is used, new node will become the parent of existing
+    root node. If nodeId is already in the tree, the node is moved with its sub tree.
+
+    Parameters
+    ----------
+    nodeId: str
+      Unique ID of the node to insert in the tree
+    parentNodeId: str or None
+      Unique ID of the parent node. If None or "", new node will be inserted as root.
+    status: PlaceStatus
+
+    Raises
+    ------
+      ValueError
+        If parentNodeId is not None and doesn't exist in the tree
+    """
+    if parentNodeId and not self.isInTree(parentNodeId):
+      raise ValueError("Parent node {} is not in the tree".format(parentNodeId))
+
+    self._beginEdit()
+    self._insertNode(nodeId, parentNodeId or None, status)
+    self._notifyModified()
+    self._endEdit()
+
+  def insertEdges(self, edges, status=PlaceStatus.NOT_PLACED):
+    """Inserts every input edge as insertAfterNode would, in the list order. Individual node insertion signals are
+    not emitted, listeners are notified once with treeReset and modified after the last insertion.
+
+    Parameters
+    ----------
+    edges: Iterable[Tuple[str or None, str]]
+      (parentNodeId, nodeId) pairs. Parent is None or "" to insert node as root.
+    status: PlaceStatus
+      Status of the inserted nodes
+
+    Raises
+    ------
+      ValueError
+        If a parent node doesn't exist in the tree when its edge is inserted. Edges before the invalid edge are kept.
+    """
+    self._beginEdit()
+    try:
+      for parentNodeId, nodeId in edges:
+        if parentNodeId and not self.isInTree(parentNodeId):
+          raise ValueError("Parent node {} is not in the tree".format(parentNodeId))
+        self._insertNode(nodeId, parentNodeId or None, status, notify=False)
+    finally:
+      self.treeReset.emit()
+      self._notifyModified()
+      self._endEdit()
+
+  def insertBeforeNode(self, nodeId, beforeNodeId, status=PlaceStatus.NOT_PLACED):
+    """Insert given node before the input node Id. Inserts new node as root if beforeNodeId is None.
+
+    Parameters
+    ----------
+    nodeId: str
+      Unique ID of the node to insert in the tree
+    beforeNodeId: str or None
+      Unique ID of the node before which the new node will be inserted. If None or "" will insert node at root.
+    status: PlaceStatus
+
+    Raises
+    ------
+      ValueError
+        If beforeNodeId is not None and doesn't exist in the tree
+    """
+    if beforeNodeId and not self.isInTree(beforeNodeId):
+      raise ValueError("Node {} is not in the tree".format(beforeNodeId))
+
+    self._beginEdit()
+    if not beforeNodeId:
+      self._insertNode(nodeId, None, status)
+    else:
+      parentNodeId = self._parents[beforeNodeId]
+      self._detach(beforeNodeId)
+      self._insertNode(nodeId, parentNodeId, status)
+      self._attach(beforeNodeId, nodeId)
+
+    self._notifyModified()
+    self._endEdit()
+
+  def removeNode(self, nodeId):
+    """Remove given node from tree.
+
+    If node is root, only remove if it has exactly one direct child and replace root by child. Else does nothing.
+    If intermediate node, move each child of node to node parent.
+
+    Returns
+    -------
+    bool - True if node was removed, False otherwise
+    """
+    parentId = self._parents[nodeId]
+    children = self._children[nodeId]
+    if parentId is None and len(children) > 1:
+      return False
+
+    self._beginEdit()
+    self._touch(nodeId)
+    iRoot = self._roots.index(nodeId) if parentId is None else None
+    self._detach(nodeId)
+    for childId in list(children):
+      self._detach(childId)
+      self._attach(childId, parentId, iRoot)
+
+    del self._parents[nodeId]
+    del self._children[nodeId]
+    del self._status[nodeId]
+    self.nodeRemoved.emit(nodeId)
+    self._notifyModified()
+    self._endEdit()
+    return True
+
+  def setTreeParentList(self, treeParentList, statusDict=None):
+    """Replaces the tree structure by the input adjacent list.
+
+    Parameters
+    ----------
+    treeParentList: List[List[str]]
+      Adjacent list in the getTreeParentList format. Children are added to their parent in the list order and may be
+      listed before their parent.
+    statusDict: Dict[str, PlaceStatus] or None
+      Status of the nodes. If None, status of the nodes already in the tree is kept and new nodes are not placed.
+    """
+    previousStates = {nodeId: self._nodeState(nodeId) for nodeId in self.getNodeList()}
+    previousRoots = list(self._roots)
+    previousStatus = self._status if statusDict is None else statusDict
+    self._parents = {}
+    self._children = {}
+    self._status = {}
+    self._roots = []
+    for parentId, childId in treeParentList:
+      self._parents[childId] = parentId
+      self._children.setdefault(childId, [])
+      self._status[childId] = previousStatus.get(childId, PlaceStatus.NOT_PLACED)
+
+    for parentId, childId in treeParentList:
+      if parentId is None:
+        self._roots.append(childId)
+      else:
+        self._children[parentId].append(childId)
+
+    self.treeReset.emit()
+    self._notifyModified()
+    self._emitReplacementEdit(previousStates, previousRoots)
+
+  def _emitReplacementEdit(self, previousStates, previousRoots):
+    """Emits the edit of a whole structure replacement restricted to the nodes whose state changed"""
+    changedIds = [nodeId for nodeId in set(previousStates).union(self.getNodeList())
+                  if previousStates.get(nodeId) != self._nodeState(nodeId)]
+    edit = TreeEdit({nodeId: previousStates.get(nodeId) for nodeId in changedIds},
+                    {nodeId: self._nodeState(nodeId) for nodeId in changedIds}, previousRoots, list(self._roots))
+    if not edit.isEmpty():
+      self.edited.emit(edit)
+
+  def _insertNode(self, nodeId, parentId, status, notify=True):
+    self._touch(nodeId)
+    isNew = not self.isInTree(nodeId)
+    if isNew:
+      self._children[nodeId] = []
+    else:
+      self._detach(nodeId)
+
+    self._status[nodeId] = status
+    if parentId is None:
+      # New root becomes the parent of the previous root
+      previousRoots = list(self._roots)
+      self._attach(nodeId, None)
+      if previousRoots:
+        self._detach(previousRoots[0])
+        self._attach(previousRoots[0], nodeId)
+    else:
+      self._attach(nodeId, parentId)
+
+    if isNew and notify:
+      self.nodeInserted.emit(nodeId)
+
+  def _detach(self, nodeId):
+    parentId = self._parents.get(nodeId)
+    self._touch(nodeId)
+    self._touch(parentId)
+    siblings = self._roots if parentId is None else self._children[parentId]
+    if nodeId in siblings:
+      siblings.remove(nodeId)
+    self._parents[nodeId] = None
+
+  def _attach(self, nodeId, parentId, index=None):
+    self._touch(nodeId)
+    self._touch(parentId)
+    siblings = self._roots if parentId is None else self._children[parentId]
+    siblings.insert(len(siblings) if index is None else index, nodeId)
+    self._parents[nodeId] = parentId
+
+
+def saveVesselTree(filePath, vesselTree, idPositionDict):
+  """Saves the tree structure, node status and node positions to the input file.
+
+  The file contains one JSON header line with the format version, the node ids, their parent index and their status,
+  followed by the node positions packed as little endian float64 N x 3 array. Nodes without position are saved as NaN.
+  Transient placing status are saved as their stable counterpart.
+
+  Parameters
+  ----------
+  filePath: str
+  vesselTree: VesselTreeModel or VesselBranchTree
+  idPositionDict: Dict[str, List[float]]
+    Dictionary with nodeId as key and node position as value
+  """
+  treeParentList = vesselTree.getTreeParentList()
+  nodeIds = [nodeId for _, nodeId in treeParentList]
+  nodeIndex = {nodeId: i for i, nodeId in enumerate(nodeIds)}
+
+  header = {"format": TREE_FILE_FORMAT, "version": TREE_FILE_VERSION, "nodeIds": nodeIds,
+            "parentIndices": [nodeIndex[parentId] if parentId is not None else -1 for parentId, _ in treeParentList],
+            "status": [_stableStatus(vesselTree.getStatus(nodeId)) for nodeId in nodeIds]}
+  positions = np.array([idPositionDict.get(nodeId, [np.nan] * 3) for nodeId in nodeIds], dtype="<f8").reshape(-1, 3)
+
+  with open(filePath, "wb") as f:
+    f.write(json.dumps(header).encode("utf-8") + b"\n")
+    f.write(positions.tobytes())
+
+
+def _parentFirstOrder(parentIndices, filePath):
+  """Returns the node indices in file order where each node is moved after its parent.
+
+  Raises
+  ------
+    ValueError
+      If the parent indices form a cycle
+  """
+  isAdded = [False] * len(parentIndices)
+  order = []
+  for i in range(len(parentIndices)):
+    # Walk up to the first added ancestor and add the walked nodes from the top
+    ancestors = []
+    walkedIds = set()
+    iNode = i
+    while iNode >= 0 and not isAdded[iNode]:
+      if iNode in walkedIds:
+        raise ValueError("{} header is invalid. Parent indices form a cycle".format(filePath))
+      ancestors.append(iNode)
+      walkedIds.add(iNode)
+      iNode = parentIndices[iNode]
+
+    for iAncestor in reversed(ancestors):
+      isAdded[iAncestor] = True
+      order.append(iAncestor)
+  return order
+
+
+def loadVesselTree(filePath):
+  """Loads a vessel tree saved with saveVesselTree.
+
+  Nodes listed before their parent in the file are moved after their parent in the returned adjacent list.
+
+  Returns
+  -------
+  Tuple[List[List[str]], Dict[str, PlaceStatus], Dict[str, List[float]]]
+    Tree adjacent list in the getTreeParentList format, status of each node and position of each node with position
+
+  Raises
+  ------
+    ValueError
+      If the file is not a vessel tree file, was saved with a newer format version or its header is inconsistent
+      (missing entries, duplicated node ids, parent indices out of range or forming a cycle)
+  """
+  with open(filePath, "rb") as f:
+    try:
+      header = json.loads(f.readline().decode("utf-8"))
+    except ValueError:
+      raise ValueError("{} is not a vessel tree file".format(filePath))
+    positions = np.frombuffer(f.read(), dtype="<f8").reshape(-1, 3)
+
+  if not isinstance(header, dict) or header.get("format") != TREE_FILE_FORMAT:
+    raise ValueError("{} is not a vessel tree file".format(filePath))
+
+  missingKeys = [key for key in ("version", "nodeIds", "parentIndices", "status") if key not in header]
+  if missingKeys:
+    raise ValueError("{} header is missing the {} entries".format(filePath, ", ".join(missingKeys)))
+  if header["version"] > TREE_FILE_VERSION:
+    raise ValueError("Vessel tree file version {} is not supported. Maximum supported version is {}".format(
+      header["version"], TREE_FILE_VERSION))
+
+  nodeIds = header["nodeIds"]
+  for key in ("parentIndices", "status"):
+    if len(header[key]) != len(nodeIds):
+      raise ValueError("{} header is invalid. Expected {} {}, got {}".format(filePath, len(nodeIds), key,
+                                                                            len(header[key])))
+  if len(set(nodeIds)) != len(nodeIds):
+    raise ValueError("{} header is invalid. Node ids are duplicated".format(filePath))
+  if any(not -1 <= iParent < len(nodeIds) for iParent in header["parentIndices"]):
+    raise ValueError("{} header is invalid. Parent indices are out of the node ids range".format(filePath))
+  if len(positions) != len(nodeIds):
+    raise ValueError("{} is truncated. Expected {} node positions, got {}".format(filePath, len(nodeIds),
+                                                                                 len(positions)))
+
+  parentIndices = header["parentIndices"]
+  treeParentList = [[nodeIds[parentIndices[i]] if parentIndices[i] >= 0 else None, nodeIds[i]]
+                    for i in _parentFirstOrder(parentIndices, filePath)]
+  statusDict = dict(zip(nodeIds, header["status"]))
+  idPositionDict = {nodeId: position.tolist() for nodeId, position in zip(nodeIds, positions)
+                    if not np.any(np.isnan(position))}
+  return treeParentList, statusDict, idPositionDict
@@ -0,0 +1,372 @@
+import qt
+
+from RVXLiverSegmentationLib import Signal, VesselTreeColumnRole
+from .RVXLiverSegmentationUtils import Icons
+from .VesselBranchTree import nodeDisplayText
+
+
+class VesselTreeItemModel(qt.QAbstractItemModel):
+  """Qt item model exposing a VesselTreeModel to the Qt item views.
+
+  No item is stored per node. Model indices are created on demand by the view for the visible rows only and carry
+  an integer id mapped to the node id. Children of each node are exposed by batches through canFetchMore / fetchMore
+  to keep nodes with a large number of children responsive. Tooltip images are only generated when requested by the
+  view.
+
+  The item model keeps the children ids it exposed for each fetched parent. Node insertions and removals are
+  forwarded to the views as row insertions and removals of the parents they touch by comparing the exposed children
+  with the tree model. Structure replacements and moves without insertion or removal reset the item model.
+  """
+
+  fetchBatchSize = 256
+
+  def __init__(self, vesselHelpWidget, treeModel, parent=None):
+    """
+    Parameters
+    ----------
+    vesselHelpWidget: VesselHelpWidget
+    treeModel: VesselTreeModel
+    parent: Optional[qt.QObject]
+    """
+    qt.QAbstractItemModel.__init__(self, parent)
+    self._vesselHelpWidget = vesselHelpWidget
+    self._treeModel = treeModel
+    self._nodeIds = []
+    self._internalIds = {}
+
+    # Children ids exposed for each fetched parent (None for the roots) and parent and row of each exposed node
+    self._exposedChildren = {}
+    self._exposedParents = {}
+    self._exposedRows = {}
+
+    # Parents touched by the node insertions and removals since the last tree modification
+    self._pendingParentIds = set()
+    self._hasPendingNodeChanges = False
+    self._isResetPending = False
+
+    self._treeModel.nodeInserted.connect(self._onNodeInserted)
+    self._treeModel.nodeRemoved.connect(self._onNodeRemoved)
+    self._treeModel.treeReset.connect(self._onTreeReset)
+    self._treeModel.modified.connect(self._onTreeModified)
+    self._treeModel.statusChanged.connect(self._onStatusChanged)
+
+  def getTreeModel(self):
+    return self._treeModel
+
+  def _onNodeInserted(self, nodeId):
+    # Inserted node parent gets a new row and nodes inserted before an existing node get children
+    self._pendingParentIds.update([self._treeModel.getParentNodeId(nodeId), nodeId])
+    self._hasPendingNodeChanges = True
+
+  def _onNodeRemoved(self, nodeId):
+    # Children of the removed node are moved to the removed node parent
+    if nodeId in self._exposedParents:
+      self._pendingParentIds.add(self._exposedParents[nodeId])
+    self._hasPendingNodeChanges = True
+
+  def _onTreeReset(self):
+    self._isResetPending = True
+
+  def _onTreeModified(self):
+    try:
+      if self._isResetPending or not self._hasPendingNodeChanges or not self._updatePendingRows():
+        self._resetModel()
+    finally:
+      self._pendingParentIds = set()
+      self._hasPendingNodeChanges = False
+      self._isResetPending = False
+
+  def _resetModel(self):
+    self.beginResetModel()
+    self._exposedChildren = {}
+    self._exposedParents = {}
+    self._exposedRows = {}
+    self.endResetModel()
+
+  def _updatePendingRows(self):
+    """Removes the exposed rows of the pending parents which are not children anymore and inserts the new children.
+    Every removal is done before the insertions for the moved nodes to never be exposed twice.
+
+    Returns
+    -------
+    bool
+      False if the exposed rows couldn't be updated and the item model needs to be reset
+    """
+    pendingIds = [parentId for parentId in self._pendingParentIds if self._isExposedParent(parentId)]
+    targets = {parentId: self._targetChildIds(parentId) for parentId in pendingIds}
+    for parentId in pendingIds:
+      self._removeOutdatedRows(parentId, targets[parentId])
+
+    if any(self._exposedParents.get(childId, parentId) != parentId
+           for parentId in pendingIds for childId in targets[parentId]):
+      return False
+
+    for parentId in sorted(pendingIds, key=self._depth):
+      if self._isExposedParent(parentId):
+        self._insertMissingRows(parentId, targets[parentId])
+    return True
+
+  def _isExposedParent(self, parentId):
+    if parentId is None:
+      return parentId in self._exposedChildren
+    return parentId in self._exposedChildren and parentId in self._exposedRows and self._treeModel.isInTree(parentId)
+
+  def _depth(self, nodeId):
+    depth = 0
+    while nodeId is not None:
+      nodeId = self._treeModel.getParentNodeId(nodeId)
+      depth += 1
+    return depth
+
+  def _targetChildIds(self, parentId):
+    """Children of parentId in the tree model limited to the number of rows already fetched"""
+    exposedCount = max(len(self._exposedChildren[parentId]), self.fetchBatchSize)
+    childCount = min(self._treeModel.getChildCount(parentId), exposedCount)
+    return [self._treeModel.getNthChildNodeId(parentId, i) for i in range(childCount)]
+
+  def _removeOutdatedRows(self, parentId, targetIds):
+    if not self._isExposedParent(parentId):
+      return
+
+    targetSet = set(targetIds)
+    exposedIds = self._exposedChildren[parentId]
+    for row in reversed(range(len(exposedIds))):
+      if exposedIds[row] not in targetSet:
+        self._removeRows(parentId, row, row)
+
+    # Kept rows must be in the same order as in the tree model for the new rows to be inserted between them
+    keptSet = set(exposedIds)
+    if exposedIds != [nodeId for nodeId in targetIds if nodeId in keptSet]:
+      self._removeRows(parentId, 0, len(exposedIds) - 1)
+
+  def _insertMissingRows(self, parentId, targetIds):
+    exposedIds = self._exposedChildren[parentId]
+    for row, nodeId in enumerate(targetIds):
+      if row >= len(exposedIds) or exposedIds[row] != nodeId:
+        self.beginInsertRows(self._exposedIndex(parentId), row, row)
+        exposedIds.insert(row, nodeId)
+        self._exposedParents[nodeId] = parentId
+        self._updateExposedRows(parentId, row)
+        self.endInsertRows()
+
+  def _removeRows(self, parentId, first, last):
+    self.beginRemoveRows(self._exposedIndex(parentId), first, last)
+    exposedIds = self._exposedChildren[parentId]
+    for nodeId in exposedIds[first:last + 1]:
+      self._forgetExposedNode(nodeId, parentId)
+    del exposedIds[first:last + 1]
+    self._updateExposedRows(parentId, first)
+    self.endRemoveRows()
+
+  def _forgetExposedNode(self, nodeId, parentId):
+    """Forgets the exposed rows of the input node and of its exposed sub tree"""
+    toForget = [(nodeId, parentId)]
+    while toForget:
+      forgottenId, forgottenParentId = toForget.pop()
+      if forgottenId not in self._exposedParents or self._exposedParents[forgottenId] != forgottenParentId:
+        continue
+
+      del self._exposedParents[forgottenId]
+      del self._exposedRows[forgottenId]
+      toForget.extend((childId, forgottenId) for childId in self._exposedChildren.pop(forgottenId, []))
+
+  def _updateExposedRows(self, parentId, firstRow):
+    exposedIds = self._exposedChildren[parentId]
+    for row in range(firstRow, len(exposedIds)):
+      self._exposedRows[exposedIds[row]] = row
+
+  def _exposedChildIds(self, parentId):
+    """Returns the children ids exposed for parentId. First batch of children is exposed on first access."""
+    if parentId is not None and not self._treeModel.isInTree(parentId):
+      return []
+
+    if parentId not in self._exposedChildren:
+      self._exposedChildren[parentId] = []
+      self._exposeChildren(parentId, self.fetchBatchSize)
+    return self._exposedChildren[parentId]
+
+  def _exposeChildren(self, parentId, count):
+    exposedIds = self._exposedChildren[parentId]
+    firstRow = len(exposedIds)
+    lastRow = min(self._treeModel.getChildCount(parentId), firstRow + count)
+    exposedIds.extend(self._treeModel.getNthChildNodeId(parentId, row) for row in range(firstRow, lastRow))
+    for row in range(firstRow, lastRow):
+      self._exposedParents[exposedIds[row]] = parentId
+      self._exposedRows[exposedIds[row]] = row
+
+  def _exposedIndex(self, nodeId):
+    if nodeId is None:
+      return qt.QModelIndex()
+    return self.createIndex(self._exposedRows[nodeId], 0, self._internalId(nodeId))
+
+  def _onStatusChanged(self, nodeId, status):
+    if nodeId not in self._exposedRows:
+      return
+
+    index = self._exposedIndex(nodeId)
+    self.dataChanged(index, index)
+
+  def _internalId(self, nodeId):
+    if nodeId not in self._internalIds:
+      self._internalIds[nodeId] = len(self._nodeIds)
+      self._nodeIds.append(nodeId)
+    return self._internalIds[nodeId]
+
+  def nodeId(self, index):
+    """
+    Returns
+    -------
+    str or None
+      Id of the node associated with the index. None for the invalid index
+    """
+    return self._nodeIds[index.internalId()] if index.isValid() else None
+
+  def indexOfNode(self, nodeId, column=0):
+    """Returns the model index of the input node. Rows of the node and of its ancestors are fetched if necessary.
+
+    Returns
+    -------
+    qt.QModelIndex
+    """
+    if nodeId is None or not self._treeModel.isInTree(nodeId):
+      return qt.QModelIndex()
+
+    parentId = self._treeModel.getParentNodeId(nodeId)
+    parentIndex = self.indexOfNode(parentId)
+    self._exposedChildIds(parentId)
+    while self._exposedParents.get(nodeId) != parentId and self.canFetchMore(parentIndex):
+      self.fetchMore(parentIndex)
+    return self.createIndex(self._exposedRows[nodeId], column, self._internalId(nodeId))
+
+  def index(self, row, column, parent=qt.QModelIndex()):
+    exposedIds = self._exposedChildIds(self.nodeId(parent))
+    if row < 0 or column < 0 or column >= self.columnCount(parent) or row >= len(exposedIds):
+      return qt.QModelIndex()
+    return self.createIndex(row, column, self._internalId(exposedIds[row]))
+
+  def parent(self, index=None):
+    if index is None:
+      return qt.QAbstractItemModel.parent(self)
+
+    parentId = self._exposedParents.get(self.nodeId(index)) if index.isValid() else None
+    if parentId is None:
+      return qt.QModelIndex()
+    return self._exposedIndex(parentId)
+
+  def rowCount(self, parent=qt.QModelIndex()):
+    if parent.column() > 0:
+      return 0
+    return len(self._exposedChildIds(self.nodeId(parent)))
+
+  def columnCount(self, parent=qt.QModelIndex()):
+    return 3
+
+  def hasChildren(self, parent=qt.QModelIndex()):
+    if parent.column() > 0:
+      return False
+    parentId = self.nodeId(parent)
+    if parentId is not None and not self._treeModel.isInTree(parentId):
+      return False
+    return self._treeModel.getChildCount(parentId) > 0
+
+  def canFetchMore(self, parent):
+    parentId = self.nodeId(parent)
+    if parentId is not None and not self._treeModel.isInTree(parentId):
+      return False
+    return len(self._exposedChildIds(parentId)) < self._treeModel.getChildCount(parentId)
+
+  def fetchMore(self, parent):
+    if not self.canFetchMore(parent):
+      return
+
+    parentId = self.nodeId(parent)
+    fetchedCount = len(self._exposedChildIds(parentId))
+    nextCount = min(self._treeModel.getChildCount(parentId), fetchedCount + self.fetchBatchSize)
+    if nextCount <= fetchedCount:
+      return
+
+    self.beginInsertRows(parent, fetchedCount, nextCount - 1)
+    self._exposeChildren(parentId, nextCount - fetchedCount)
+    self.endInsertRows()
+
+  def data(self, index, role=qt.Qt.DisplayRole):
+    nodeId = self.nodeId(index)
+    if nodeId is None or not self._treeModel.isInTree(nodeId):
+      return None
+
+    column = index.column()
+    if role == qt.Qt.DisplayRole:
+      if column == VesselTreeColumnRole.NODE_ID:
+        return nodeDisplayText(nodeId, self._treeModel.getStatus(nodeId))
+      if column == VesselTreeColumnRole.INSERT_BEFORE:
+        return "Insert Before"
+    elif role == qt.Qt.DecorationRole and column == VesselTreeColumnRole.DELETE:
+      return Icons.delete
+    elif role == qt.Qt.ToolTipRole and column == VesselTreeColumnRole.NODE_ID:
+      return self._vesselHelpWidget.tooltipImageUrl(nodeId)
+    return None
+
+  def headerData(self, section, orientation, role=qt.Qt.DisplayRole):
+    if orientation != qt.Qt.Horizontal:
+      return None
+    if role == qt.Qt.DisplayRole and section == VesselTreeColumnRole.NODE_ID:
+      return "Branch Node Name"
+    if role == qt.Qt.DecorationRole and section == VesselTreeColumnRole.DELETE:
+      return Icons.delete
+    return None
+
+  def flags(self, index):
+    if not index.isValid():
+      return qt.Qt.NoItemFlags
+    return qt.Qt.ItemIsEnabled | qt.Qt.ItemIsSelectable
+
+
+class VesselTreeView(qt.QTreeView):
+  """Read only view of a VesselTreeModel backed by a VesselTreeItemModel. Intended for the very large trees generated
+  from skeletons or imported graphs for which creating one QTreeWidgetItem per node is too slow.
+
+  Signals the clicked node id and column with nodeClicked.
+  """
+
+  def __init__(self, vesselHelpWidget, treeModel, parent=None):
+    """
+    Parameters
+    ----------
+    vesselHelpWidget: VesselHelpWidget
+    treeModel: VesselTreeModel
+    parent: Optional[qt.QWidget]
+    """
+    qt.QTreeView.__init__(self, parent)
+    self.nodeClicked = Signal("str, int")
+
+    self._itemModel = VesselTreeItemModel(vesselHelpWidget, treeModel, self)
+    self.setModel(self._itemModel)
+
+    # Every row has the same height which lets the view skip measuring the rows outside of the viewport
+    self.setUniformRowHeights(True)
+    self.header().setSectionResizeMode(0, qt.QHeaderView.Stretch)
+    self.header().setStretchLastSection(False)
+    self.header().setSectionResizeMode(1, qt.QHeaderView.ResizeToContents)
+    self.header().setSectionResizeMode(2, qt.QHeaderView.ResizeToContents)
+
+    self.connect("clicked(QModelIndex)", self._onClicked)
+    self._itemModel.connect("modelReset()", lambda: self.expandToDepth(0))
+    self.expandToDepth(0)
+
+  def getItemModel(self):
+    return self._itemModel
+
+  def _onClicked(self, index):
+    nodeId = self._itemModel.nodeId(index)
+    if nodeId is not None:
+      self.nodeClicked.emit(nodeId, index.column())
+
+  def getCurrentNodeId(self):
+    return self._itemModel.nodeId(self.currentIndex())
+
+  def setCurrentNodeId(self, nodeId):
+    """Selects the input node and scrolls the view to make it visible"""
+    index = self._itemModel.indexOfNode(nodeId)
+    self.setCurrentIndex(index)
+    if index.isValid():
+      self.scrollTo(index)
@@ -8,12 +8,27 @@ import slicer
 from RVXLiverSegmentationLib import setup_portal_vein_default_branch, setup_inferior_cava_vein_default_branch, \
   VesselHelpWidget, createButton, VesselHelpType
 from .ExtractVesselStrategies import ExtractOneVesselPerBranch, ExtractOneVesselPerParentAndSubChildNode, \
-  ExtractOneVesselPerParentChildNode, ExtractAllVesselsInOneGoStrategy
+  ExtractOneVesselPerParentChildNode, ExtractAllVesselsInOneGoStrategy, ExtractVesselsByCluster
+from .MinimalPathCenterline import extractMinimalPathCenterlines, minimalPathModuleName, minimalPathPackageName
 from .RVXLiverSegmentationLogic import VesselnessFilterParameters, LevelSetParameters
 from .RVXLiverSegmentationUtils import GeometryExporter, removeNodesFromMRMLScene, createDisplayNodeIfNecessary, Signal, \
-  getMarkupIdPositionDictionary
+  getMarkupIdPositionDictionary, installPythonPackageIfNeeded
 from .VerticalLayoutWidget import VerticalLayoutWidget
-from .VesselBranchTree import VesselBranchWidget, VesselBranchTree
+from .VesselBranchTree import VesselBranchWidget, VesselBranchTree, TreeDrawer
+from .VesselTreeModel import saveVesselTree, TREE_FILE_EXTENSION
+
+
+class VesselTreeExporter(GeometryExporter):
+  """Exports the vessel tree, node status and node positions in the format read by VesselBranchWidget.loadTree
+  """
+
+  def __init__(self, **elementsToExport):
+    GeometryExporter.__init__(self, **elementsToExport)
+
+  def exportToDirectory(self, selectedDir):
+    for treeName, (markup, tree) in self._elementsToExport.items():
+      filePath = os.path.join(selectedDir, treeName + "Tree" + TREE_FILE_EXTENSION)
+      saveVesselTree(filePath, tree, getMarkupIdPositionDictionary(markup))
 
 
 class VesselAdjacencyMatrixExporter(GeometryExporter):
@@ -50,7 +65,7 @@ class VesselAdjacencyMatrixExporter(GeometryExporter):
   @classmethod
   def toAdjacencyMatrix(cls, tree):
     """
-    :type tree: VesselBranchTree
+    :type tree: VesselTreeModel or VesselBranchTree
     :return: Tuple[List[str], List[List[int]]]
     """
     node_list = sorted(tree.getNodeList())
@@ -75,7 +90,7 @@ class VesselAdjacencyMatrixExporter(GeometryExporter):
     Parameters
     ----------
       markup: Slicer MarkupFiducialNode
-      tree: VesselBranchTree
+      tree: VesselTreeModel or VesselBranchTree
 
     Returns
     -------
@@ -119,7 +134,8 @@ class VesselWidget(VerticalLayoutWidget):
     """
     VerticalLayoutWidget.__init__(self, widgetName + " Tab")
 
-    self.vesselSegmentationChanged = Signal("vtkMRMLLabelMapVolumeNode", "List[str]")
+    self.vesselSegmentationChanged = Signal("vtkMRMLLabelMapVolumeNode", "NodeBranches",
+                                            "Optional[Tuple[vtkMRMLLabelMapVolumeNode, Dict[str, int]]]")
 
     self._widgetName = widgetName
     self._vesselStartSelector = None
@@ -127,12 +143,15 @@ class VesselWidget(VerticalLayoutWidget):
     self._vesselnessVolume = None
     self._vesselVolumeNode = None
     self._vesselModelNode = None
+    self._vesselBranchLabelMap = None
+    self._nodeTreeCenterLineModel = None
     self._inputVolume = None
     self._vesselnessDisplay = None
     self._logic = logic
     self._segmentationOpacity = 0.7  # Initial segmentation opacity set to 70% to still view the vessel tree
     self._vesselBranchWidget = VesselBranchWidget(setupBranchF, vesselHelpWidget)
     self._vesselBranchWidget.extractVesselsButton.connect("clicked(bool)", self._extractVessel)
+    self._vesselBranchWidget.extractCenterlinesButton.connect("clicked(bool)", self._extractNodeTreeCenterlines)
     self._vesselBranchWidget.treeValidityChanged.connect(self._updateButtonStatusAndFilterParameters)
 
     # Extraction strategies
@@ -141,6 +160,7 @@ class VesselWidget(VerticalLayoutWidget):
     self._strategies["One vessel per parent child"] = ExtractOneVesselPerParentChildNode()
     self._strategies["One vessel per parent and sub child"] = ExtractOneVesselPerParentAndSubChildNode()
     self._strategies["One vessel for whole tree"] = ExtractAllVesselsInOneGoStrategy()
+    self._strategies["One vessel per branch cluster"] = ExtractVesselsByCluster()
     self._defaultStrategy = "One vessel per branch"
 
     # LevelSet Initialization
@@ -165,6 +185,8 @@ class VesselWidget(VerticalLayoutWidget):
 
   def clear(self):
     self._removePreviouslyExtractedVessels()
+    removeNodesFromMRMLScene([self._nodeTreeCenterLineModel])
+    self._nodeTreeCenterLineModel = None
     self._vesselBranchWidget.clear()
 
   def _createHelpWidget(self, vesselHelpWidget):
@@ -229,6 +251,15 @@ class VesselWidget(VerticalLayoutWidget):
     treeLineOpacitySlider.connect(valueChangedSig, tree.setOpacity)
     advancedFormLayout.addRow("Line opacity:", treeLineOpacitySlider)
 
+    coloringArrays = OrderedDict([("Single color", None), ("Branch", TreeDrawer.branchIdArrayName),
+                                  ("Depth", TreeDrawer.depthArrayName)])
+    treeLineColoringChoice = qt.QComboBox()
+    treeLineColoringChoice.addItems(list(coloringArrays.keys()))
+    treeLineColoringChoice.toolTip = "Choose how the tree lines are colored"
+    treeLineColoringChoice.connect("currentIndexChanged(QString)",
+                                   lambda text: tree.setScalarColoring(coloringArrays[text]))
+    advancedFormLayout.addRow("Line coloring:", treeLineColoringChoice)
+
     # Segmented volume display
     segmentationOpacity = ctk.ctkSliderWidget()
     segmentationOpacity.decimals = 1
@@ -280,6 +311,14 @@ class VesselWidget(VerticalLayoutWidget):
     self._minRoiSlider.toolTip = "Minimum thickness of the bounding box in pixels."
     self._vesselnessFormLayout.addRow("Min Bounding Box extent:", self._minRoiSlider)
 
+    self._roiClusterCountSpinBox = qt.QSpinBox()
+    self._roiClusterCountSpinBox.minimum = 1
+    self._roiClusterCountSpinBox.maximum = 20
+    self._roiClusterCountSpinBox.singleStep = 1
+    self._roiClusterCountSpinBox.toolTip = "Number of bounding boxes around clustered tree branches. Using more than " \
+                                           "one box limits vesselness filter to the voxels close to the branches."
+    self._vesselnessFormLayout.addRow("Bounding box count:", self._roiClusterCountSpinBox)
+
     # VMTK parameters
     self._minimumDiameterSpinBox = qt.QSpinBox()
     self._minimumDiameterSpinBox.minimum = 1
@@ -429,6 +468,23 @@ class VesselWidget(VerticalLayoutWidget):
     self._strategyChoice.toolTip = "Choose the strategy for vessel tree segmentation"
     segmentationAdvancedFormLayout.addRow("Segmentation strategy:", self._strategyChoice)
 
+    # Cluster size spinbox
+    self._clusterSizeSpinBox = qt.QSpinBox()
+    self._clusterSizeSpinBox.minimum = 16
+    self._clusterSizeSpinBox.maximum = 1024
+    self._clusterSizeSpinBox.singleStep = 16
+    self._clusterSizeSpinBox.suffix = " voxels"
+    self._clusterSizeSpinBox.toolTip = "Edge length of the largest cubic box in which branches are grouped by the " \
+                                       "branch cluster strategy. Larger clusters lead to fewer segmentation runs " \
+                                       "over more voxels."
+    segmentationAdvancedFormLayout.addRow("Branch cluster size:", self._clusterSizeSpinBox)
+
+    # Branch labels check box
+    self._keepBranchLabelsCheckBox = qt.QCheckBox()
+    self._keepBranchLabelsCheckBox.toolTip = "If checked, the segmented voxels will be pre-split between the tree " \
+                                             "branches before vessel splitting."
+    segmentationAdvancedFormLayout.addRow("Keep branch labels:", self._keepBranchLabelsCheckBox)
+
     # initialization combo box
     self._levelSetInitializationChoice = qt.QComboBox()
     self._levelSetInitializationChoice.addItems(list(self._levelSetInitializations.keys()))
@@ -492,7 +548,7 @@ class VesselWidget(VerticalLayoutWidget):
     self._removePreviouslyExtractedVessels()
 
     # Call vessel extraction strategy and inform user of vessel extraction
-    branchTree = self._vesselBranchWidget.getBranchTree()
+    branchTree = self._vesselBranchWidget.getTreeModel()
     branchMarkupNode = self._vesselBranchWidget.getBranchMarkupNode()
 
     progressText = "Extracting vessels volume from branch nodes.\nThis may take a minute..."
@@ -510,12 +566,17 @@ class VesselWidget(VerticalLayoutWidget):
       progressDialog.repaint()
       self._updateVesselnessVolume()
       strategy = self._strategies[self._strategyChoice.currentText]
+      strategy.keepBranchLabels = self._keepBranchLabelsCheckBox.checked
+      if isinstance(strategy, ExtractVesselsByCluster):
+        strategy.maxClusterVoxels = self._clusterSizeSpinBox.value ** 3
       progressDialog.setLabelText(progressText + "\n\nSegmenting Vessels...")
       progressDialog.repaint()
       self._vesselVolumeNode, self._vesselModelNode = strategy.extractVesselVolumeFromVesselBranchTree(branchTree,
                                                                                                        branchMarkupNode,
                                                                                                        self._logic)
-      self.vesselSegmentationChanged.emit(self._vesselVolumeNode, self._vesselBranchWidget.getBranchNames())
+      self._vesselBranchLabelMap = strategy.getBranchLabelMap()
+      self.vesselSegmentationChanged.emit(self._vesselVolumeNode, self._vesselBranchWidget.getBranchNames(),
+                                          self._vesselBranchLabelMap)
       self._setSegmentationOpacity(self._segmentationOpacity)
 
     except Exception as e:
@@ -528,10 +589,46 @@ class VesselWidget(VerticalLayoutWidget):
     progressDialog.hide()
     self._updateVisibility()
 
+  def _extractNodeTreeCenterlines(self):
+    """Extract centerlines directly from vessel branch tree and vesselness volume without level set segmentation.
+    """
+    self._vesselBranchWidget.stopInteraction()
+    removeNodesFromMRMLScene([self._nodeTreeCenterLineModel])
+    self._nodeTreeCenterLineModel = None
+
+    featureName = "Centerline extraction from branch nodes"
+    if not installPythonPackageIfNeeded(minimalPathModuleName, minimalPathPackageName, featureName):
+      slicer.util.errorDisplay("{} requires the {} Python package.".format(featureName, minimalPathPackageName))
+      return
+
+    progressDialog = slicer.util.createProgressDialog(parent=self, windowTitle="Extracting centerlines",
+                                                      labelText="Extracting centerlines from branch nodes...")
+    progressDialog.setRange(0, 0)
+    progressDialog.setModal(True)
+    progressDialog.show()
+    slicer.app.processEvents()
+    try:
+      self._updateVesselnessVolume()
+      self._nodeTreeCenterLineModel = extractMinimalPathCenterlines(self._vesselBranchWidget.getTreeModel(),
+                                                                    self._vesselBranchWidget.getBranchMarkupNode(),
+                                                                    self._logic.getCurrentVesselnessVolume())
+      self._nodeTreeCenterLineModel.SetName(self._widgetName.replace(" ", "") + "NodeTreeCenterLine")
+    except Exception as e:
+      import traceback
+      info = traceback.format_exc()
+      warning_message = "An error happened while extracting centerlines.\n{}\n\n{}".format(str(e), info)
+      qt.QMessageBox.warning(self, "Failed to extract centerlines", warning_message)
+
+    progressDialog.hide()
+    self._updateVisibility()
+
   def _removePreviouslyExtractedVessels(self):
     """Remove previous nodes from mrmlScene if necessary.
     """
     removeNodesFromMRMLScene([self._vesselVolumeNode, self._vesselModelNode])
+    if self._vesselBranchLabelMap is not None:
+      removeNodesFromMRMLScene([self._vesselBranchLabelMap[0]])
+      self._vesselBranchLabelMap = None
 
   def _updateLevelSetParameters(self):
     """
@@ -559,6 +656,7 @@ class VesselWidget(VerticalLayoutWidget):
     parameters.vesselContrast = self._contrastSlider.value
     parameters.roiGrowthFactor = self._roiSlider.value
     parameters.minROIExtent = self._minRoiSlider.value
+    parameters.roiClusterCount = self._roiClusterCountSpinBox.value
     parameters.useROI = self._useROI.checked
     parameters.useVmtkFilter = self._useVmtkCheckBox.checked
     parameters.satoSigma = self._satoSigmaSpinBox.value
@@ -566,8 +664,11 @@ class VesselWidget(VerticalLayoutWidget):
     parameters.satoAlpha2 = self._satoAlpha2SpinBox.value
     self._logic.vesselnessFilterParameters = parameters
 
-    idPositionDict = getMarkupIdPositionDictionary(self._vesselBranchWidget.getBranchMarkupNode())
-    self._logic.updateVesselnessVolume(idPositionDict.values())
+    idPositionDict = self._vesselBranchWidget.getIdPositionDict()
+    nodeEdges = [(idPositionDict[parentId], idPositionDict[childId])
+                 for parentId, childId in self._vesselBranchWidget.getTreeModel().getTreeParentList()
+                 if parentId in idPositionDict and childId in idPositionDict]
+    self._logic.updateVesselnessVolume(idPositionDict.values(), nodeEdges)
 
   def _restoreDefaultVesselnessFilterParameters(self):
     """Apply default vesselness filter parameters to the UI
@@ -581,6 +682,8 @@ class VesselWidget(VerticalLayoutWidget):
     self._inflationSlider.value = p.inflation
     self._iterationSpinBox.value = p.iterationNumber
     self._strategyChoice.setCurrentIndex(self._strategyChoice.findText(self._defaultStrategy))
+    self._keepBranchLabelsCheckBox.setChecked(False)
+    self._clusterSizeSpinBox.value = ExtractVesselsByCluster.defaultClusterSize
     self._levelSetInitializationChoice.setCurrentIndex(0)
     self._levelSetSegmentationChoice.setCurrentIndex(0)
 
@@ -598,6 +701,7 @@ class VesselWidget(VerticalLayoutWidget):
     self._contrastSlider.value = params.vesselContrast
     self._roiSlider.value = params.roiGrowthFactor
     self._minRoiSlider.value = params.minROIExtent
+    self._roiClusterCountSpinBox.value = params.roiClusterCount
     self._useROI.setChecked(params.useROI)
 
     self._useVmtkCheckBox.setChecked(params.useVmtkFilter)
@@ -628,6 +732,7 @@ class VesselWidget(VerticalLayoutWidget):
     """
     isEnabled = self._inputVolume is not None and self._vesselBranchWidget.isVesselTreeValid()
     self._vesselBranchWidget.extractVesselsButton.setEnabled(isEnabled)
+    self._vesselBranchWidget.extractCenterlinesButton.setEnabled(isEnabled)
     self._updateVesselnessFilterParameters(self._logic.vesselnessFilterParameters)
 
   def setInputNode(self, node):
@@ -647,8 +752,12 @@ class VesselWidget(VerticalLayoutWidget):
   def getGeometryExporters(self):
     name = self._widgetName.replace(" ", "")
     node = self._vesselBranchWidget.getBranchMarkupNode()
-    return [GeometryExporter(**{name + "Node": node}),
-            VesselAdjacencyMatrixExporter(**{name: (node, self._vesselBranchWidget.getBranchTree())})]
+    exporters = [GeometryExporter(**{name + "Node": node}),
+                 VesselAdjacencyMatrixExporter(**{name: (node, self._vesselBranchWidget.getTreeModel())}),
+                 VesselTreeExporter(**{name: (node, self._vesselBranchWidget.getTreeModel())})]
+    if self._nodeTreeCenterLineModel is not None:
+      exporters.append(GeometryExporter(**{self._nodeTreeCenterLineModel.GetName(): self._nodeTreeCenterLineModel}))
+    return exporters
 
   def _setExtractedVolumeVisible(self, isVisible):
     if self._vesselVolumeNode is None or self._vesselModelNode is None:
@@ -674,6 +783,8 @@ class VesselWidget(VerticalLayoutWidget):
     self._vesselBranchWidget.enableShortcuts(self.visible)
     self._vesselBranchWidget.setVisibleInScene(self.visible)
     self._setExtractedVolumeVisible(self.visible)
+    if self._nodeTreeCenterLineModel is not None:
+      self._nodeTreeCenterLineModel.SetDisplayVisibility(self.visible)
     self._setVesselnessVisible(self._showVesselness if self.visible else False)
 
   def getVesselWizard(self):
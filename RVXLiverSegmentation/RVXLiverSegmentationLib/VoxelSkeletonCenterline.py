@@ -0,0 +1,200 @@
+from collections import defaultdict, deque
+
+import numpy as np
+import slicer
+import vtk
+
+from .RVXLiverSegmentationUtils import raiseValueErrorIfInvalidType, createModelNode, arrayFromVTKMatrix
+
+# 26-connectivity neighbour offsets in KJI order
+_neighborOffsets = np.array([(dk, dj, di) for dk in (-1, 0, 1) for dj in (-1, 0, 1) for di in (-1, 0, 1)
+                             if (dk, dj, di) != (0, 0, 0)])
+
+
+# Thinning is provided by scikit-image which is not bundled with Slicer (see installPythonPackageIfNeeded)
+skeletonizationModuleName = "skimage.morphology"
+skeletonizationPackageName = "scikit-image"
+
+
+def skeletonizeMask(mask):
+  """3D topological thinning of the input binary mask restricted to the mask bounding box.
+
+  Parameters
+  ----------
+  mask: np.ndarray
+    Boolean array in KJI order
+
+  Returns
+  -------
+  np.ndarray
+    Boolean array with the same shape as mask containing the one voxel thick skeleton
+
+  Raises
+  ------
+  ImportError if scikit-image is not installed
+  """
+  from skimage.morphology import skeletonize
+
+  skeleton = np.zeros(mask.shape, dtype=bool)
+  nonZero = np.nonzero(mask)
+  if len(nonZero[0]) == 0:
+    return skeleton
+
+  # Pad crop by one voxel so that the mask doesn't touch the thinning border
+  crop = tuple(slice(max(int(axis.min()) - 1, 0), int(axis.max()) + 2) for axis in nonZero)
+  skeleton[crop] = skeletonize(mask[crop].astype(np.uint8), method="lee") > 0
+  return skeleton
+
+
+def skeletonAdjacency(skeletonKji):
+  """Constructs the 26-connectivity adjacency of the skeleton voxels.
+
+  Parameters
+  ----------
+  skeletonKji: np.ndarray
+    N x 3 array of skeleton voxel indices in KJI order
+
+  Returns
+  -------
+  List[np.ndarray]
+    For each skeleton voxel, indices of the neighbouring skeleton voxels in skeletonKji
+  """
+  # Index volume restricted to the skeleton bounding box and padded to avoid out of bound neighbour lookups
+  localKji = skeletonKji - skeletonKji.min(axis=0) + 1
+  indexVolume = np.full(localKji.max(axis=0) + 2, -1, dtype=np.int32)
+  indexVolume[tuple(localKji.T)] = np.arange(len(localKji))
+
+  neighbors = np.stack([indexVolume[tuple((localKji + offset).T)] for offset in _neighborOffsets], axis=1)
+  return [row[row >= 0] for row in neighbors]
+
+
+def skeletonCenterlinePaths(mask, ijkToRas, startPoints, endPoints):
+  """Extracts the centerline polylines of the input mask using its skeleton.
+
+  The skeleton is traversed from the voxel closest to the first start point. Only the skeleton voxels on the paths
+  from this root voxel to the voxels closest to the end points are kept, which prunes the thinning spurs and breaks
+  the skeleton loops. The kept voxels are split in polylines at each junction.
+
+  Parameters
+  ----------
+  mask: np.ndarray
+    Boolean array in KJI order
+  ijkToRas: np.ndarray
+    4x4 IJK to RAS matrix of the mask
+  startPoints: List[List[float]]
+    Tree root position
+  endPoints: List[List[float]]
+    Tree leaf positions
+
+  Returns
+  -------
+  List[np.ndarray]
+    M x 3 RAS polylines going from tree root to tree leaves
+  """
+  skeletonKji = np.argwhere(skeletonizeMask(mask))
+  if len(skeletonKji) == 0 or not startPoints:
+    return []
+
+  skeletonRas = kjiToRas(skeletonKji, ijkToRas)
+  adjacency = skeletonAdjacency(skeletonKji)
+  rootId = _closestPointId(skeletonRas, startPoints[0])
+  parents = _breadthFirstParents(adjacency, rootId)
+
+  # Keep union of paths from each leaf to root
+  isKept = np.zeros(len(skeletonRas), dtype=bool)
+  isKept[rootId] = True
+  children = defaultdict(list)
+  for endPoint in endPoints:
+    nodeId = _closestPointId(skeletonRas, endPoint)
+    if parents[nodeId] is None:
+      continue
+
+    while not isKept[nodeId]:
+      isKept[nodeId] = True
+      children[parents[nodeId]].append(nodeId)
+      nodeId = parents[nodeId]
+
+  # Split kept voxels in polylines at junctions
+  paths = []
+  toVisit = [(rootId, childId) for childId in children[rootId]]
+  while toVisit:
+    startId, nodeId = toVisit.pop()
+    path = [startId, nodeId]
+    while len(children[nodeId]) == 1:
+      nodeId = children[nodeId][0]
+      path.append(nodeId)
+
+    paths.append(skeletonRas[path])
+    toVisit.extend((nodeId, childId) for childId in children[nodeId])
+
+  return paths
+
+
+def kjiToRas(kji, ijkToRas):
+  """Converts N x 3 KJI voxel indices to N x 3 RAS positions"""
+  ijk = np.column_stack([kji[:, ::-1], np.ones(len(kji))])
+  return np.dot(ijkToRas, ijk.T).T[:, :3]
+
+
+def _closestPointId(points, position):
+  return int(np.argmin(np.sum((points - np.asarray(position, dtype=float)) ** 2, axis=1)))
+
+
+def _breadthFirstParents(adjacency, rootId):
+  """Returns the breadth first traversal parent of each node. Root parent is root and unreachable node parent is None"""
+  parents = [None] * len(adjacency)
+  parents[rootId] = rootId
+  queue = deque([rootId])
+  while queue:
+    nodeId = queue.popleft()
+    for neighborId in adjacency[nodeId]:
+      if parents[neighborId] is None:
+        parents[neighborId] = nodeId
+        queue.append(neighborId)
+  return parents
+
+
+def pathsToPolyData(paths):
+  """Converts the input polylines to vtkPolyData with one poly line cell per path"""
+  points = vtk.vtkPoints()
+  lines = vtk.vtkCellArray()
+  for path in paths:
+    line = vtk.vtkPolyLine()
+    line.GetPointIds().SetNumberOfIds(len(path))
+    for i, position in enumerate(path):
+      line.GetPointIds().SetId(i, points.InsertNextPoint(*position))
+    lines.InsertNextCell(line)
+
+  polyData = vtk.vtkPolyData()
+  polyData.SetPoints(points)
+  polyData.SetLines(lines)
+  return polyData
+
+
+def extractSkeletonCenterline(labelMapNode, startPoints, endPoints):
+  """Extracts centerline from input vessel label map using voxel skeleton instead of VMTK surface Voronoi diagram.
+
+  Parameters
+  ----------
+  labelMapNode: vtkMRMLLabelMapVolumeNode
+    Vessel tree label map. Every non zero voxel is considered part of the tree.
+  startPoints: List[List[float]]
+    Tree root position
+  endPoints: List[List[float]]
+    Tree leaf positions
+
+  Returns
+  -------
+  centerLineModel : vtkMRMLModelNode
+    Contains one poly line per centerline segment between tree root, junctions and leaves
+  """
+  raiseValueErrorIfInvalidType(labelMapNode=(labelMapNode, "vtkMRMLLabelMapVolumeNode"))
+
+  ijkToRas = vtk.vtkMatrix4x4()
+  labelMapNode.GetIJKToRASMatrix(ijkToRas)
+  paths = skeletonCenterlinePaths(slicer.util.arrayFromVolume(labelMapNode) > 0, arrayFromVTKMatrix(ijkToRas),
+                                  startPoints, endPoints)
+
+  centerLineModel = createModelNode("CenterLineModel")
+  centerLineModel.SetAndObservePolyData(pathsToPolyData(paths))
+  return centerLineModel
@@ -3,19 +3,31 @@ from .RVXLiverSegmentationUtils import GeometryExporter, Settings, WidgetUtils,
   jumpSlicesToNthMarkupPosition, getMarkupIdPositionDictionary, hideFromUser, removeNodesFromMRMLScene, createButton, \
   getFiducialPositions, createModelNode, createLabelMapVolumeNodeBasedOnModel, createFiducialNode, addToScene, \
   raiseValueErrorIfInvalidType, removeNoneList, Icons, Signal, createDisplayNodeIfNecessary, \
-  createVolumeNodeBasedOnModel, removeNodeFromMRMLScene, cropSourceVolume, cloneSourceVolume, \
-  getVolumeIJKToRASDirectionMatrixAsNumpyArray, arrayFromVTKMatrix, resourcesPath
+  createVolumeNodeBasedOnModel, removeNodeFromMRMLScene, cropSourceVolume, \
+  cropSourceVolumeToRASBounds, cropSourceVolumeToIJKSlices, rasBoundsToIJKSlices, \
+  getVolumeIJKToRASDirectionMatrixAsNumpyArray, arrayFromVTKMatrix, resourcesPath, CoalescingDispatcher, \
+  isPythonModuleFound, installPythonPackageIfNeeded
 from .VerticalLayoutWidget import VerticalLayoutWidget
 from .DataWidget import DataWidget
 from .SegmentWidget import SegmentWidget
 from .RVXLiverSegmentationLogic import RVXLiverSegmentationLogic, IRVXLiverSegmentationLogic, \
-  VesselnessFilterParameters, LevelSetParameters
+  VesselnessFilterParameters, LevelSetParameters, LazyVolumeBoundaryModel, \
+  CenterlineParameters, PreprocessedSurfaceCache
 from .ExtractVesselStrategies import ExtractAllVesselsInOneGoStrategy, ExtractOneVesselPerParentChildNode, \
   ExtractOneVesselPerParentAndSubChildNode, ExtractVesselFromVesselSeedPointsStrategy, ExtractOneVesselPerBranch, \
-  VesselSeedPoints
+  VesselSeedPoints, NodePositionTable, mergeVolumesAsBranchLabels, labelVoxelsByNearestBranch, branchLabelNames, \
+  ExtractVesselsByCluster, VesselSeedCluster, clusterVesselSeeds, planVesselSeedRuns
 from .VesselBranchWizard import VesselBranchWizard, PlaceStatus, VeinId, NodeBranches, InteractionStatus, \
   VesselTreeColumnRole, setup_portal_vein_default_branch, setup_inferior_cava_vein_default_branch
+from .VoxelSkeletonCenterline import extractSkeletonCenterline, skeletonCenterlinePaths, skeletonizeMask
+from .MinimalPathCenterline import extractMinimalPathCenterlines, minimalPathCenterlinePaths, minimalPaths
 from .VesselHelpWidget import VesselHelpWidget, VesselHelpType
-from .VesselBranchTree import VesselBranchTree, VesselBranchWidget, MarkupNode, TreeDrawer, INodePlaceWidget
-from .VesselWidget import VesselWidget, VesselAdjacencyMatrixExporter, PortalVesselWidget, IVCVesselWidget
+from .VesselTreeModel import VesselTreeModel, preorderNodeIds, postorderNodeIds, eulerTourNodeIds, branchChains, \
+  saveVesselTree, loadVesselTree, TREE_FILE_EXTENSION, TreeEdit
+from .VesselEditJournal import VesselEditJournal, NodeMoveEdit
+from .VesselBranchTree import VesselBranchTree, VesselBranchWidget, MarkupNode, TreeDrawer, INodePlaceWidget, \
+  nodeDisplayText
+from .VesselTreeView import VesselTreeItemModel, VesselTreeView
+from .VesselWidget import VesselWidget, VesselAdjacencyMatrixExporter, VesselTreeExporter, PortalVesselWidget, \
+  IVCVesselWidget
 from .VesselSegmentEditWidget import VesselSegmentEditWidget, PortalVesselEditWidget, IVCVesselEditWidget
@@ -1,7 +1,11 @@
 import unittest
 
+import numpy as np
+
 from RVXLiverSegmentationLib import ExtractOneVesselPerParentAndSubChildNode, ExtractOneVesselPerParentChildNode, \
-  VesselBranchTree, VesselSeedPoints, ExtractOneVesselPerBranch, PlaceStatus, VesselHelpWidget, VesselHelpType
+  VesselBranchTree, VesselSeedPoints, ExtractOneVesselPerBranch, PlaceStatus, VesselHelpWidget, VesselHelpType, \
+  branchLabelNames, labelVoxelsByNearestBranch, NodePositionTable, clusterVesselSeeds, \
+  planVesselSeedRuns
 
 
 class ExtractVesselStrategyTestCase(unittest.TestCase):
@@ -29,6 +33,23 @@ class ExtractVesselStrategyTestCase(unittest.TestCase):
     v2 = VesselSeedPoints(posDict, ["2", "1", "4"])
     self.assertEqual(v1, v2)
 
+  def testVesselSeedPointsCopyAndCombineSharePositionTable(self):
+    table = NodePositionTable({str(i): [i] * 3 for i in range(5)})
+    v1 = VesselSeedPoints(table, ["0", "1"])
+    v2 = VesselSeedPoints(table, ["1", "2", "3"])
+
+    v1Copy = v1.copy()
+    v1Copy.appendPoint("4")
+    self.assertEqual([("0", "1")], v1.getEdgeIds())
+    self.assertEqual("4", v1Copy.lastPointId())
+
+    combined = VesselSeedPoints.combine(v1, v2)
+    self.assertEqual(VesselSeedPoints({str(i): [i] * 3 for i in range(5)}, ["0", "1", "2", "3"]), combined)
+    self.assertEqual([[0, 0, 0], [1, 1, 1], [2, 2, 2]], combined.getSeedPositions())
+    self.assertTrue(v1 < v2)
+    with self.assertRaises(ValueError):
+      VesselSeedPoints.combine(v2, v1)
+
   def testExtractOneVesselConstructsBranchListForEachParentChildNodePair(self):
     # Create tree
     # n0
@@ -168,3 +189,121 @@ class ExtractVesselStrategyTestCase(unittest.TestCase):
       VesselSeedPoints(posDict, ("n20", "n32"))]
 
     self.assertEqual(sorted(expBranchPairs), sorted(actPairs))
+
+  def testClusterVesselSeedsGroupsOverlappingBranchesWithinVoxelBudget(self):
+    # Every branch box overlaps at n20. n30 is far away and merging its branch would exceed the voxel budget
+    posDict = {"n0": [0, 0, 0], "n10": [4, 0, 0], "n20": [8, 0, 0], "n30": [100, 0, 0], "n31": [8, 4, 0],
+               "n32": [12, 0, 0]}
+    table = NodePositionTable(posDict)
+    seeds = [VesselSeedPoints(table, ["n0", "n10", "n20"]), VesselSeedPoints(table, ["n20", "n30"]),
+             VesselSeedPoints(table, ["n20", "n31"]), VesselSeedPoints(table, ["n20", "n32"])]
+
+    clusters = clusterVesselSeeds(seeds, spacing=[1, 1, 1], maxClusterVoxels=500, margin=1)
+    self.assertEqual(3, len(clusters))
+    self.assertEqual(sorted([[("n0", "n10"), ("n10", "n20")], [("n20", "n30")], [("n20", "n31"), ("n20", "n32")]]),
+                     sorted(sorted(cluster.getEdgeIds()) for cluster in clusters))
+
+    merged = [cluster for cluster in clusters if len(cluster.vesselSeedsList) == 2][0]
+    self.assertEqual(sorted([[8, 4, 0], [12, 0, 0]]), sorted(merged.getStopperPositions()))
+    np.testing.assert_array_equal([7, -1, -1], merged.lower)
+    np.testing.assert_array_equal([13, 5, 1], merged.upper)
+
+    # Budget smaller than any merged box keeps one cluster per branch
+    self.assertEqual(4, len(clusterVesselSeeds(seeds, spacing=[1, 1, 1], maxClusterVoxels=10, margin=1)))
+
+  def testClusterVesselSeedsNeverMergesChainedBranches(self):
+    posDict = {"n0": [0, 0, 0], "n10": [4, 0, 0], "n20": [8, 0, 0], "n31": [8, 4, 0]}
+    table = NodePositionTable(posDict)
+    seeds = [VesselSeedPoints(table, ["n0", "n10", "n20"]), VesselSeedPoints(table, ["n20", "n31"])]
+
+    clusters = clusterVesselSeeds(seeds, spacing=[1, 1, 1], maxClusterVoxels=1e9, margin=1)
+    self.assertEqual(2, len(clusters))
+    self.assertEqual(sorted([[8, 0, 0], [8, 4, 0]]),
+                     sorted(position for cluster in clusters for position in cluster.getStopperPositions()))
+
+  def testPlanVesselSeedRunsDropsDuplicatesAndMergesOverlappingRuns(self):
+    # n1 and n2 are short children of n0, n3 and n4 are far away from n0
+    posDict = {"n0": [0, 0, 0], "n1": [1, 0, 0], "n2": [0, 1, 0], "n3": [50, 0, 0], "n4": [51, 0, 0]}
+    table = NodePositionTable(posDict)
+    seeds = [VesselSeedPoints(table, ["n0", "n1"]), VesselSeedPoints(table, ["n0", "n1"]),
+             VesselSeedPoints(table, ["n0", "n2"]), VesselSeedPoints(table, ["n3", "n4"])]
+
+    runs = planVesselSeedRuns(seeds, spacing=[1, 1, 1], overlapThreshold=0.9, margin=10)
+    self.assertEqual(sorted([[("n0", "n1"), ("n0", "n2")], [("n3", "n4")]]),
+                     sorted(sorted(run.getEdgeIds()) for run in runs))
+
+    merged = [run for run in runs if len(run.vesselSeedsList) == 2][0]
+    self.assertEqual(sorted([[1, 0, 0], [0, 1, 0]]), sorted(merged.getStopperPositions()))
+    self.assertEqual(21 * 21 * 20, merged.voxelCount([1, 1, 1]))
+
+    # Threshold above 1 only drops the duplicates
+    self.assertEqual(3, len(planVesselSeedRuns(seeds, spacing=[1, 1, 1], overlapThreshold=1.1, margin=10)))
+
+  def testMergingRunsLowersTotalPlannedCost(self):
+    posDict = {"n0": [0, 0, 0], "n1": [1, 0, 0], "n2": [0, 1, 0], "n3": [50, 0, 0], "n4": [51, 0, 0]}
+    table = NodePositionTable(posDict)
+    seeds = [VesselSeedPoints(table, ["n0", "n1"]), VesselSeedPoints(table, ["n0", "n2"]),
+             VesselSeedPoints(table, ["n3", "n4"])]
+
+    def plannedCost(overlapThreshold):
+      runs = planVesselSeedRuns(seeds, spacing=[1, 1, 1], overlapThreshold=overlapThreshold, margin=10)
+      return sum(run.voxelCount([1, 1, 1]) for run in runs)
+
+    defaultThreshold = ExtractOneVesselPerBranch().overlapThreshold
+    self.assertLessEqual(defaultThreshold, 1)
+    self.assertLess(plannedCost(defaultThreshold), plannedCost(1.1))
+
+  def testPlanVesselSeedRunsDoesNotMergeChainedSeeds(self):
+    # Merging both seeds would drop the n1 stopper
+    posDict = {"n0": [0, 0, 0], "n1": [1, 0, 0], "n2": [1, 1, 0]}
+    table = NodePositionTable(posDict)
+    seeds = [VesselSeedPoints(table, ["n0", "n1"]), VesselSeedPoints(table, ["n1", "n2"])]
+
+    runs = planVesselSeedRuns(seeds, spacing=[1, 1, 1], overlapThreshold=0, margin=10)
+    self.assertEqual(2, len(runs))
+    self.assertEqual(sorted([[1, 0, 0], [1, 1, 0]]), sorted(p for run in runs for p in run.getStopperPositions()))
+
+  def testBranchLabelNamesAssociatesInsertedNodesWithNextNamedBranch(self):
+    # Create tree
+    # PortalVeinRoot
+    #     |_ PortalVeinRoot_0
+    #             |_ LeftPortalVein
+    #     |_ RightPortalVein
+    branchWidget = VesselBranchTree(VesselHelpWidget(VesselHelpType.Portal))
+    branchWidget.insertAfterNode("PortalVeinRoot", None, PlaceStatus.PLACED)
+    branchWidget.insertAfterNode("PortalVeinRoot_0", "PortalVeinRoot", PlaceStatus.PLACED)
+    branchWidget.insertAfterNode("LeftPortalVein", "PortalVeinRoot_0", PlaceStatus.PLACED)
+    branchWidget.insertAfterNode("RightPortalVein", "PortalVeinRoot", PlaceStatus.PLACED)
+
+    edges = [("PortalVeinRoot", "PortalVeinRoot_0"), ("PortalVeinRoot_0", "LeftPortalVein"),
+             ("PortalVeinRoot", "RightPortalVein")]
+    expLabels = {("PortalVeinRoot", "PortalVeinRoot_0"): "LeftPortalVein",
+                 ("PortalVeinRoot_0", "LeftPortalVein"): "LeftPortalVein",
+                 ("PortalVeinRoot", "RightPortalVein"): "RightPortalVein"}
+    self.assertEqual(expLabels, branchLabelNames(branchWidget, edges))
+
+  def testLabelVoxelsByNearestBranchSplitsOverlappingMasksAlongNearestEdge(self):
+    # Two overlapping masks along the I axis, each associated with one edge
+    first = np.zeros((1, 1, 10), dtype=bool)
+    first[0, 0, :6] = True
+    second = np.zeros((1, 1, 10), dtype=bool)
+    second[0, 0, 4:] = True
+
+    posDict = {"n0": [0, 0, 0], "n1": [4, 0, 0], "n2": [9, 0, 0]}
+    labels = labelVoxelsByNearestBranch([first, second], np.eye(4), [[("n0", "n1")], [("n1", "n2")]], posDict,
+                                        {("n0", "n1"): 1, ("n1", "n2"): 2})
+
+    np.testing.assert_array_equal([1, 1, 1, 1, 1, 2, 2, 2, 2, 2], labels[0, 0])
+
+  def testLabelVoxelsByNearestBranchOnlyUsesEdgesOfMasksClaimingTheVoxel(self):
+    # Voxel 0 is closer to the second edge but only claimed by the first mask
+    first = np.zeros((1, 1, 3), dtype=bool)
+    first[0, 0, 0] = True
+    second = np.zeros((1, 1, 3), dtype=bool)
+    second[0, 0, 2] = True
+
+    posDict = {"n0": [10, 0, 0], "n1": [20, 0, 0], "n2": [0, 0, 0], "n3": [1, 0, 0]}
+    labels = labelVoxelsByNearestBranch([first, second], np.eye(4), [[("n0", "n1")], [("n2", "n3")]], posDict,
+                                        {("n0", "n1"): 1, ("n2", "n3"): 2})
+
+    np.testing.assert_array_equal([1, 0, 2], labels[0, 0])
@@ -0,0 +1,82 @@
+import unittest
+from collections import OrderedDict
+
+import numpy as np
+
+from RVXLiverSegmentationLib import minimalPaths, minimalPathCenterlinePaths, isPythonModuleFound
+from RVXLiverSegmentationLib.MinimalPathCenterline import vesselnessCostArray, rasToKji, isInsideVolume, \
+  minimalPathModuleName
+from .VoxelSkeletonCenterlineTestCase import createTubePhantom, distanceToAxes
+
+
+@unittest.skipUnless(isPythonModuleFound(minimalPathModuleName), "scikit-image is not installed")
+class MinimalPathCenterlineTestCase(unittest.TestCase):
+  def setUp(self):
+    # Y shaped vesselness phantom with identity IJK to RAS
+    self.root = [30, 30, 5]
+    self.junction = [30, 30, 30]
+    self.leaves = [[15, 30, 55], [45, 30, 55]]
+    self.axes = [(self.root, self.junction)] + [(self.junction, leaf) for leaf in self.leaves]
+    self.vesselness = createTubePhantom((60, 60, 60), self.axes, radius=3).astype(float)
+
+  def testCostIsMinimalWhereVesselnessIsMaximal(self):
+    cost = vesselnessCostArray(np.array([0.0, 5.0, 10.0]))
+    self.assertEqual(2, np.argmin(cost))
+    self.assertEqual(0, np.argmax(cost))
+
+  def testMinimalPathFollowsLowCostVoxels(self):
+    # L shaped low cost corridor
+    cost = np.full((1, 20, 20), 100.0)
+    cost[0, 2, 2:18] = 1
+    cost[0, 2:18, 17] = 1
+
+    path = minimalPaths(cost, np.array([0, 2, 2]), [np.array([0, 17, 17])], margin=2)[0]
+    np.testing.assert_array_equal([0, 2, 2], path[0])
+    np.testing.assert_array_equal([0, 17, 17], path[-1])
+    self.assertTrue(np.all(cost[tuple(path.T)] == 1))
+
+  def testRasPositionsOutsideOfVolumeAreNotInsideVolume(self):
+    kji = rasToKji([[-5, 2, 100], [1, 2, 3]], np.eye(4))
+    np.testing.assert_array_equal([[100, 2, -5], [3, 2, 1]], kji)
+    np.testing.assert_array_equal([False, True], isInsideVolume(kji, (10, 10, 10)))
+
+  def testEdgesWithNodesOutsideOfVolumeAreSkipped(self):
+    idPositionDict = {"root": self.root, "junction": self.junction, "left": self.leaves[0], "outside": [30, 30, 100]}
+    childrenDict = OrderedDict([("root", ["junction"]), ("junction", ["left", "outside"]), ("outside", ["left"])])
+
+    edgePaths = minimalPathCenterlinePaths(self.vesselness, np.eye(4), childrenDict, idPositionDict)
+    self.assertEqual([("root", "junction"), ("junction", "left")], [edge for edge, _ in edgePaths])
+
+  def testCenterlinePathsAreComputedForEveryParentChildEdge(self):
+    idPositionDict = {"root": self.root, "junction": self.junction, "left": self.leaves[0], "right": self.leaves[1]}
+    childrenDict = OrderedDict([("root", ["junction"]), ("junction", ["left", "right"])])
+
+    edgePaths = minimalPathCenterlinePaths(self.vesselness, np.eye(4), childrenDict, idPositionDict)
+
+    self.assertEqual([("root", "junction"), ("junction", "left"), ("junction", "right")],
+                     [edge for edge, _ in edgePaths])
+    for (parentId, childId), path in edgePaths:
+      np.testing.assert_array_almost_equal(idPositionDict[parentId], path[0])
+      np.testing.assert_array_almost_equal(idPositionDict[childId], path[-1])
+      self.assertLess(np.max(distanceToAxes(path, self.axes)), 3)
+
+  def testMinimalPathAcceptsNumpyVoxelSpacing(self):
+    cost = np.ones((1, 10, 10))
+    sampling = np.array([1.0, 2.0, 0.5])
+    path = minimalPaths(cost, np.array([0, 0, 0]), [np.array([0, 9, 9])], margin=1, sampling=sampling)[0]
+    np.testing.assert_array_equal([0, 0, 0], path[0])
+    np.testing.assert_array_equal([0, 9, 9], path[-1])
+
+  def testCenterlinePathsFollowAxesWithAnisotropicSpacing(self):
+    # Same phantom with 2 mm voxels along I
+    ijkToRas = np.diag([2.0, 1.0, 1.0, 1.0])
+    idPositionDict = {"root": [60, 30, 5], "junction": [60, 30, 30], "left": [30, 30, 55]}
+    childrenDict = OrderedDict([("root", ["junction"]), ("junction", ["left"])])
+
+    edgePaths = minimalPathCenterlinePaths(self.vesselness, ijkToRas, childrenDict, idPositionDict)
+    self.assertEqual([("root", "junction"), ("junction", "left")], [edge for edge, _ in edgePaths])
+    for (parentId, childId), path in edgePaths:
+      np.testing.assert_array_almost_equal(idPositionDict[parentId], path[0])
+      np.testing.assert_array_almost_equal(idPositionDict[childId], path[-1])
+      ijkPath = path / [2.0, 1.0, 1.0]
+      self.assertLess(np.max(distanceToAxes(ijkPath, self.axes)), 3)
@@ -1,11 +1,18 @@
 import os
 import unittest
+from unittest import mock
 
 import numpy as np
 import slicer
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
 
-from RVXLiverSegmentationLib import RVXLiverSegmentationLogic, GeometryExporter, getVolumeIJKToRASDirectionMatrixAsNumpyArray
+from RVXLiverSegmentationLib import RVXLiverSegmentationLogic, GeometryExporter, getVolumeIJKToRASDirectionMatrixAsNumpyArray, \
+  CenterlineParameters, cropSourceVolumeToRASBounds, rasBoundsToIJKSlices, createModelNode, ExtractVesselsByCluster, \
+  VesselTreeModel, PreprocessedSurfaceCache, ExtractOneVesselPerBranch
+from RVXLiverSegmentationLib.RVXLiverSegmentationLogic import VMTKModule
 from .TestUtils import TemporaryDir, createNonEmptyVolume, createNonEmptyModel
+from .VoxelSkeletonCenterlineTestCase import createTubePhantom
 
 
 def prepareEndToEndTest():
@@ -20,12 +27,30 @@ def prepareEndToEndTest():
   return sourceVolume, startPosition, endPosition
 
 
+def prepareTubePhantomTest():
+  """Creates a Y shaped bright tube volume with identity IJK to RAS and the node positions of its axes"""
+  positions = {"n0": [30, 30, 5], "n1": [30, 30, 30], "n2": [15, 30, 55], "n3": [45, 30, 55]}
+  edges = [("n0", "n1"), ("n1", "n2"), ("n1", "n3")]
+  phantom = createTubePhantom((60, 60, 60), [(positions[p], positions[c]) for p, c in edges], radius=3)
+
+  sourceVolume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode")
+  slicer.util.updateVolumeFromArray(sourceVolume, np.where(phantom, 400, 0).astype("int16"))
+  return sourceVolume, positions, edges
+
+
 class RVXLiverSegmentationTestCase(unittest.TestCase):
   def setUp(self):
     """ Clear scene before each tests
     """
     slicer.mrmlScene.Clear(0)
 
+  def prepareTubePhantomLogic(self):
+    sourceVolume, positions, edges = prepareTubePhantomTest()
+    logic = RVXLiverSegmentationLogic()
+    logic.setInputVolume(sourceVolume)
+    logic.updateVesselnessVolume(positions.values())
+    return logic, sourceVolume, positions, edges
+
   def testVesselSegmentationLogic(self):
     # Prepare source volume, start position and end position
     sourceVolume, startPosition, endPosition = prepareEndToEndTest()
@@ -44,6 +69,23 @@ class RVXLiverSegmentationTestCase(unittest.TestCase):
       self.assertIsNotNone(outModel)
       self.assertNotEqual(0, outModel.GetPolyData().GetNumberOfCells())
 
+  def testLazyModelIsOnlyCreatedOnceWhenRequested(self):
+    sourceVolume, startPosition, endPosition = prepareEndToEndTest()
+
+    logic = RVXLiverSegmentationLogic()
+    logic.setInputVolume(sourceVolume)
+    logic.updateVesselnessVolume([startPosition, endPosition])
+
+    nModels = slicer.mrmlScene.GetNumberOfNodesByClass("vtkMRMLModelNode")
+    _, _, _, lazyModel = logic.extractVesselVolumeFromPosition([startPosition], [endPosition], lazyModel=True)
+    self.assertFalse(lazyModel.isCreated())
+    self.assertEqual(nModels, slicer.mrmlScene.GetNumberOfNodesByClass("vtkMRMLModelNode"))
+
+    outModel = lazyModel.get()
+    self.assertTrue(lazyModel.isCreated())
+    self.assertNotEqual(0, outModel.GetPolyData().GetNumberOfCells())
+    self.assertIs(outModel, lazyModel.get())
+
   def testSegmentedVesselPositionAndSizeIsTheSameAsSourceVolume(self):
     # Prepare source volume, start position and end position
     sourceVolume, startPosition, endPosition = prepareEndToEndTest()
@@ -139,3 +181,313 @@ class RVXLiverSegmentationTestCase(unittest.TestCase):
     roi_center, roi_radius = RVXLiverSegmentationLogic.calculateRoiExtent(node_positions, minExtent=0, growthFactor=1)
     np.testing.assert_array_almost_equal([-45.5, -23, -41], roi_center)
     np.testing.assert_array_almost_equal([0.5, 1., 13.], roi_radius)
+
+  def testBoundaryExtentIsLimitedToThresholdCrossingsPaddedByOneVoxel(self):
+    array = np.zeros((20, 30, 40), dtype="uint8")
+    array[5:8, 10:12, 20:25] = 1
+    volume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
+    slicer.util.updateVolumeFromArray(volume, array)
+
+    boundaryExtent = RVXLiverSegmentationLogic.calculateBoundaryExtent(volume.GetImageData(), threshold=1)
+    self.assertEqual([19, 25, 9, 12, 4, 8], boundaryExtent)
+
+  def testBoundaryExtentIsNoneWhenImageHasNoThresholdCrossing(self):
+    volume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
+    slicer.util.updateVolumeFromArray(volume, np.zeros((5, 5, 5), dtype="uint8"))
+    self.assertIsNone(RVXLiverSegmentationLogic.calculateBoundaryExtent(volume.GetImageData(), threshold=1))
+
+  def testVolumeBoundaryModelIsTheSameWithBoundaryExtent(self):
+    array = np.zeros((20, 30, 40), dtype="uint8")
+    array[5:8, 10:12, 20:25] = 1
+    volume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
+    volume.SetOrigin(10, -5, 3)
+    volume.SetSpacing(0.5, 0.8, 2)
+    slicer.util.updateVolumeFromArray(volume, array)
+
+    model = RVXLiverSegmentationLogic.createVolumeBoundaryModel(volume, "Model", threshold=1)
+
+    ijkToRas = vtk.vtkMatrix4x4()
+    volume.GetIJKToRASMatrix(ijkToRas)
+    expPolyData = VMTKModule.getLevelSetSegmentationLogic().marchingCubes(volume.GetImageData(), ijkToRas, 1)
+
+    self.assertGreater(model.GetPolyData().GetNumberOfPoints(), 0)
+    self.assertEqual(expPolyData.GetNumberOfPoints(), model.GetPolyData().GetNumberOfPoints())
+    np.testing.assert_array_almost_equal(expPolyData.GetBounds(), model.GetPolyData().GetBounds())
+
+  def testCenterlineTargetNumberOfPointsScalesWithAreaAndMinimumRadius(self):
+    parameters = CenterlineParameters()
+    parameters.minimumNumberOfPoints = 0
+    parameters.maximumNumberOfPoints = 1e9
+
+    nPoints = parameters.targetNumberOfPoints(10000)
+    self.assertAlmostEqual(2 * nPoints, parameters.targetNumberOfPoints(20000), delta=1)
+
+    parameters.minimumVesselRadius /= 2
+    self.assertAlmostEqual(4 * nPoints, parameters.targetNumberOfPoints(10000), delta=1)
+
+  def testCenterlineTargetNumberOfPointsIsClamped(self):
+    parameters = CenterlineParameters()
+    self.assertEqual(parameters.minimumNumberOfPoints, parameters.targetNumberOfPoints(0))
+    self.assertEqual(parameters.maximumNumberOfPoints, parameters.targetNumberOfPoints(1e12))
+
+  def testDefaultCenterlineTargetNumberOfPointsScalesForUsualVesselTreeAreas(self):
+    parameters = CenterlineParameters()
+    targets = [parameters.targetNumberOfPoints(area) for area in [600, 2000, 5000, 10000]]
+    self.assertEqual(sorted(set(targets)), targets)
+    self.assertGreater(targets[0], parameters.minimumNumberOfPoints)
+    self.assertLess(targets[-1], parameters.maximumNumberOfPoints)
+
+  def testCenterlineSurfaceIsOnlyPreprocessedAgainWhenModified(self):
+    sphere = vtk.vtkSphereSource()
+    sphere.SetRadius(10)
+    sphere.Update()
+    surface = sphere.GetOutput()
+
+    preprocessCalls = []
+
+    class FakeCenterlineLogic(object):
+      def preprocess(self, polyData, *args):
+        preprocessCalls.append(polyData)
+        return vtk.vtkPolyData()
+
+    cache = PreprocessedSurfaceCache(maxSize=2)
+    with mock.patch.object(VMTKModule, "getCenterlineExtractionLogic", return_value=FakeCenterlineLogic()):
+      first = RVXLiverSegmentationLogic.preprocessCenterlineSurface(surface, surfaceCache=cache)
+      second = RVXLiverSegmentationLogic.preprocessCenterlineSurface(surface, surfaceCache=cache)
+      self.assertIs(first, second)
+      self.assertEqual(1, len(preprocessCalls))
+
+      parameters = CenterlineParameters()
+      parameters.decimationAggressiveness = 3.0
+      self.assertIsNot(first, RVXLiverSegmentationLogic.preprocessCenterlineSurface(surface, parameters, cache))
+
+      surface.Modified()
+      self.assertIsNot(first, RVXLiverSegmentationLogic.preprocessCenterlineSurface(surface, surfaceCache=cache))
+      self.assertEqual(3, len(preprocessCalls))
+      self.assertEqual(2, len(cache))
+
+      RVXLiverSegmentationLogic.preprocessCenterlineSurface(surface)
+      self.assertEqual(4, len(preprocessCalls))
+
+  def testEachLogicHasItsOwnCenterlineSurfaceCache(self):
+    self.assertIsNot(RVXLiverSegmentationLogic().centerlineSurfaceCache,
+                     RVXLiverSegmentationLogic().centerlineSurfaceCache)
+
+  @staticmethod
+  def createTubeModel(pathPoints):
+    line = vtk.vtkPolyLineSource()
+    line.SetNumberOfPoints(len(pathPoints))
+    for i, point in enumerate(pathPoints):
+      line.SetPoint(i, *point)
+
+    tube = vtk.vtkTubeFilter()
+    tube.SetInputConnection(line.GetOutputPort())
+    tube.SetRadius(3)
+    tube.SetNumberOfSides(20)
+    tube.CappingOn()
+    triangles = vtk.vtkTriangleFilter()
+    triangles.SetInputConnection(tube.GetOutputPort())
+    triangles.Update()
+
+    tubeModel = createModelNode("TubeModel")
+    tubeModel.SetAndObservePolyData(triangles.GetOutput())
+    return tubeModel
+
+  def testCenterLinePerBranchLabelsEachBranchCenterLineWithItsBranchId(self):
+    # L shaped closed tube with one branch per straight part
+    pathPoints = [[0, 0, 0], [40, 0, 0], [40, 40, 0]]
+    tubeModel = self.createTubeModel(pathPoints)
+
+    branchPaths = [("first", pathPoints[:2]), ("second", pathPoints[1:])]
+    centerLine = RVXLiverSegmentationLogic.centerLineFilterPerBranch(tubeModel, branchPaths).GetPolyData()
+
+    branchIds = vtk_to_numpy(centerLine.GetCellData().GetArray("BranchId"))
+    self.assertEqual({0, 1}, set(branchIds))
+
+    for cellId, branchId in enumerate(branchIds):
+      start, end = np.array(branchPaths[branchId][1], dtype=float)
+      cellPointIds = centerLine.GetCell(cellId).GetPointIds()
+      for i in range(cellPointIds.GetNumberOfIds()):
+        point = np.array(centerLine.GetPoint(cellPointIds.GetId(i)))
+        t = np.clip(np.dot(point - start, end - start) / np.dot(end - start, end - start), 0, 1)
+        self.assertLess(np.linalg.norm(point - (start + t * (end - start))), 3.0)
+
+  def testCenterLinePerBranchIsTheSameWhenBranchesAreExtractedConcurrently(self):
+    # Zigzag closed tube with one branch per straight part
+    pathPoints = [[0, 0, 0], [40, 0, 0], [70, 30, 0], [70, -30, 0]]
+    tubeModel = self.createTubeModel(pathPoints)
+
+    branchPaths = [("first", pathPoints[:2]), ("second", pathPoints[1:3]), ("third", pathPoints[2:])]
+    sequential = RVXLiverSegmentationLogic.centerLineFilterPerBranch(tubeModel, branchPaths, maxWorkers=1)
+    concurrent = RVXLiverSegmentationLogic.centerLineFilterPerBranch(tubeModel, branchPaths, maxWorkers=3)
+
+    sequentialPoints = vtk_to_numpy(sequential.GetPolyData().GetPoints().GetData())
+    concurrentPoints = vtk_to_numpy(concurrent.GetPolyData().GetPoints().GetData())
+    np.testing.assert_array_almost_equal(sequentialPoints, concurrentPoints)
+    np.testing.assert_array_equal(vtk_to_numpy(sequential.GetPolyData().GetCellData().GetArray("BranchId")),
+                                  vtk_to_numpy(concurrent.GetPolyData().GetCellData().GetArray("BranchId")))
+
+  def testOpenSurfaceAtPointsIsTheSameAsOpeningEachPoint(self):
+    # Vessel like mesh with multiple end points
+    sphere = vtk.vtkSphereSource()
+    sphere.SetRadius(50)
+    sphere.SetThetaResolution(400)
+    sphere.SetPhiResolution(400)
+    sphere.Update()
+
+    seeds = [[50 * np.cos(theta), 50 * np.sin(theta), 0] for theta in np.linspace(0, 2 * np.pi, 20, endpoint=False)]
+
+    sequential = vtk.vtkPolyData()
+    sequential.DeepCopy(sphere.GetOutput())
+    for seed in seeds:
+      RVXLiverSegmentationLogic.openSurfaceAtPoint(sequential, seed)
+
+    batched = vtk.vtkPolyData()
+    batched.DeepCopy(sphere.GetOutput())
+    RVXLiverSegmentationLogic.openSurfaceAtPoints(batched, seeds)
+
+    self.assertEqual(sequential.GetNumberOfCells(), batched.GetNumberOfCells())
+    self.assertLess(batched.GetNumberOfCells(), sphere.GetOutput().GetNumberOfCells())
+    np.testing.assert_array_almost_equal(sequential.GetBounds(), batched.GetBounds())
+
+  def testCropToRASBoundsKeepsVoxelPositionsAndDoesNotCreateParameterNodes(self):
+    array = np.arange(20 * 30 * 40, dtype="int16").reshape((20, 30, 40))
+    volume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode")
+    volume.SetOrigin(10, -5, 3)
+    volume.SetSpacing(0.5, 2, 1)
+    slicer.util.updateVolumeFromArray(volume, array)
+
+    cropped = cropSourceVolumeToRASBounds(volume, [12, 1, 8], [14, 9, 10])
+
+    # I : [12, 14] -> [4, 8], J : [1, 9] -> [3, 7], K : [8, 10] -> [5, 7]
+    np.testing.assert_array_equal(array[5:8, 3:8, 4:9], slicer.util.arrayFromVolume(cropped))
+    np.testing.assert_array_almost_equal([12, 1, 8], cropped.GetOrigin())
+    np.testing.assert_array_almost_equal(volume.GetSpacing(), cropped.GetSpacing())
+    self.assertEqual(0, slicer.mrmlScene.GetNumberOfNodesByClass("vtkMRMLCropVolumeParametersNode"))
+    self.assertEqual(0, slicer.mrmlScene.GetNumberOfNodesByClass("vtkMRMLMarkupsROINode"))
+
+  def testCropToRASBoundsIsClippedToVolumeExtent(self):
+    volume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode")
+    slicer.util.updateVolumeFromArray(volume, np.ones((5, 6, 7), dtype="int16"))
+
+    cropped = cropSourceVolumeToRASBounds(volume, [-10, -10, -10], [100, 100, 100])
+    self.assertEqual((5, 6, 7), slicer.util.arrayFromVolume(cropped).shape)
+
+  def testCropToRASBoundsOutsideOfVolumeRaisesValueError(self):
+    volume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode")
+    slicer.util.updateVolumeFromArray(volume, np.ones((5, 6, 7), dtype="int16"))
+
+    with self.assertRaises(ValueError):
+      rasBoundsToIJKSlices(volume, [50, 50, 50], [60, 60, 60])
+
+  def testSingleRoiClusterBoxIsTheSameAsRoiExtent(self):
+    node_positions = [[0, 0, 0], [10, 20, 30], [40, 0, 5]]
+    center, radius = RVXLiverSegmentationLogic.calculateRoiExtent(node_positions, minExtent=5, growthFactor=1.2)
+    boxes = RVXLiverSegmentationLogic.calculateRoiBoxes(node_positions, None, 1, minExtent=5, growthFactor=1.2)
+
+    self.assertEqual(1, len(boxes))
+    np.testing.assert_array_almost_equal(center - radius, boxes[0][0])
+    np.testing.assert_array_almost_equal(center + radius, boxes[0][1])
+
+  def testRoiClusterBoxesContainEveryEdgeAndAreSmallerThanGlobalBox(self):
+    # Two distant branches linked by one edge
+    left = [[0, 0, 0], [0, 10, 0], [0, 20, 0]]
+    right = [[100, 0, 0], [100, 10, 0], [100, 20, 0]]
+    edges = list(zip(left[:-1], left[1:])) + list(zip(right[:-1], right[1:])) + [(left[0], right[0])]
+    positions = left + right
+
+    boxes = RVXLiverSegmentationLogic.calculateRoiBoxes(positions, edges, 2, minExtent=5, growthFactor=1)
+    self.assertEqual(2, len(boxes))
+    for start, end in edges:
+      self.assertTrue(any(np.all(lower <= start) and np.all(start <= upper) and np.all(lower <= end) and
+                          np.all(end <= upper) for lower, upper in boxes))
+
+    globalLower, globalUpper = RVXLiverSegmentationLogic.calculateRoiBoxes(positions, edges, 1, 5, 1)[0]
+    boxVolume = sum(np.prod(upper - lower) for lower, upper in boxes)
+    self.assertLess(boxVolume, np.prod(globalUpper - globalLower))
+
+  def testVesselnessOutsideOfRoiBoxesIsZero(self):
+    volume = createNonEmptyVolume()
+    logic = RVXLiverSegmentationLogic()
+    bounds = [0] * 6
+    volume.GetRASBounds(bounds)
+    lower, upper = np.array(bounds[::2]), np.array(bounds[1::2])
+    quarter = (upper - lower) / 4
+    boxes = [(lower, lower + quarter), (upper - quarter, upper)]
+
+    vesselness = slicer.util.arrayFromVolume(logic._applyVesselnessFilterPerBox(volume, boxes))
+    isInBox = np.zeros(vesselness.shape, dtype=bool)
+    for boxLower, boxUpper in boxes:
+      isInBox[rasBoundsToIJKSlices(volume, boxLower, boxUpper)[::-1]] = True
+
+    self.assertTrue(np.all(vesselness[~isInBox] == 0))
+    self.assertGreaterEqual(np.min(vesselness), 0)
+    self.assertLessEqual(np.max(vesselness), 1)
+
+  def testVesselVolumesInRASBoxesAreExtractedOnSourceVolumeGeometry(self):
+    logic, sourceVolume, positions, edges = self.prepareTubePhantomLogic()
+    nVolumes = slicer.mrmlScene.GetNumberOfNodesByClass("vtkMRMLScalarVolumeNode")
+
+    runs = []
+    for parentId, childId in edges:
+      start, end = np.array(positions[parentId]), np.array(positions[childId])
+      runs.append(([start], [end], np.minimum(start, end) - 5, np.maximum(start, end) + 5))
+
+    runOutputs = logic.extractVesselVolumesInRASBoxes(runs, maxWorkers=1)
+    self.assertEqual(len(edges), len(runOutputs))
+    for _, _, outVolume, outModel in runOutputs:
+      outArray = slicer.util.arrayFromVolume(outVolume)
+      self.assertEqual(slicer.util.arrayFromVolume(sourceVolume).shape, outArray.shape)
+      self.assertNotEqual(0, np.count_nonzero(outArray))
+      self.assertNotEqual(0, outModel.GetPolyData().GetNumberOfCells())
+
+    # Cropped volumes are removed from the scene, only the output volumes are left
+    self.assertEqual(nVolumes + len(edges), slicer.mrmlScene.GetNumberOfNodesByClass("vtkMRMLScalarVolumeNode"))
+
+    # Concurrent evolutions by batches of two runs give the same volumes
+    concurrentOutputs = logic.extractVesselVolumesInRASBoxes(runs, maxWorkers=2)
+    for (_, _, outVolume, _), (_, _, concurrentVolume, _) in zip(runOutputs, concurrentOutputs):
+      np.testing.assert_array_equal(slicer.util.arrayFromVolume(outVolume),
+                                    slicer.util.arrayFromVolume(concurrentVolume))
+
+  @staticmethod
+  def prepareTubePhantomTree(positions, edges):
+    tree = VesselTreeModel()
+    tree.insertAfterNode("n0", None)
+    for parentId, childId in edges:
+      tree.insertAfterNode(childId, parentId)
+
+    markup = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode")
+    for nodeId, position in positions.items():
+      markup.SetNthControlPointLabel(markup.AddControlPoint(position), nodeId)
+    return tree, markup
+
+  def testExtractOneVesselPerBranchRunsAreExtractedInTheirPlannedBoxes(self):
+    logic, sourceVolume, positions, edges = self.prepareTubePhantomLogic()
+    tree, markup = self.prepareTubePhantomTree(positions, edges)
+
+    strategy = ExtractOneVesselPerBranch(margin=5)
+    outVolume, outModel = strategy.extractVesselVolumeFromVesselBranchTree(tree, markup, logic)
+
+    self.assertNotEqual(0, np.count_nonzero(slicer.util.arrayFromVolume(outVolume)))
+    self.assertNotEqual(0, outModel.GetPolyData().GetNumberOfCells())
+    self.assertEqual(sorted(edges), sorted(edge for runEdges, _ in strategy.getRunPlan() for edge in runEdges))
+
+    # Each run cost is its own box voxel count, smaller than the source volume
+    sourceVoxelCount = np.prod(slicer.util.arrayFromVolume(sourceVolume).shape)
+    self.assertTrue(all(0 < cost < sourceVoxelCount for _, cost in strategy.getRunPlan()))
+
+  def testExtractVesselsByClusterSegmentsEveryBranchOfTree(self):
+    logic, sourceVolume, positions, edges = self.prepareTubePhantomLogic()
+    tree, markup = self.prepareTubePhantomTree(positions, edges)
+
+    # Voxel budget is smaller than any merged branch box which leads to one run per branch
+    strategy = ExtractVesselsByCluster(maxClusterVoxels=10000, margin=5)
+    outVolume, outModel = strategy.extractVesselVolumeFromVesselBranchTree(tree, markup, logic)
+
+    outArray = slicer.util.arrayFromVolume(outVolume)
+    self.assertEqual(slicer.util.arrayFromVolume(sourceVolume).shape, outArray.shape)
+    self.assertNotEqual(0, np.count_nonzero(outArray))
+    self.assertNotEqual(0, outModel.GetPolyData().GetNumberOfCells())
+    self.assertEqual(len(edges), len(strategy.getRunPlan()))
+    self.assertEqual(sorted(edges), sorted(edge for runEdges, _ in strategy.getRunPlan() for edge in runEdges))
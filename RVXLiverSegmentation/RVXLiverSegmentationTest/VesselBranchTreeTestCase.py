@@ -1,7 +1,10 @@
 import unittest
 
+import slicer
+import vtk
+
 from RVXLiverSegmentationLib import VesselBranchTree, PlaceStatus, VesselAdjacencyMatrixExporter, VesselHelpWidget, \
-  VesselHelpType
+  VesselHelpType, TreeDrawer, MarkupNode
 from .TestUtils import FakeMarkupNode, treeSort
 
 
@@ -558,3 +561,83 @@ class VesselBranchTreeTestCase(unittest.TestCase):
 
     getItem("id31").status = PlaceStatus.PLACED
     self.assertEqual(getItem("id12"), branchWidget.getNextUnplacedItem("id31"))
+
+  def testTreeDrawerMovesOnlyPointOfModifiedNode(self):
+    branchWidget = VesselBranchTree(VesselHelpWidget(VesselHelpType.Portal))
+    branchWidget.insertEdges([(None, "id0"), ("id0", "id1"), ("id0", "id2")])
+    markupNode = MarkupNode(slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode"))
+    markupNode.setControlPoints({"id0": [0, 0, 0], "id1": [1, 0, 0], "id2": [0, 1, 0]})
+
+    drawer = TreeDrawer(branchWidget, markupNode)
+    drawer.updateTreeLines()
+    polyData = drawer.getLineModel().GetPolyData()
+    self.assertEqual(3, polyData.GetNumberOfPoints())
+    self.assertEqual(2, polyData.GetNumberOfCells())
+
+    points = polyData.GetPoints()
+    markupNode.SetNthControlPointPosition(0, 5, 5, 5)
+    drawer.updateNodePosition(0)
+    self.assertIs(points, drawer.getLineModel().GetPolyData().GetPoints())
+    self.assertEqual([(5, 5, 5), (1, 0, 0), (0, 1, 0)], [points.GetPoint(i) for i in range(points.GetNumberOfPoints())])
+
+    # Structure modification rebuilds the lines
+    branchWidget.removeNode("id2")
+    drawer.updateNodePosition(1)
+    self.assertEqual(2, drawer.getLineModel().GetPolyData().GetNumberOfPoints())
+
+  def testTreeDrawerConnectsNodesToClosestPlacedAncestorWithBranchScalars(self):
+    branchWidget = VesselBranchTree(VesselHelpWidget(VesselHelpType.Portal))
+    branchWidget.insertEdges([(None, "id0"), ("id0", "id1"), ("id1", "id2"), ("id1", "id3")])
+    markupNode = MarkupNode(slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode"))
+    markupNode.setControlPoints({"id0": [0, 0, 0], "id2": [1, 0, 0], "id3": [0, 1, 0]})
+
+    drawer = TreeDrawer(branchWidget, markupNode)
+    drawer.updateTreeLines()
+    polyData = drawer.getLineModel().GetPolyData()
+
+    def cellPoints(iCell):
+      cellIds = polyData.GetCell(iCell).GetPointIds()
+      return [cellIds.GetId(i) for i in range(cellIds.GetNumberOfIds())]
+
+    self.assertEqual([[0, 1], [0, 2]], [cellPoints(i) for i in range(polyData.GetNumberOfCells())])
+    branchIds = polyData.GetCellData().GetArray(TreeDrawer.branchIdArrayName)
+    depths = polyData.GetCellData().GetArray(TreeDrawer.depthArrayName)
+    self.assertEqual([1, 2], [branchIds.GetValue(i) for i in range(2)])
+    self.assertEqual([2, 2], [depths.GetValue(i) for i in range(2)])
+
+  def testMarkupNodeIndexFollowsControlPointModifications(self):
+    markupNode = MarkupNode(slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode"))
+    markupNode.setControlPoints({"id0": [0, 0, 0], "id1": [1, 0, 0]})
+    self.assertEqual(1, markupNode.getControlPointIndex("id1"))
+    self.assertIsNone(markupNode.getControlPointIndex("id2"))
+
+    markupNode.SetNthControlPointLabel(markupNode.AddControlPoint([0, 2, 0]), "id2")
+    self.assertEqual(2, markupNode.getControlPointIndex("id2"))
+    self.assertEqual((3, 3), markupNode.getControlPointPositions().shape)
+
+    markupNode.SetNthControlPointPosition(0, 3, 3, 3)
+    self.assertEqual([3, 3, 3], markupNode.getControlPointPosition("id0"))
+    self.assertEqual({"id0": [3, 3, 3], "id1": [1, 0, 0], "id2": [0, 2, 0]}, markupNode.getIdPositionDict())
+
+    markupNode.SetNthControlPointLabel(1, "renamed")
+    self.assertEqual(1, markupNode.getControlPointIndex("renamed"))
+    self.assertIsNone(markupNode.getControlPointIndex("id1"))
+
+    markupNode.RemoveAllControlPoints()
+    self.assertEqual({}, markupNode.getIdPositionDict())
+
+  def testMarkupNodeVisibilityIsUpdatedInOneModification(self):
+    markupNode = MarkupNode(slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode"))
+    markupNode.setControlPoints({"id{}".format(i): [i, 0, 0] for i in range(100)})
+    modifiedEvents = []
+    obsId = markupNode.GetSlicerNode().AddObserver(vtk.vtkCommand.ModifiedEvent, lambda *x: modifiedEvents.append(x))
+
+    markupNode.setControlPointsVisibility({"id1", "id50"})
+    markupNode.GetSlicerNode().RemoveObserver(obsId)
+
+    self.assertEqual(1, len(modifiedEvents))
+    self.assertEqual([False, False], [bool(markupNode.GetNthFiducialVisibility(i)) for i in [1, 50]])
+    self.assertTrue(markupNode.GetNthFiducialVisibility(2))
+
+    markupNode.setControlPointsVisibility(set(), isVisible=False)
+    self.assertFalse(any(markupNode.GetNthFiducialVisibility(i) for i in range(100)))
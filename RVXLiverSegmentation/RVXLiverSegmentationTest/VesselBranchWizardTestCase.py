@@ -4,7 +4,7 @@ import unittest
 
 from RVXLiverSegmentationLib import VesselBranchTree, VesselBranchWizard, VeinId, VesselTreeColumnRole, \
   setup_portal_vein_default_branch, MarkupNode, TreeDrawer, INodePlaceWidget, InteractionStatus, VesselHelpWidget, \
-  VesselHelpType
+  VesselHelpType, PlaceStatus
 from .TestUtils import treeSort
 
 
@@ -264,6 +264,101 @@ class VesselBranchWizardTestCase(unittest.TestCase):
     # Expect second node id to be present 3 times in tree
     self.assertNTimesInTree(VeinId.rightPortalVein, 3)
 
+  def test_branch_paths_go_from_parent_branch_to_branch_through_inserted_nodes(self):
+    # Place first and second nodes and insert two nodes before second node
+    self.click_first_element()
+    self.nodePlace.placeNode()
+    self.nodePlace.placeNode()
+    self.click_second_element()
+    self.wizard.onInsertBeforeNode()
+    self.nodePlace.placeNode()
+    self.nodePlace.placeNode()
+
+    # Expect the right portal vein path to contain portal vein, the two inserted nodes and right portal vein
+    branchPaths = dict(self.wizard.getVesselBranches().branchPaths())
+    self.assertEqual(4, len(branchPaths[VeinId.rightPortalVein]))
+    self.assertNotIn(VeinId.leftPortalVein, branchPaths)
+
   def assertNTimesInTree(self, veinId, ntimes):
     nodeIds = filter(lambda x: veinId in x, self.tree.getNodeList())
     self.assertEqual(ntimes, len(list(nodeIds)))
+
+  def test_loading_tree_replaces_tree_and_markups(self):
+    treeParentList = [[None, "RootId"], ["RootId", "ChildId"], ["RootId", "OtherChildId"]]
+    statusDict = {"RootId": PlaceStatus.PLACED, "ChildId": PlaceStatus.PLACED, "OtherChildId": PlaceStatus.NOT_PLACED}
+    idPositionDict = {"RootId": [0, 0, 0], "ChildId": [1, 2, 3]}
+    self.wizard.loadTree(treeParentList, statusDict, idPositionDict)
+
+    self.assertEqual(treeSort(treeParentList), treeSort(self.tree.getTreeParentList()))
+    self.assertEqual(2, self.markupNode.GetNumberOfControlPoints())
+    self.assertEqual(["RootId", "ChildId"], [self.markupNode.GetNthControlPointLabel(i) for i in range(2)])
+    self.assertEqual(PlaceStatus.NOT_PLACED, self.tree.getStatus("OtherChildId"))
+
+  def test_undo_and_redo_revert_and_apply_node_deletion(self):
+    self.markupNode.setControlPoints({VeinId.portalVein: [1, 2, 3]})
+    self.tree.getTreeWidgetItem(VeinId.portalVein).status = PlaceStatus.PLACED
+    expTree = self.tree.getTreeParentList()
+
+    self.tree.itemClicked.emit(self.tree.getTreeWidgetItem(VeinId.portalVein), VesselTreeColumnRole.DELETE)
+    self.assertFalse(self.tree.isInTree(VeinId.portalVein))
+    self.assertFalse(self.markupNode.GetNthFiducialVisibility(0))
+
+    self.wizard.undo()
+    self.assertEqual(expTree, self.tree.getTreeParentList())
+    self.assertEqual(PlaceStatus.PLACED, self.tree.getStatus(VeinId.portalVein))
+    self.assertTrue(self.markupNode.GetNthFiducialVisibility(0))
+
+    self.wizard.redo()
+    self.assertFalse(self.tree.isInTree(VeinId.portalVein))
+    self.assertFalse(self.wizard.getJournal().canRedo())
+
+  def test_redo_of_placed_node_insertion_keeps_node_placed(self):
+    self.tree.insertAfterNode("NewId", VeinId.portalVein)
+    self.markupNode.setControlPoints({"NewId": [1, 2, 3]})
+    self.tree.getTreeWidgetItem("NewId").status = PlaceStatus.PLACED
+
+    self.wizard.undo()
+    self.assertFalse(self.tree.isInTree("NewId"))
+    self.assertFalse(self.markupNode.GetNthFiducialVisibility(0))
+
+    self.wizard.redo()
+    self.assertEqual(PlaceStatus.PLACED, self.tree.getStatus("NewId"))
+    self.assertTrue(self.markupNode.GetNthFiducialVisibility(0))
+    self.assertEqual(1, self.markupNode.GetNumberOfControlPoints())
+
+  def test_only_points_moved_during_edit_are_recorded(self):
+    self.markupNode.setControlPoints({VeinId.portalVein: [1, 2, 3], VeinId.rightPortalVein: [4, 5, 6]})
+    self.wizard.onEditNode(True)
+    self.markupNode.SetNthControlPointPosition(1, 7, 8, 9)
+    self.markupNode.pointInteractionEnded.emit(1)
+
+    self.wizard.undo()
+    position = [0] * 3
+    self.markupNode.GetNthControlPointPosition(1, position)
+    self.assertEqual([4, 5, 6], position)
+    self.assertFalse(self.wizard.getJournal().canUndo())
+
+  def test_undo_reverts_node_moves(self):
+    self.markupNode.setControlPoints({VeinId.portalVein: [1, 2, 3]})
+    self.wizard.getJournal().recordNodeMoves({VeinId.portalVein: [1, 2, 3]}, {VeinId.portalVein: [4, 5, 6]})
+
+    self.wizard.undo()
+    position = [0] * 3
+    self.markupNode.GetNthControlPointPosition(0, position)
+    self.assertEqual([1, 2, 3], position)
+
+  def test_point_modified_bursts_are_coalesced_in_one_redraw(self):
+    self.treeDrawer.updateNodePosition = Mock()
+    dispatcher = self.wizard.getPointModifiedDispatcher()
+    flushed = []
+    dispatcher.flushed.connect(lambda keys, eventCount: flushed.append((keys, eventCount)))
+
+    for _ in range(10):
+      self.markupNode.pointModified.emit(0)
+    self.assertEqual(0, self.treeDrawer.updateNodePosition.call_count)
+
+    dispatcher.flush()
+    self.assertEqual(1, self.treeDrawer.updateNodePosition.call_count)
+    self.assertEqual([([0], 10)], flushed)
+    self.assertEqual(9, dispatcher.coalescedEventCount)
+    self.assertFalse(dispatcher.hasPendingEvents())
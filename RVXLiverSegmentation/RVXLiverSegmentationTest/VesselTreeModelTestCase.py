@@ -0,0 +1,395 @@
+import json
+import os
+import sys
+import unittest
+
+import numpy as np
+import qt
+
+from RVXLiverSegmentationLib import VesselTreeModel, VesselBranchTree, PlaceStatus, VesselHelpWidget, VesselHelpType, \
+  preorderNodeIds, postorderNodeIds, eulerTourNodeIds, branchChains, ExtractOneVesselPerBranch, saveVesselTree, \
+  loadVesselTree, VesselTreeItemModel, VesselTreeView, VesselTreeColumnRole
+from .TestUtils import treeSort, TemporaryDir
+
+
+def createTreeModel():
+  # ParentId
+  #     |_ Child1Id
+  #             |_ SubChild1Id
+  #     |_ Child2Id
+  model = VesselTreeModel()
+  model.insertAfterNode("ParentId", None)
+  model.insertAfterNode("Child1Id", "ParentId")
+  model.insertAfterNode("Child2Id", "ParentId")
+  model.insertAfterNode("SubChild1Id", "Child1Id")
+  return model
+
+
+class VesselTreeModelTestCase(unittest.TestCase):
+  def testModelStructureCanBeQueriedWithoutWidget(self):
+    model = createTreeModel()
+
+    self.assertEqual("ParentId", model.getRootNodeId())
+    self.assertEqual("ParentId", model.getParentNodeId("Child1Id"))
+    self.assertEqual(["Child1Id", "Child2Id"], model.getChildrenNodeId("ParentId"))
+    self.assertTrue(model.isLeaf("SubChild1Id"))
+    self.assertTrue(model.isRoot("ParentId"))
+    self.assertEqual([[None, "ParentId"], ["ParentId", "Child1Id"], ["ParentId", "Child2Id"],
+                      ["Child1Id", "SubChild1Id"]], model.getTreeParentList())
+
+  def testInsertBeforeNodeAddsNodeBetweenParentAndNode(self):
+    model = createTreeModel()
+    model.insertBeforeNode("InsertedId", "Child1Id")
+
+    expTree = [[None, "ParentId"], ["ParentId", "Child2Id"], ["ParentId", "InsertedId"], ["InsertedId", "Child1Id"],
+               ["Child1Id", "SubChild1Id"]]
+    self.assertEqual(treeSort(expTree), treeSort(model.getTreeParentList()))
+
+  def testRemovingIntermediateNodeConnectsChildrenToParent(self):
+    model = createTreeModel()
+    self.assertTrue(model.removeNode("Child1Id"))
+    self.assertEqual(["Child2Id", "SubChild1Id"], model.getChildrenNodeId("ParentId"))
+    self.assertFalse(model.isInTree("Child1Id"))
+
+  def testRemovingRootWithMultipleChildrenDoesNothing(self):
+    model = createTreeModel()
+    self.assertFalse(model.removeNode("ParentId"))
+    self.assertEqual("ParentId", model.getRootNodeId())
+
+  def testInsertingAfterUnknownParentRaisesValueError(self):
+    model = createTreeModel()
+    with self.assertRaises(ValueError):
+      model.insertAfterNode("NodeId", "UnknownId")
+
+  def testModelNotifiesModifications(self):
+    model = VesselTreeModel()
+    calls = []
+    model.nodeInserted.connect(lambda nodeId: calls.append(("inserted", nodeId)))
+    model.nodeRemoved.connect(lambda nodeId: calls.append(("removed", nodeId)))
+    model.statusChanged.connect(lambda nodeId, status: calls.append(("status", nodeId, status)))
+
+    model.insertAfterNode("NodeId", None)
+    model.setStatus("NodeId", PlaceStatus.PLACED)
+    model.setStatus("NodeId", PlaceStatus.PLACED)
+    model.removeNode("NodeId")
+    self.assertEqual([("inserted", "NodeId"), ("status", "NodeId", PlaceStatus.PLACED), ("removed", "NodeId")], calls)
+
+  def testNextUnplacedNodeIsSearchedInDepthFirstOrder(self):
+    model = createTreeModel()
+    model.setStatus("ParentId", PlaceStatus.PLACED)
+    model.setStatus("Child1Id", PlaceStatus.PLACED)
+    self.assertEqual("SubChild1Id", model.getNextUnplacedNodeId("ParentId"))
+
+    model.setStatus("SubChild1Id", PlaceStatus.PLACED)
+    self.assertEqual("Child2Id", model.getNextUnplacedNodeId("SubChild1Id"))
+
+  def testNextUnplacedNodeFollowsStructureModifications(self):
+    model = createTreeModel()
+    for nodeId in model.getNodeList():
+      model.setStatus(nodeId, PlaceStatus.PLACED)
+    self.assertIsNone(model.getNextUnplacedNodeId("SubChild1Id"))
+
+    model.insertAfterNode("SubChild2Id", "Child1Id")
+    self.assertEqual("SubChild2Id", model.getNextUnplacedNodeId("SubChild1Id"))
+    self.assertIsNone(model.getNextUnplacedNodeId("Child2Id"))
+
+  def testTreeWidgetIsSynchronizedWithModel(self):
+    model = createTreeModel()
+    tree = VesselBranchTree(VesselHelpWidget(VesselHelpType.Portal), treeModel=model)
+    self.assertEqual(model.getTreeParentList(), tree.getTreeParentList())
+    self.assertEqual(2, tree.getTreeWidgetItem("ParentId").childCount())
+
+    model.removeNode("Child1Id")
+    self.assertIsNone(tree.getTreeWidgetItem("Child1Id"))
+    self.assertEqual(2, tree.getTreeWidgetItem("ParentId").childCount())
+
+    tree.getTreeWidgetItem("Child2Id").status = PlaceStatus.PLACED
+    self.assertEqual(PlaceStatus.PLACED, model.getStatus("Child2Id"))
+    self.assertEqual("Child2Id", tree.getText("Child2Id"))
+
+  def testTreeWidgetItemMovesAreWrittenToModel(self):
+    model = createTreeModel()
+    tree = VesselBranchTree(VesselHelpWidget(VesselHelpType.Portal), treeModel=model)
+
+    # Move sub child to root level as a drag and drop would
+    subChild = tree.getTreeWidgetItem("SubChild1Id")
+    tree.getTreeWidgetItem("Child1Id").removeChild(subChild)
+    tree.addTopLevelItem(subChild)
+    tree.enforceOneRoot()
+
+    self.assertEqual("SubChild1Id", model.getRootNodeId())
+    self.assertEqual("SubChild1Id", model.getParentNodeId("ParentId"))
+    self.assertTrue(model.isLeaf("Child1Id"))
+
+  def testTraversalsFollowChildrenOrder(self):
+    model = createTreeModel()
+    self.assertEqual(["ParentId", "Child1Id", "SubChild1Id", "Child2Id"], preorderNodeIds(model))
+    self.assertEqual(["SubChild1Id", "Child1Id", "Child2Id", "ParentId"], postorderNodeIds(model))
+    self.assertEqual(["ParentId", "Child1Id", "SubChild1Id", "Child1Id", "ParentId", "Child2Id", "ParentId"],
+                     eulerTourNodeIds(model))
+    self.assertEqual([["ParentId", "Child1Id", "SubChild1Id"], ["ParentId", "Child2Id"]], branchChains(model))
+    self.assertEqual(["Child1Id", "SubChild1Id"], preorderNodeIds(model, "Child1Id"))
+
+  def testTraversalsOfEmptyTreeAreEmpty(self):
+    model = VesselTreeModel()
+    self.assertEqual([], preorderNodeIds(model))
+    self.assertEqual([], eulerTourNodeIds(model))
+    self.assertEqual([], branchChains(model))
+    self.assertEqual([], model.getTreeParentList())
+
+  def testTraversalsOfTreesDeeperThanRecursionLimitDoNotFail(self):
+    depth = sys.getrecursionlimit() * 2
+    model = VesselTreeModel()
+    model.insertAfterNode("0", None)
+    for i in range(1, depth):
+      model.insertAfterNode(str(i), str(i - 1))
+    model.insertAfterNode("Sibling", "0")
+
+    self.assertEqual(depth + 1, len(preorderNodeIds(model)))
+    self.assertEqual(depth + 1, len(model.getTreeParentList()))
+    self.assertEqual(2, len(branchChains(model)))
+    self.assertEqual(str(depth - 1), model.getNextUnplacedNodeId(str(depth - 1)))
+
+    idPositionDict = {nodeId: [0, 0, 0] for nodeId in model.getNodeList()}
+    seeds = ExtractOneVesselPerBranch().constructVesselSeedList(model, idPositionDict)
+    self.assertEqual([depth - 1, 1], [len(seed.getEdgeIds()) for seed in seeds])
+
+  def testDerivedViewsAreCachedUntilNextStructureModification(self):
+    model = createTreeModel()
+    version = model.getVersion()
+    self.assertEqual(frozenset(["SubChild1Id", "Child2Id"]), model.getLeafNodeIds())
+    self.assertIs(model.getLeafNodeIds(), model.getLeafNodeIds())
+
+    model.setStatus("ParentId", PlaceStatus.PLACED)
+    self.assertEqual(version, model.getVersion())
+
+    model.insertAfterNode("SubChild2Id", "Child2Id")
+    self.assertEqual(version + 1, model.getVersion())
+    self.assertEqual(frozenset(["SubChild1Id", "SubChild2Id"]), model.getLeafNodeIds())
+    self.assertEqual([["ParentId", "Child1Id", "SubChild1Id"], ["ParentId", "Child2Id", "SubChild2Id"]],
+                     model.getBranchChains())
+    self.assertIn(["Child2Id", "SubChild2Id"], model.getTreeParentList())
+
+  def testReturnedAdjacentListDoesNotModifyCache(self):
+    model = createTreeModel()
+    model.getTreeParentList().append([None, "Other"])
+    model.getTreeParentList()[0][1] = "Other"
+    model.getBranchChains()[0].append("Other")
+    self.assertEqual(4, len(model.getTreeParentList()))
+    self.assertEqual([None, "ParentId"], model.getTreeParentList()[0])
+    self.assertEqual(["ParentId", "Child1Id", "SubChild1Id"], model.getBranchChains()[0])
+
+  def testBulkEdgeInsertionIsEquivalentToSequentialInsertionAndNotifiesOnce(self):
+    edges = [(None, "ParentId"), ("ParentId", "Child1Id"), ("ParentId", "Child2Id"), ("Child1Id", "SubChild1Id")]
+    model = VesselTreeModel()
+    modifiedCalls = []
+    model.modified.connect(lambda: modifiedCalls.append(model.getVersion()))
+    model.insertEdges(edges)
+
+    self.assertEqual(createTreeModel().getTreeParentList(), model.getTreeParentList())
+    self.assertEqual(1, len(modifiedCalls))
+
+  def testBulkEdgeInsertionWithUnknownParentRaisesValueError(self):
+    model = VesselTreeModel()
+    with self.assertRaises(ValueError):
+      model.insertEdges([(None, "ParentId"), ("UnknownId", "ChildId")])
+    self.assertEqual(["ParentId"], list(model.getNodeList()))
+
+  def testBulkEdgeInsertionInTreeWidgetBuildsItemsOnce(self):
+    tree = VesselBranchTree(VesselHelpWidget(VesselHelpType.Portal))
+    rebuildCalls = []
+    tree.getTreeModel().modified.connect(lambda: rebuildCalls.append(True))
+
+    edges = [(None, "0")] + [(str((i - 1) // 2), str(i)) for i in range(1, 200)]
+    tree.insertEdges(edges)
+
+    self.assertEqual(1, len(rebuildCalls))
+    self.assertEqual(200, len(tree.getNodeList()))
+    self.assertEqual(2, tree.getTreeWidgetItem("0").childCount())
+    self.assertTrue(tree.getTreeWidgetItem("199").parent().isExpanded())
+
+  def testTreeWidgetItemsKeepCollapsedStateOnNodeInsertionAndRemoval(self):
+    tree = VesselBranchTree(VesselHelpWidget(VesselHelpType.Portal))
+    tree.insertEdges([(None, "0"), ("0", "1"), ("0", "2"), ("1", "3"), ("2", "4")])
+    tree.getTreeWidgetItem("1").setExpanded(False)
+
+    tree.insertAfterNode("5", "2")
+    tree.insertBeforeNode("6", "4")
+    tree.removeNode("2")
+
+    self.assertFalse(tree.getTreeWidgetItem("1").isExpanded())
+    self.assertTrue(tree.getTreeWidgetItem("6").isExpanded())
+    self.assertIsNone(tree.getTreeWidgetItem("2"))
+    self.assertEqual(["1", "6", "5"], [tree.getTreeWidgetItem("0").child(i).nodeId for i in range(3)])
+    self.assertEqual("4", tree.getTreeWidgetItem("6").child(0).nodeId)
+
+  def testSavedTreeCanBeLoadedWithStatusAndPositions(self):
+    model = createTreeModel()
+    model.setStatus("ParentId", PlaceStatus.PLACED)
+    model.setStatus("Child1Id", PlaceStatus.INSERT_BEFORE)
+    model.setStatus("Child2Id", PlaceStatus.PLACING)
+    idPositionDict = {"ParentId": [1.5, 2.0, -3.0], "Child1Id": [4.0, 5.0, 6.0]}
+
+    with TemporaryDir() as outputDir:
+      filePath = os.path.join(outputDir, "tree.rvxtree")
+      saveVesselTree(filePath, model, idPositionDict)
+      treeParentList, statusDict, loadedPositions = loadVesselTree(filePath)
+
+    self.assertEqual(model.getTreeParentList(), treeParentList)
+    self.assertEqual({"ParentId": PlaceStatus.PLACED, "Child1Id": PlaceStatus.PLACED,
+                      "Child2Id": PlaceStatus.NOT_PLACED, "SubChild1Id": PlaceStatus.NOT_PLACED}, statusDict)
+    self.assertEqual(idPositionDict, loadedPositions)
+
+    loadedModel = VesselTreeModel()
+    loadedModel.setTreeParentList(treeParentList, statusDict)
+    self.assertEqual(model.getTreeParentList(), loadedModel.getTreeParentList())
+    self.assertEqual(PlaceStatus.PLACED, loadedModel.getStatus("Child1Id"))
+
+  def testLoadingInvalidOrNewerTreeFileRaisesValueError(self):
+    with TemporaryDir() as outputDir:
+      filePath = os.path.join(outputDir, "tree.rvxtree")
+      with open(filePath, "w") as f:
+        f.write("not a tree\n")
+      with self.assertRaises(ValueError):
+        loadVesselTree(filePath)
+
+      with open(filePath, "w") as f:
+        f.write('{"format": "RVXVesselTree", "version": 1000, "nodeIds": [], "parentIndices": [], "status": []}\n')
+      with self.assertRaises(ValueError):
+        loadVesselTree(filePath)
+
+  def testLoadingTreeFileWithInconsistentHeaderRaisesValueError(self):
+    validHeader = {"format": "RVXVesselTree", "version": 1, "nodeIds": ["a"], "parentIndices": [-1], "status": [0]}
+    invalidHeaders = [dict(validHeader, **{key: value}) for key, value in
+                      [("parentIndices", []), ("status", []), ("parentIndices", [3])]]
+    invalidHeaders += [{k: v for k, v in validHeader.items() if k != key} for key in ("version", "parentIndices")]
+
+    with TemporaryDir() as outputDir:
+      filePath = os.path.join(outputDir, "tree.rvxtree")
+      for header in invalidHeaders:
+        with open(filePath, "wb") as f:
+          f.write(json.dumps(header).encode("utf-8") + b"\n" + np.zeros(3, dtype="<f8").tobytes())
+        with self.assertRaises(ValueError):
+          loadVesselTree(filePath)
+
+  def testLoadingTreeFileWithChildrenBeforeParentsKeepsStructure(self):
+    header = {"format": "RVXVesselTree", "version": 1, "nodeIds": ["SubChild1Id", "Child1Id", "Child2Id", "ParentId"],
+              "parentIndices": [1, 3, 3, -1], "status": [0, 0, 0, 0]}
+
+    with TemporaryDir() as outputDir:
+      filePath = os.path.join(outputDir, "tree.rvxtree")
+      with open(filePath, "wb") as f:
+        f.write(json.dumps(header).encode("utf-8") + b"\n" + np.zeros(12, dtype="<f8").tobytes())
+      treeParentList, _, _ = loadVesselTree(filePath)
+
+    model = VesselTreeModel()
+    model.setTreeParentList(treeParentList)
+    self.assertEqual(treeSort(createTreeModel().getTreeParentList()), treeSort(model.getTreeParentList()))
+    self.assertEqual(["ParentId"], list(model.getRootNodeIds()))
+
+  def testLoadingTreeFileWithParentCycleRaisesValueError(self):
+    header = {"format": "RVXVesselTree", "version": 1, "nodeIds": ["a", "b", "c"], "parentIndices": [-1, 2, 1],
+              "status": [0, 0, 0]}
+
+    with TemporaryDir() as outputDir:
+      filePath = os.path.join(outputDir, "tree.rvxtree")
+      with open(filePath, "wb") as f:
+        f.write(json.dumps(header).encode("utf-8") + b"\n" + np.zeros(9, dtype="<f8").tobytes())
+      with self.assertRaises(ValueError):
+        loadVesselTree(filePath)
+
+  def testEditsOnlyHoldTouchedNodes(self):
+    model = createTreeModel()
+    edits = []
+    model.edited.connect(edits.append)
+
+    model.insertBeforeNode("InsertedId", "SubChild1Id")
+    self.assertEqual(1, len(edits))
+    self.assertEqual(sorted(["InsertedId", "SubChild1Id", "Child1Id"]), sorted(edits[0].getNodeIds()))
+
+    model.setTreeParentList([[None, "ParentId"], ["ParentId", "Child1Id"], ["ParentId", "Child2Id"],
+                             ["Child2Id", "InsertedId"], ["InsertedId", "SubChild1Id"]])
+    self.assertEqual(sorted(["Child1Id", "Child2Id", "InsertedId"]), sorted(edits[1].getNodeIds()))
+
+  def testAppliedEditsRestoreStructureBeforeAndAfterEdit(self):
+    model = createTreeModel()
+    model.setStatus("Child1Id", PlaceStatus.PLACED)
+    expTree = model.getTreeParentList()
+    edits = []
+    model.edited.connect(edits.append)
+
+    model.removeNode("Child1Id")
+    removedTree = model.getTreeParentList()
+
+    model.applyEdit(edits[0], undo=True)
+    self.assertEqual(expTree, model.getTreeParentList())
+    self.assertEqual(PlaceStatus.PLACED, model.getStatus("Child1Id"))
+
+    model.applyEdit(edits[0])
+    self.assertEqual(removedTree, model.getTreeParentList())
+    self.assertEqual(1, len(edits))
+
+  def testItemModelExposesLargeFlatTreeByBatches(self):
+    model = VesselTreeModel()
+    model.insertEdges([(None, "Root")] + [("Root", "Child{}".format(i)) for i in range(5000)])
+    itemModel = VesselTreeItemModel(VesselHelpWidget(VesselHelpType.Portal), model)
+
+    rootIndex = itemModel.index(0, 0)
+    self.assertEqual("Root", itemModel.nodeId(rootIndex))
+    self.assertEqual(VesselTreeItemModel.fetchBatchSize, itemModel.rowCount(rootIndex))
+    self.assertTrue(itemModel.canFetchMore(rootIndex))
+
+    itemModel.fetchMore(rootIndex)
+    self.assertEqual(2 * VesselTreeItemModel.fetchBatchSize, itemModel.rowCount(rootIndex))
+
+    lastIndex = itemModel.indexOfNode("Child4999")
+    self.assertEqual(4999, lastIndex.row())
+    self.assertEqual(5000, itemModel.rowCount(rootIndex))
+    self.assertEqual("Root", itemModel.nodeId(itemModel.parent(lastIndex)))
+
+  def testItemModelDataFollowsTreeModel(self):
+    model = createTreeModel()
+    itemModel = VesselTreeItemModel(VesselHelpWidget(VesselHelpType.Portal), model)
+    child2Index = itemModel.indexOfNode("Child2Id")
+    self.assertEqual(1, child2Index.row())
+    self.assertIn("start placing", itemModel.data(child2Index, qt.Qt.DisplayRole))
+
+    model.setStatus("Child2Id", PlaceStatus.PLACED)
+    self.assertEqual("Child2Id", itemModel.data(child2Index, qt.Qt.DisplayRole))
+    self.assertIn("img", itemModel.data(child2Index, qt.Qt.ToolTipRole))
+
+    model.removeNode("Child1Id")
+    self.assertEqual(["Child2Id", "SubChild1Id"],
+                     [itemModel.nodeId(itemModel.index(i, 0, itemModel.index(0, 0))) for i in range(2)])
+
+  def testItemModelForwardsNodeInsertionAndRemovalAsRowChanges(self):
+    model = createTreeModel()
+    itemModel = VesselTreeItemModel(VesselHelpWidget(VesselHelpType.Portal), model)
+    rootIndex = itemModel.indexOfNode("ParentId")
+    self.assertEqual(2, itemModel.rowCount(rootIndex))
+
+    calls = []
+    itemModel.connect("modelReset()", lambda: calls.append("reset"))
+    itemModel.connect("rowsInserted(QModelIndex, int, int)", lambda parent, first, last: calls.append("inserted"))
+    itemModel.connect("rowsRemoved(QModelIndex, int, int)", lambda parent, first, last: calls.append("removed"))
+
+    model.insertAfterNode("Child3Id", "ParentId")
+    model.insertBeforeNode("InsertedId", "Child2Id")
+    model.removeNode("Child1Id")
+
+    self.assertNotIn("reset", calls)
+    self.assertEqual(["Child3Id", "InsertedId", "SubChild1Id"],
+                     [itemModel.nodeId(itemModel.index(i, 0, rootIndex)) for i in range(itemModel.rowCount(rootIndex))])
+    self.assertEqual("Child2Id", itemModel.nodeId(itemModel.index(0, 0, itemModel.indexOfNode("InsertedId"))))
+
+  def testTreeViewSignalsClickedNodeId(self):
+    view = VesselTreeView(VesselHelpWidget(VesselHelpType.Portal), createTreeModel())
+    clicked = []
+    view.nodeClicked.connect(lambda nodeId, column: clicked.append((nodeId, column)))
+
+    view.setCurrentNodeId("SubChild1Id")
+    self.assertEqual("SubChild1Id", view.getCurrentNodeId())
+
+    index = view.getItemModel().indexOfNode("Child2Id", VesselTreeColumnRole.DELETE)
+    view.clicked(index)
+    self.assertEqual([("Child2Id", VesselTreeColumnRole.DELETE)], clicked)
@@ -0,0 +1,97 @@
+import time
+import unittest
+
+import numpy as np
+import slicer
+from vtk.util.numpy_support import vtk_to_numpy
+
+from RVXLiverSegmentationLib import RVXLiverSegmentationLogic, skeletonCenterlinePaths, extractSkeletonCenterline, \
+  isPythonModuleFound
+from RVXLiverSegmentationLib.VoxelSkeletonCenterline import skeletonAdjacency, skeletonizationModuleName
+
+
+def distanceToSegment(points, start, end):
+  start, end = np.asarray(start, dtype=float), np.asarray(end, dtype=float)
+  segment = end - start
+  t = np.clip(np.dot(points - start, segment) / np.dot(segment, segment), 0, 1)
+  return np.linalg.norm(points - (start + t[:, np.newaxis] * segment), axis=1)
+
+
+def distanceToAxes(points, axes):
+  return np.min([distanceToSegment(points, start, end) for start, end in axes], axis=0)
+
+
+def createTubePhantom(shape, axes, radius):
+  """Creates a KJI boolean mask of tubes with given radius around the given IJK axes"""
+  kji = np.indices(shape).reshape(3, -1).T
+  distance = distanceToAxes(kji[:, ::-1].astype(float), axes)
+  return (distance <= radius).reshape(shape)
+
+
+@unittest.skipUnless(isPythonModuleFound(skeletonizationModuleName), "scikit-image is not installed")
+class VoxelSkeletonCenterlineTestCase(unittest.TestCase):
+  def setUp(self):
+    """ Clear scene before each tests
+    """
+    slicer.mrmlScene.Clear(0)
+
+    # Y shaped phantom with identity IJK to RAS
+    self.root = [30, 30, 5]
+    self.junction = [30, 30, 30]
+    self.leaves = [[15, 30, 55], [45, 30, 55]]
+    self.axes = [(self.root, self.junction)] + [(self.junction, leaf) for leaf in self.leaves]
+    self.phantom = createTubePhantom((60, 60, 60), self.axes, radius=4)
+
+  def testSkeletonAdjacencyUses26Connectivity(self):
+    skeletonKji = np.array([[0, 0, 0], [1, 1, 1], [2, 2, 2], [5, 5, 5]])
+    adjacency = skeletonAdjacency(skeletonKji)
+    self.assertEqual([1], list(adjacency[0]))
+    self.assertEqual([0, 2], sorted(adjacency[1]))
+    self.assertEqual([], list(adjacency[3]))
+
+  def testSkeletonPathsAreSplitAtJunctionAndCloseToPhantomAxes(self):
+    paths = skeletonCenterlinePaths(self.phantom, np.eye(4), [self.root], self.leaves)
+
+    self.assertEqual(3, len(paths))
+    self.assertLess(np.max(distanceToAxes(np.concatenate(paths), self.axes)), 2.0)
+
+  def testSkeletonSpursNotLeadingToLeavesArePruned(self):
+    # Add a short bump on the trunk side
+    bump = createTubePhantom(self.phantom.shape, [([30, 30, 15], [37, 30, 15])], radius=2)
+    paths = skeletonCenterlinePaths(self.phantom | bump, np.eye(4), [self.root], self.leaves)
+
+    self.assertEqual(3, len(paths))
+    self.assertLess(np.max(distanceToAxes(np.concatenate(paths), self.axes)), 2.0)
+
+  def testLeavesOutsideOfSkeletonComponentAreIgnored(self):
+    isolated = createTubePhantom(self.phantom.shape, [([5, 5, 40], [5, 5, 55])], radius=2)
+    paths = skeletonCenterlinePaths(self.phantom | isolated, np.eye(4), [self.root], self.leaves + [[5, 5, 55]])
+    self.assertEqual(3, len(paths))
+
+  def testSkeletonCenterlineIsAsAccurateAsVmtkOnPhantom(self):
+    labelMap = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
+    slicer.util.updateVolumeFromArray(labelMap, self.phantom.astype(np.uint8))
+
+    skeletonModel = extractSkeletonCenterline(labelMap, [self.root], self.leaves)
+    surfaceModel = RVXLiverSegmentationLogic.createVolumeBoundaryModel(labelMap, "PhantomModel", threshold=1)
+    vmtkModel = RVXLiverSegmentationLogic.centerLineFilterFromNodePositions(surfaceModel, [self.root], self.leaves)
+
+    skeletonError = distanceToAxes(vtk_to_numpy(skeletonModel.GetPolyData().GetPoints().GetData()), self.axes)
+    vmtkError = distanceToAxes(vtk_to_numpy(vmtkModel.GetPolyData().GetPoints().GetData()), self.axes)
+    self.assertLess(np.mean(skeletonError), np.mean(vmtkError) + 1.0)
+
+  def testSkeletonCenterlineIsFasterThanVmtkOnPhantom(self):
+    labelMap = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
+    slicer.util.updateVolumeFromArray(labelMap, self.phantom.astype(np.uint8))
+    surfaceModel = RVXLiverSegmentationLogic.createVolumeBoundaryModel(labelMap, "PhantomModel", threshold=1)
+
+    # Both modes start from an existing tree representation, the surface creation is not timed
+    start = time.perf_counter()
+    extractSkeletonCenterline(labelMap, [self.root], self.leaves)
+    skeletonTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    RVXLiverSegmentationLogic.centerLineFilterFromNodePositions(surfaceModel, [self.root], self.leaves)
+    vmtkTime = time.perf_counter() - start
+
+    self.assertLess(skeletonTime, vmtkTime)
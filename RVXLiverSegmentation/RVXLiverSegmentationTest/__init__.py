@@ -3,3 +3,6 @@ from .ModuleLogicTestCase import RVXLiverSegmentationTestCase
 from .VesselBranchTreeTestCase import VesselBranchTreeTestCase
 from .VesselBranchWizardTestCase import VesselBranchWizardTestCase
 from .VesselSegmentEditWidgetTestCase import VesselSegmentEditWidgetTestCase
+from .VoxelSkeletonCenterlineTestCase import VoxelSkeletonCenterlineTestCase
+from .MinimalPathCenterlineTestCase import MinimalPathCenterlineTestCase
+from .VesselTreeModelTestCase import VesselTreeModelTestCase